@@ -2,32 +2,38 @@
 Comic Generator Flask Application
 Main entry point - registers all Blueprints
 """
-import logging
+import os
+from dotenv import load_dotenv
 from flask import Flask
 from flask_cors import CORS
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Output to console
-    ]
-)
+load_dotenv()
+
+# Configure logging: LOG_LEVEL (default INFO); records are truncated,
+# redacted and written by a background thread
+from core.logging_config import configure_logging
+
+configure_logging()
 
 
 # Configure Flask with explicit static folder
 app = Flask(__name__, static_folder='static', static_url_path='/static')
-CORS(app)  # Enable CORS for frontend requests
+# Let a fronting server (nginx/Apache) stream image files when configured
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() in ('1', 'true', 'yes')
+CORS(app, expose_headers=['X-Cache', 'X-Run-Id', 'Idempotent-Replayed'])  # Enable CORS for frontend requests
 
 # Register blueprints
-from controllers import comic_bp, image_bp, social_bp, prompt_bp, session_bp
+from controllers import comic_bp, image_bp, social_bp, prompt_bp, session_bp, pipeline_bp, job_bp, media_bp, ops_bp
 
 app.register_blueprint(comic_bp)
 app.register_blueprint(image_bp)
 app.register_blueprint(social_bp)
 app.register_blueprint(prompt_bp)
 app.register_blueprint(session_bp)
+app.register_blueprint(pipeline_bp)
+app.register_blueprint(job_bp)
+app.register_blueprint(media_bp)
+app.register_blueprint(ops_bp)
 
 
 if __name__ == '__main__':
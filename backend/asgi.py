@@ -0,0 +1,20 @@
+"""
+Comic Generator ASGI application
+
+Async serving mode: the provider-bound endpoints (/api/generate,
+/api/generate-image, /api/generate-cover) run as coroutines on the
+provider SDKs' async clients, so hundreds of in-flight model calls share
+one event loop instead of holding a thread each. Every other route is
+served by the Flask app through a WSGI bridge.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5003
+"""
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import app as flask_app
+from controllers.async_controller import async_routes
+
+app = Starlette(routes=async_routes + [Mount('/', app=WSGIMiddleware(flask_app))])
@@ -0,0 +1 @@
+# Offline benchmark harness: fake Gemini/OpenAI provider and load driver
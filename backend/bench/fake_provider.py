@@ -0,0 +1,363 @@
+"""
+Offline stand-in for the Gemini and OpenAI HTTP APIs
+
+Answers the requests the backend's SDK clients make, after a latency drawn
+from a log-normal distribution, failing a configurable share of them:
+
+    POST /v1beta/models/<model>:generateContent        image (image models) or JSON script
+    POST /v1beta/models/<model>:streamGenerateContent  JSON script as server-sent events
+    POST /v1/chat/completions                          JSON script, streamed or not
+    GET  /images/<n>.png                               synthetic image for /api/proxy-image
+    GET  /stats                                        request and error counters
+
+Run it, then point the backend at it:
+
+    python -m bench.fake_provider --port 8765 --image-latency 8:0.4 --error-rate 0.02
+    GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:8765 python app.py
+
+OpenAI requests use it through the request's ``base_url``
+(``http://127.0.0.1:8765/v1``). Only the standard library and Pillow are used.
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import logging
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Status codes of injected failures, in the proportions real providers show them
+ERROR_STATUSES = [429, 429, 500, 503]
+_GENAI_STATUS_NAMES = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+
+class LatencyModel:
+    """Log-normal latency: ``median`` seconds, spread ``sigma`` (0 for a constant)"""
+
+    def __init__(self, median: float, sigma: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """Parse "median[:sigma]", e.g. "8:0.4" """
+        median, _, sigma = spec.partition(':')
+        return cls(float(median), float(sigma or 0))
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0.0, self.sigma)) if self.sigma > 0 else self.median
+
+
+def noise_png(width: int, height: int, seed: int) -> bytes:
+    """A PNG that compresses about as badly as a real illustration"""
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 48).convert('RGB')
+    tint = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    Image.blend(noise, tint, 0.5).save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def _with_text_chunk(png: bytes, text: bytes) -> bytes:
+    """Insert a tEXt chunk before IEND so every response is a distinct image"""
+    data = b'bench\x00' + text
+    chunk = struct.pack('>I', len(data)) + b'tEXt' + data + struct.pack('>I', zlib.crc32(b'tEXt' + data) & 0xffffffff)
+    return png[:-12] + chunk + png[-12:]
+
+
+class FakeProvider:
+    """Latency models, synthetic payloads and counters shared by all handler threads"""
+
+    def __init__(
+        self,
+        image_latency: LatencyModel,
+        text_latency: LatencyModel,
+        error_rate: float = 0.0,
+        image_size: Tuple[int, int] = (768, 1376),
+        image_pool: int = 4,
+        script_pages: int = 3
+    ):
+        self.image_latency = image_latency
+        self.text_latency = text_latency
+        self.error_rate = error_rate
+        self.script_pages = script_pages
+        self.images = [noise_png(image_size[0], image_size[1], seed) for seed in range(max(1, image_pool))]
+        self._serial = itertools.count()
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def count(self, name: str):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def injected_error(self) -> Optional[int]:
+        """Status code of a simulated failure, or None for a normal response"""
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            return random.choice(ERROR_STATUSES)
+        return None
+
+    def image_bytes(self) -> bytes:
+        serial = next(self._serial)
+        return _with_text_chunk(self.images[serial % len(self.images)], str(serial).encode('ascii'))
+
+    def script(self, request_text: str) -> Dict[str, Any]:
+        """A ComicScript with the page and row counts the prompt asks for"""
+        pages = re.search(r'Pages:\s*(\d+)', request_text)
+        rows = re.search(r'Rows per page:\s*about\s*(\d+)', request_text)
+        page_count = int(pages.group(1)) if pages else self.script_pages
+        row_count = int(rows.group(1)) if rows else 4
+        return {"pages": [
+            {
+                "title": f"Page {page + 1}",
+                "rows": [
+                    {"height": "180px", "panels": [{"text": f"Panel {page + 1}.{row + 1}.{panel + 1}"} for panel in range(2)]}
+                    for row in range(row_count)
+                ]
+            }
+            for page in range(page_count)
+        ]}
+
+
+def _chunks(text: str, count: int) -> List[str]:
+    size = max(1, math.ceil(len(text) / count))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: "FakeProviderServer"
+
+    def log_message(self, format: str, *args):
+        logger.debug(format % args)
+
+    @property
+    def provider(self) -> FakeProvider:
+        return self.server.provider
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, status: int, body: Any):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, openai_style: bool):
+        self.provider.count(f"error_{status}")
+        message = f"Simulated provider error {status}"
+        if openai_style:
+            body = {"error": {"message": message, "type": "server_error", "code": str(status)}}
+        else:
+            body = {"error": {"code": status, "message": message, "status": _GENAI_STATUS_NAMES.get(status, "UNKNOWN")}}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, data: str):
+        self.wfile.write(f"data: {data}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def do_GET(self):
+        match = re.fullmatch(r'/images/(\d+)\.png', self.path.split('?', 1)[0])
+        if match:
+            self.provider.count('proxy_image')
+            index = int(match.group(1))
+            image = self.provider.images[index % len(self.provider.images)]
+            etag = f'"bench-{index}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(image)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'max-age=60')
+            self.end_headers()
+            self.wfile.write(image)
+            return
+        if self.path == '/stats':
+            self._send_json(200, self.provider.stats())
+            return
+        self._send_json(404, {"error": {"message": f"No route for GET {self.path}"}})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        genai = re.fullmatch(r'/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)', path)
+        if genai:
+            self._genai(genai.group(1), genai.group(2) == 'streamGenerateContent', body)
+        elif path.endswith('/chat/completions'):
+            self._chat_completion(body)
+        else:
+            self._send_json(404, {"error": {"message": f"No route for POST {path}"}})
+
+    def _genai(self, model: str, stream: bool, body: Dict[str, Any]):
+        is_image = 'image' in model
+        self.provider.count(f"genai_{'image' if is_image else 'text'}")
+        latency = (self.provider.image_latency if is_image else self.provider.text_latency).sample()
+        status = self.provider.injected_error()
+        if status is not None:
+            time.sleep(latency * random.random())
+            self._send_error(status, openai_style=False)
+            return
+
+        if is_image:
+            time.sleep(latency)
+            data = base64.b64encode(self.provider.image_bytes()).decode('ascii')
+            self._send_json(200, {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"inlineData": {"mimeType": "image/png", "data": data}}]},
+                    "finishReason": "STOP",
+                    "index": 0
+                }],
+                "modelVersion": model
+            })
+            return
+
+        request_text = json.dumps(body.get('contents', ''), ensure_ascii=False)
+        text = json.dumps(self.provider.script(request_text), ensure_ascii=False)
+        if not stream:
+            time.sleep(latency)
+            self._send_json(200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+                "modelVersion": model
+            })
+            return
+
+        self._start_sse()
+        pieces = _chunks(text, 8)
+        for i, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            candidate = {"content": {"role": "model", "parts": [{"text": piece}]}, "index": 0}
+            if i == len(pieces) - 1:
+                candidate["finishReason"] = "STOP"
+            self._send_event(json.dumps({"candidates": [candidate], "modelVersion": model}))
+
+    def _chat_completion(self, body: Dict[str, Any]):
+        self.provider.count('openai_chat')
+        latency = self.provider.text_latency.sample()
+        status = self.provider.injected_error()
+        if status is not None:
+            time.sleep(latency * random.random())
+            self._send_error(status, openai_style=True)
+            return
+
+        model = body.get('model', 'gpt-4o-mini')
+        request_text = json.dumps(body.get('messages', []), ensure_ascii=False)
+        text = json.dumps(self.provider.script(request_text), ensure_ascii=False)
+        created = int(time.time())
+        usage = {"prompt_tokens": len(request_text) // 4, "completion_tokens": len(text) // 4,
+                 "total_tokens": (len(request_text) + len(text)) // 4}
+
+        if not body.get('stream'):
+            time.sleep(latency)
+            self._send_json(200, {
+                "id": f"chatcmpl-bench-{created}", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text, "refusal": None},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": usage
+            })
+            return
+
+        self._start_sse()
+        pieces = _chunks(text, 8)
+        for i, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            chunk = {
+                "id": f"chatcmpl-bench-{created}", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece} if i else {"role": "assistant", "content": piece},
+                             "finish_reason": "stop" if i == len(pieces) - 1 else None}]
+            }
+            self._send_event(json.dumps(chunk))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            self._send_event(json.dumps({
+                "id": f"chatcmpl-bench-{created}", "object": "chat.completion.chunk", "created": created,
+                "model": model, "choices": [], "usage": usage
+            }))
+        self._send_event("[DONE]")
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The backend keeps many pooled connections open at high concurrency
+    request_queue_size = 512
+
+    def __init__(self, address: Tuple[str, int], provider: FakeProvider):
+        super().__init__(address, FakeProviderHandler)
+        self.provider = provider
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--image-latency', default='8:0.4', help='image call latency "median[:sigma]" in seconds')
+    parser.add_argument('--text-latency', default='3:0.3', help='script call latency "median[:sigma]" in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with 429/500/503')
+    parser.add_argument('--image-size', default='768x1376', help='synthetic image size WxH')
+    parser.add_argument('--image-pool', type=int, default=4, help='distinct base images to render')
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    provider = FakeProvider(
+        image_latency=LatencyModel.parse(args.image_latency),
+        text_latency=LatencyModel.parse(args.text_latency),
+        error_rate=args.error_rate,
+        image_size=(width, height),
+        image_pool=args.image_pool
+    )
+    server = FakeProviderServer((args.host, args.port), provider)
+    print(f"Fake provider listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
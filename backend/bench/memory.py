@@ -0,0 +1,148 @@
+"""
+Reference handling memory check (tracemalloc)
+
+Prepares one image request per page with a growing number of distinct
+reference images, the way /api/generate-image does before calling the
+provider, then releases it. For each reference count it reports:
+
+    held      encoded reference parts the request must keep for the call
+    peak      tracemalloc peak while preparing, above the starting point
+    overhead  peak - held: transient buffers (raw downloads, base64, re-encoding)
+    retained  memory still allocated after the request is released
+
+References are prepared one at a time, so the overhead must stay flat as
+the count grows and nothing may be retained. Exits 1 otherwise:
+
+    python -m bench.memory --references 1,2,4,8 --size 1024x1024
+
+The image I/O pool runs in threads here so its allocations are traced, and
+the reference cache is disabled so every page prepares its references.
+Pixel buffers allocated inside Pillow are not visible to tracemalloc; their
+size is charged to the request's MemoryBudget instead (budget column).
+Provider calls are not made; bench.run covers them end to end.
+"""
+import argparse
+import base64
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Dict, List, Optional
+
+from bench.fake_provider import noise_png
+
+MB = 1024 * 1024
+
+
+def environment(data_dir: str) -> Dict[str, str]:
+    """
+    Settings the measurement needs; singletons read them at import, so they
+    must be in place before comic_generator is first imported
+    """
+    return {
+        "IMAGE_IO_MODE": "thread",
+        "REFERENCE_CACHE_MAX_BYTES": "0",
+        "IMAGE_RESULT_CACHE_ENABLED": "false",
+        "GEMINI_CONTEXT_CACHE_ENABLED": "false",
+        "IMAGE_STORE_ROOT": os.path.join(data_dir, 'images'),
+        "IMAGE_INDEX_PATH": os.path.join(data_dir, 'image_index.sqlite3'),
+        "LOG_LEVEL": "WARNING"
+    }
+
+
+def measure(counts: List[int], width: int, height: int, pages: int) -> List[Dict[str, int]]:
+    """
+    Prepare and release ``pages`` requests per reference count
+
+    Returns:
+        The worst (highest overhead) row per count, smallest count first
+    """
+    from comic_generator import _prepare_image_request
+
+    counts = sorted(set(counts))
+    references = [
+        "data:image/png;base64," + base64.b64encode(noise_png(width, height, seed)).decode('ascii')
+        for seed in range(max(counts))
+    ]
+
+    def prepare(count: int, page: int):
+        request, _ = _prepare_image_request(
+            f"Memory check page {count}-{page}", references[:count], 'bench-key',
+            None, True, None, None, False
+        )
+        held = sum(len(part.inline_data.data) for part in request.reference_parts)
+        return request, held
+
+    # Warm up imports, the client pool and the I/O pool outside the measurement
+    prepare(1, -1)[0].release()
+
+    tracemalloc.start()
+    rows = []
+    for count in counts:
+        worst = None
+        for page in range(pages):
+            gc.collect()
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            request, held = prepare(count, page)
+            peak = tracemalloc.get_traced_memory()[1] - start
+            budget_peak = request.budget.peak
+            request.release()
+            del request
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - start
+            row = {"count": count, "held": held, "peak": peak, "overhead": peak - held,
+                   "retained": retained, "budget": budget_peak}
+            if worst is None or row["overhead"] > worst["overhead"]:
+                worst = row
+        rows.append(worst)
+    tracemalloc.stop()
+    return rows
+
+
+def find_failures(rows: List[Dict[str, int]], tolerance: float, slack_mb: float) -> List[str]:
+    """Overhead growing with the reference count, or memory retained after release"""
+    failures = []
+    allowed = rows[0]["overhead"] * (1 + tolerance) + slack_mb * MB
+    for row in rows[1:]:
+        if row["overhead"] > allowed:
+            failures.append(f"overhead with {row['count']} references is {row['overhead'] / MB:.2f} MB, "
+                            f"over {allowed / MB:.2f} MB")
+    for row in rows:
+        if row["retained"] > slack_mb * MB:
+            failures.append(f"{row['retained'] / MB:.2f} MB retained after releasing {row['count']} references")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reference handling memory check (tracemalloc)")
+    parser.add_argument('--references', default='1,2,4,8', help='comma-separated reference counts')
+    parser.add_argument('--size', default='1024x1024', help='reference image size WxH')
+    parser.add_argument('--pages', type=int, default=3, help='pages prepared per reference count')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed overhead growth over the smallest count')
+    parser.add_argument('--slack-mb', type=float, default=1.0, help='absolute allowance for overhead and retained memory')
+    args = parser.parse_args(argv)
+
+    os.environ.update(environment(tempfile.mkdtemp(prefix='comic-memory-')))
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    counts = [int(n) for n in args.references.split(',') if n.strip()]
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    print(f"{max(counts)} references of {width}x{height}")
+    rows = measure(counts, width, height, args.pages)
+
+    print(f"{'refs':>5}{'held MB':>10}{'peak MB':>10}{'overhead MB':>13}{'retained KB':>13}{'budget MB':>11}")
+    for row in rows:
+        print(f"{row['count']:>5}{row['held'] / MB:>10.2f}{row['peak'] / MB:>10.2f}{row['overhead'] / MB:>13.2f}"
+              f"{row['retained'] / 1024:>13.1f}{row['budget'] / MB:>11.2f}")
+
+    failures = find_failures(rows, args.tolerance, args.slack_mb)
+    for line in failures:
+        print(f"FAIL {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
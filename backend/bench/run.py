@@ -0,0 +1,381 @@
+"""
+End-to-end benchmark against the offline fake provider
+
+Starts bench.fake_provider and the backend (bench.serve) as subprocesses
+with every cache and store in a temporary directory, drives each scenario
+at a fixed concurrency and reports throughput, latency percentiles and the
+server's peak resident memory. No network access or API keys are needed.
+
+    python -m bench.run --requests 100 --concurrency 16
+    python -m bench.run --scenarios image,cover --references 4 --json results.json
+    python -m bench.run --baseline results.json --tolerance 0.15   # exit 1 on regression
+
+Scenarios:
+    generate  POST /api/generate        unique prompt per request
+    image     POST /api/generate-image  unique page, --references earlier pages as data URLs
+    cover     POST /api/generate-cover  --references reference images as data URLs
+    proxy     GET  /api/proxy-image     --proxy-distinct images served by the fake provider
+"""
+import argparse
+import base64
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fake_provider import noise_png
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('generate', 'image', 'cover', 'proxy')
+API_KEY = 'bench-key'
+
+# A request and its scenario: (method, path, params, json body)
+Request = Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was ready")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+
+def _process_tree(pid: int) -> List[int]:
+    """``pid`` and its descendants (image I/O worker processes count too)"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def _status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """Sample the resident memory of a process tree in a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = sum(_status_kb(pid, 'VmRSS') for pid in _process_tree(self.pid))
+            self.peak_kb = max(self.peak_kb, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _stop(process: subprocess.Popen):
+    """
+    Stop a subprocess and everything it spawned
+
+    SIGINT lets the server shut its worker pools down cleanly; workers that
+    outlive it are still in its session (``start_new_session``) and are
+    terminated with the group.
+    """
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _data_url(png: bytes) -> str:
+    return "data:image/png;base64," + base64.b64encode(png).decode('ascii')
+
+
+def _page_data(run_id: str, index: int) -> Dict[str, Any]:
+    return {
+        "title": f"Bench page {run_id}-{index}",
+        "rows": [
+            {"height": "180px", "panels": [{"text": f"Bench {run_id}-{index} panel {row}.{panel}"} for panel in range(2)]}
+            for row in range(4)
+        ]
+    }
+
+
+def _request_factory(scenario: str, args: argparse.Namespace, fake_url: str, references: List[str]) -> Callable[[int], Request]:
+    """Build the ``index -> request`` function of a scenario; every request is distinct"""
+    run_id = os.urandom(3).hex()
+
+    if scenario == 'generate':
+        def build(index: int) -> Request:
+            body = {"prompt": f"Bench story {run_id}-{index}", "page_count": args.page_count, "language": "en"}
+            if args.script_provider == 'openai':
+                body.update(api_key=API_KEY, base_url=f"{fake_url}/v1", model='gpt-4o-mini')
+            else:
+                body.update(google_api_key=API_KEY)
+            return 'POST', '/api/generate', None, body
+    elif scenario == 'image':
+        def build(index: int) -> Request:
+            return 'POST', '/api/generate-image', None, {
+                "page_data": _page_data(run_id, index),
+                "google_api_key": API_KEY,
+                "language": "en",
+                "extra_body": [{"pageIndex": i, "imageUrl": url} for i, url in enumerate(references)]
+            }
+    elif scenario == 'cover':
+        def build(index: int) -> Request:
+            return 'POST', '/api/generate-cover', None, {
+                "google_api_key": API_KEY,
+                "language": "en",
+                "reference_imgs": references,
+                "custom_requirements": f"Bench cover {run_id}-{index}"
+            }
+    else:
+        def build(index: int) -> Request:
+            return 'GET', '/api/proxy-image', {"url": f"{fake_url}/images/{index % args.proxy_distinct}.png"}, None
+    return build
+
+
+def _run_scenario(client: httpx.Client, build: Callable[[int], Request], args: argparse.Namespace,
+                  server_pid: int) -> Dict[str, Any]:
+    def call(index: int) -> Tuple[float, str]:
+        method, path, params, body = build(index)
+        started = time.perf_counter()
+        try:
+            response = client.request(method, path, params=params, json=body)
+            response.read()
+            outcome = 'ok' if response.status_code < 400 else str(response.status_code)
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        return time.perf_counter() - started, outcome
+
+    for index in range(args.warmup):
+        call(-1 - index)
+
+    with RssSampler(server_pid, args.rss_interval) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(call, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, outcome in results if outcome == 'ok']
+    errors: Dict[str, int] = {}
+    for _, outcome in results:
+        if outcome != 'ok':
+            errors[outcome] = errors.get(outcome, 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 1),
+        "peak_rss_mb": round(sampler.peak_kb / 1024, 1)
+    }
+
+
+def _server_env(args: argparse.Namespace, data_dir: str, fake_url: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_GEMINI_BASE_URL": fake_url,
+        "IMAGE_STORE_ROOT": os.path.join(data_dir, 'images'),
+        "IMAGE_INDEX_PATH": os.path.join(data_dir, 'image_index.sqlite3'),
+        "SCRIPT_CACHE_PATH": os.path.join(data_dir, 'script_cache.sqlite3'),
+        "IDEMPOTENCY_CACHE_PATH": os.path.join(data_dir, 'idempotency.sqlite3'),
+        "IMAGE_RESULT_CACHE_PATH": os.path.join(data_dir, 'image_results.sqlite3'),
+        "IMAGE_PROXY_CACHE_DIR": os.path.join(data_dir, 'proxy_cache'),
+        # The fake provider has no cachedContents API
+        "GEMINI_CONTEXT_CACHE_ENABLED": "false",
+        # One API key drives all the load, so per-key limits would measure the limiter
+        "PROVIDER_KEY_RATE": "0",
+        "PROVIDER_KEY_CONCURRENCY": str(max(args.concurrency, 1)),
+        "PROVIDER_MAX_CONCURRENCY": str(max(args.concurrency, 1)),
+        "LOG_LEVEL": "WARNING",
+        "LOG_LEVELS": "werkzeug=WARNING",
+        "PYTHONUNBUFFERED": "1"
+    })
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    return env
+
+
+def _regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenarios slower, less productive or larger than the baseline by more than ``tolerance``"""
+    found = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            found.append(f"{scenario}: throughput {current['throughput_rps']} < {previous['throughput_rps']} req/s")
+        for field in ("p95_ms", "peak_rss_mb"):
+            if previous[field] and current[field] > previous[field] * (1 + tolerance):
+                found.append(f"{scenario}: {field} {current[field]} > {previous[field]}")
+    return found
+
+
+def _print_table(results: Dict[str, Any]):
+    columns = ("requests", "ok", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "peak_rss_mb")
+    print(f"{'scenario':<10}" + "".join(f"{column:>16}" for column in columns) + "  errors")
+    for scenario, stats in results["scenarios"].items():
+        errors = ", ".join(f"{key}={count}" for key, count in sorted(stats["errors"].items())) or "-"
+        print(f"{scenario:<10}" + "".join(f"{stats[column]:>16}" for column in columns) + f"  {errors}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against the offline fake provider")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per scenario')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--script-provider', choices=('gemini', 'openai'), default='gemini')
+    parser.add_argument('--page-count', type=int, default=3, help='pages per generated script')
+    parser.add_argument('--references', type=int, default=2, help='reference images per page and cover request')
+    parser.add_argument('--reference-size', default='1024x1024', help='reference image size WxH')
+    parser.add_argument('--proxy-distinct', type=int, default=16, help='distinct URLs in the proxy scenario')
+    parser.add_argument('--image-latency', default='0.5:0.3', help='fake image call latency "median[:sigma]"')
+    parser.add_argument('--text-latency', default='0.2:0.3', help='fake script call latency "median[:sigma]"')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of fake provider calls that fail')
+    parser.add_argument('--image-size', default='768x1376', help='fake generated image size WxH')
+    parser.add_argument('--timeout', type=float, default=300.0, help='client timeout per request')
+    parser.add_argument('--rss-interval', type=float, default=0.05, help='seconds between RSS samples')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra server environment')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='earlier --json results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed regression against the baseline')
+    parser.add_argument('--keep-data', action='store_true', help='keep the temporary data directory')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    data_dir = tempfile.mkdtemp(prefix='comic-bench-')
+    fake_port, server_port = _free_port(), _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    server_url = f"http://127.0.0.1:{server_port}"
+    processes: List[subprocess.Popen] = []
+    try:
+        fake = subprocess.Popen([
+            sys.executable, '-m', 'bench.fake_provider', '--port', str(fake_port),
+            '--image-latency', args.image_latency, '--text-latency', args.text_latency,
+            '--error-rate', str(args.error_rate), '--image-size', args.image_size
+        ], cwd=BACKEND_DIR, start_new_session=True)
+        processes.append(fake)
+        _wait_ready(f"{fake_url}/stats", fake)
+
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'bench.serve', '--port', str(server_port), '--server', args.server],
+            cwd=BACKEND_DIR, env=_server_env(args, data_dir, fake_url), start_new_session=True
+        )
+        processes.append(server)
+        _wait_ready(f"{server_url}/api/health", server, timeout=60.0)
+
+        width, height = (int(v) for v in args.reference_size.lower().split('x'))
+        references = [_data_url(noise_png(width, height, 100 + i)) for i in range(args.references)]
+
+        results: Dict[str, Any] = {
+            "config": {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+            "scenarios": {}
+        }
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        with httpx.Client(base_url=server_url, timeout=args.timeout, limits=limits) as client:
+            for scenario in scenarios:
+                build = _request_factory(scenario, args, fake_url, references)
+                results["scenarios"][scenario] = _run_scenario(client, build, args, server.pid)
+            results["server_peak_rss_mb"] = round(_status_kb(server.pid, 'VmHWM') / 1024, 1)
+        results["provider_calls"] = httpx.get(f"{fake_url}/stats").json()
+    finally:
+        for process in reversed(processes):
+            _stop(process)
+        if args.keep_data:
+            print(f"Data kept in {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    _print_table(results)
+    print(f"server VmHWM: {results['server_peak_rss_mb']} MB, provider calls: {results['provider_calls']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = _regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Serve the backend for a benchmark run
+
+The Flask app runs on werkzeug's threaded server without the debugger and
+reloader that ``python app.py`` enables, so the numbers reflect request
+handling rather than development tooling. ``--server asgi`` runs the async
+serving mode on uvicorn instead.
+
+    python -m bench.serve --port 5003 [--server wsgi|asgi]
+"""
+import argparse
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve the backend for a benchmark run")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5003)
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    args = parser.parse_args(argv)
+
+    if args.server == 'asgi':
+        import uvicorn
+        uvicorn.run('asgi:app', host=args.host, port=args.port, log_level='warning', access_log=False)
+        return
+
+    from werkzeug.serving import make_server
+
+    from app import app
+    server = make_server(args.host, args.port, app, threaded=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
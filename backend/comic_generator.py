@@ -1,42 +1,385 @@
+import asyncio
 import os
-import requests
 import logging
 import time
-import uuid
 import io
 import base64
+import binascii
+import hashlib
+from concurrent.futures import Future
 
 from dotenv import load_dotenv
 from typing import Optional
-from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types
 from google.genai.types import GenerateContentConfig, ImageConfig, FinishReason
 from PIL import Image
 
+from core.client_registry import client_registry
+from core.context_cache import context_cache_manager
+from core.hedging import image_hedger
+from core.image_io import OUTPUT_FORMATS, image_io_pool, resize_encode
+from core.image_proxy import image_proxy
+from core.image_store import image_store
+from core.memory_budget import MemoryBudget
+from core.metrics import count_provider_error, count_reference_bytes, stage_timer
+from core.reference_cache import reference_cache
+from core.result_cache import image_result_cache
+from core.retry_policy import RETRYABLE_STATUS_CODES, NonRetryableError, RetryPolicy, circuit_breakers
+from core.scheduler import provider_scheduler
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 
-def generate_social_media_image_core(
-        prompt: str, 
-        reference_img: Optional[str | list] = None,
-        google_api_key: Optional[str] = None,
-        max_retries: int = 3,
-        retry_delay: float = 1.0
-    ) -> Optional[str]:
-    
-    # Initialize Google GenAI Client
+STATIC_IMAGES_PREFIX = "/backend/static/images/"
+
+IMAGE_MODEL_ID = "gemini-3-pro-image-preview"
+
+# Formats the API accepts as-is; anything else is re-encoded as PNG
+PASSTHROUGH_MIME_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+# Reference preprocessing: downscale to REFERENCE_MAX_SIDE (0 disables) and
+# re-encode as REFERENCE_FORMAT (JPEG, WEBP or ORIGINAL) at REFERENCE_QUALITY
+REFERENCE_MAX_SIDE = int(os.getenv('REFERENCE_MAX_SIDE', 1024))
+REFERENCE_FORMAT = os.getenv('REFERENCE_FORMAT', 'WEBP').upper()
+REFERENCE_QUALITY = int(os.getenv('REFERENCE_QUALITY', 85))
+
+# Memory one image request may hold for references: the prepared parts it
+# uploads plus the raw and decoded buffers of the reference being prepared.
+# References that would exceed it are skipped (0 disables the ceiling)
+REFERENCE_REQUEST_MAX_BYTES = int(os.getenv('REFERENCE_REQUEST_MAX_BYTES', 128 * 1024 ** 2))
+
+# Characters of a data URL hashed or base64-decoded per step (a multiple of 4)
+DATA_URL_CHUNK_CHARS = 1024 * 1024
+# Bytes read per step when downloading a reference image
+REFERENCE_DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+# Retry policy for image calls: total time budget, backoff cap and the
+# timeout of a single attempt, in seconds
+IMAGE_RETRY_BUDGET = float(os.getenv('IMAGE_RETRY_BUDGET', 300))
+IMAGE_RETRY_MAX_DELAY = float(os.getenv('IMAGE_RETRY_MAX_DELAY', 30))
+IMAGE_ATTEMPT_TIMEOUT = float(os.getenv('IMAGE_ATTEMPT_TIMEOUT', 180))
+
+# Finish reasons that mean the request itself was refused; retrying cannot help
+BLOCKED_FINISH_REASONS = {
+    FinishReason.SAFETY,
+    FinishReason.RECITATION,
+    FinishReason.BLOCKLIST,
+    FinishReason.PROHIBITED_CONTENT,
+    FinishReason.SPII,
+    FinishReason.IMAGE_SAFETY,
+    FinishReason.IMAGE_PROHIBITED_CONTENT,
+}
+
+# Downscaled derivatives saved next to each generated image for list views;
+# an empty IMAGE_VARIANT_WIDTHS disables them
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '240,480,960').split(',') if w.strip()]
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', 'webp').lower()  # webp, jpeg or png
+
+
+def _reference_cache_key(img_str: str) -> Optional[str]:
+    """Build a content-identifying cache key for a reference image string"""
+    if img_str.startswith('http'):
+        return f"url:{img_str}"
+    if img_str.startswith(STATIC_IMAGES_PREFIX):
+        path = _static_image_path(img_str)
+        stat = os.stat(path)
+        return f"file:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    if img_str.startswith('data:image'):
+        # Hash in slices: data URLs run to megabytes and need no full-size copy
+        digest = hashlib.sha256()
+        for start in range(0, len(img_str), DATA_URL_CHUNK_CHARS):
+            digest.update(img_str[start:start + DATA_URL_CHUNK_CHARS].encode('utf-8'))
+        return f"data:{digest.hexdigest()}"
+    return None
+
+
+def _static_image_path(img_str: str) -> str:
+    """Map a /backend/static/images/... URL to its file on disk"""
+    relative = img_str[len(STATIC_IMAGES_PREFIX):]
+    static_dir = os.path.normpath(image_store.root)
+    path = os.path.normpath(os.path.join(static_dir, relative))
+    if not path.startswith(static_dir + os.sep):
+        raise ValueError(f"Invalid static image path: {img_str}")
+    return path
+
+
+def _decode_base64(text: str, start: int) -> bytes:
+    """
+    Decode the base64 in ``text[start:]``
+
+    Decoded slice by slice, so neither the payload substring nor its ASCII
+    bytes are copied whole; only the decoded bytes are allocated in full.
+    """
+    if any(text.find(ws, start) != -1 for ws in ('\n', '\r', ' ')):
+        # Line-wrapped base64 would misalign the slices
+        return base64.b64decode(text[start:])
+    decoded = io.BytesIO()
+    for offset in range(start, len(text), DATA_URL_CHUNK_CHARS):
+        decoded.write(binascii.a2b_base64(text[offset:offset + DATA_URL_CHUNK_CHARS]))
+    return decoded.getvalue()
+
+
+def _download_reference(url: str, budget: MemoryBudget) -> bytes:
+    """Download a reference image, giving up as soon as it cannot fit in ``budget``"""
+    # Reuse the proxy's pooled connections to image hosts
+    with image_proxy.session.get(url, timeout=60, stream=True) as resp:
+        resp.raise_for_status()
+        length = resp.headers.get('Content-Length')
+        if length and length.isdigit():
+            budget.check(int(length), "Reference download")
+        data = io.BytesIO()
+        for chunk in resp.iter_content(chunk_size=REFERENCE_DOWNLOAD_CHUNK_BYTES):
+            # Content-Length may be missing or wrong; count what actually arrives
+            budget.check(data.tell() + len(chunk), "Reference download")
+            data.write(chunk)
+        return data.getvalue()
+
+
+def _read_reference_bytes(img_str: str, budget: MemoryBudget) -> bytes:
+    """
+    Fetch the raw encoded bytes of a reference image
+
+    Raises MemoryBudgetExceededError before (or, for downloads without a
+    trustworthy length, while) reading bytes that would not fit in ``budget``.
+    """
+    if img_str.startswith('http'):
+        logger.info(f"Downloading reference image: {img_str}")
+        return _download_reference(img_str, budget)
+    if img_str.startswith(STATIC_IMAGES_PREFIX):
+        logger.info(f"Processing reference image: {img_str}")
+        path = _static_image_path(img_str)
+        budget.check(os.path.getsize(path), "Reference file")
+        with open(path, 'rb') as f:
+            return f.read()
+    logger.info("Processing base64 reference image")
+    # Skip the "data:image/...;base64," header without copying the payload
+    start = img_str.find(",") + 1
+    budget.check((len(img_str) - start) * 3 // 4, "Reference data URL")
+    return _decode_base64(img_str, start)
+
+
+def _preprocess_reference(data: bytes, budget: MemoryBudget) -> tuple[bytes, str]:
+    """
+    Downscale and re-encode a reference image before upload
+
+    Images are shrunk so their longest side is at most REFERENCE_MAX_SIDE
+    and encoded as REFERENCE_FORMAT. The original bytes are kept when they
+    are already small enough and no smaller encoding is produced. Pixels
+    are only decoded when the image has to change, and their size is
+    charged to ``budget`` first.
+
+    Returns:
+        Tuple of (encoded_bytes, mime_type)
+    """
+    # Opening reads the header only
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format
+        original_mime = PASSTHROUGH_MIME_TYPES.get(img.format)
+        width, height = img.size
+        decoded_size = width * height * len(img.getbands())
+    needs_resize = REFERENCE_MAX_SIDE > 0 and max(width, height) > REFERENCE_MAX_SIDE
+    target_format = REFERENCE_FORMAT if REFERENCE_FORMAT in ('JPEG', 'WEBP') else None
+
+    if original_mime and not needs_resize and target_format in (None, source_format):
+        return data, original_mime
+
+    # Decoding, resampling and encoding are CPU bound: run them in the image I/O pool
+    save_format = target_format or 'PNG'
+    with budget.hold(decoded_size, f"Decoded {width}x{height} reference"):
+        encoded, new_width, new_height = image_io_pool.submit(
+            resize_encode,
+            data,
+            REFERENCE_MAX_SIDE if needs_resize else 0,
+            save_format,
+            REFERENCE_QUALITY
+        ).result()
+
+    if original_mime and not needs_resize and len(encoded) >= len(data):
+        logger.info(f"Reference image {width}x{height}: kept original {len(data)} bytes")
+        return data, original_mime
+
+    logger.info(
+        f"Reference image {width}x{height} -> {new_width}x{new_height} {save_format}: "
+        f"{len(data)} -> {len(encoded)} bytes"
+    )
+    return encoded, f"image/{save_format.lower()}"
+
+
+def _prepare_reference(img_str: str, budget: MemoryBudget) -> tuple[Optional[types.Part], int]:
+    """Turn a reference image string into an upload-ready Part"""
+    data = _read_reference_bytes(img_str, budget)
+    with budget.hold(len(data), "Reference image"):
+        # The raw bytes are dropped here unless they are uploaded as-is
+        data, mime_type = _preprocess_reference(data, budget)
+    return types.Part.from_bytes(data=data, mime_type=mime_type), len(data)
+
+
+def load_reference_image(img_str: str, budget: Optional[MemoryBudget] = None) -> Optional[types.Part]:
+    """
+    Load a reference image as an upload-ready Part, using the shared cache
+
+    Args:
+        img_str: http(s) URL, /backend/static/images/... path or data URL
+        budget: Request memory budget charged for the raw and decoded
+            buffers while the image is prepared (unlimited when omitted)
+
+    Returns:
+        types.Part with the encoded image, or None for unsupported strings
+    """
+    # Our own images under IMAGE_BASE_URL are read from disk, not downloaded
+    img_str = image_store.local_url(img_str)
+    key = _reference_cache_key(img_str)
+    if key is None:
+        return None
+    budget = budget or MemoryBudget(0)
+    return reference_cache.get_or_load(key, lambda: _prepare_reference(img_str, budget))
+
+
+def _save_variants(content_hash: str, image_bytes: bytes):
+    """
+    Generate and store the configured downscaled variants of a stored image
+
+    Runs in the image I/O pool without holding up the response; until the
+    variants exist, ``?w=`` requests fall back to the full-size image.
+    """
+    if not IMAGE_VARIANT_WIDTHS or IMAGE_VARIANT_FORMAT not in OUTPUT_FORMATS:
+        return
+    ext = OUTPUT_FORMATS[IMAGE_VARIANT_FORMAT][1]
+    existing = {v['width'] for v in image_store.variants(content_hash) if v['format'] == ext}
+    widths = [w for w in IMAGE_VARIANT_WIDTHS if w not in existing]
+    if not widths:
+        return
+    try:
+        future = image_io_pool.make_variants_async(image_bytes, widths, IMAGE_VARIANT_FORMAT)
+    except Exception as e:
+        logger.warning(f"Failed to create variants of {content_hash[:12]}: {e}")
+        return
+    future.add_done_callback(lambda done: _store_variants(content_hash, ext, done))
+
+
+def _store_variants(content_hash: str, ext: str, future: Future):
+    """Index the variants produced by ``_save_variants`` once the pool is done"""
+    try:
+        variants = future.result()
+        for width, data, _, height in variants:
+            image_store.save_variant(content_hash, width, data, ext, height)
+        logger.info(f"Saved {len(variants)} variants of {content_hash[:12]}")
+    except Exception as e:
+        # Variants are an optimisation; the full-size image is still served
+        logger.warning(f"Failed to create variants of {content_hash[:12]}: {e}")
+
+
+class _ImageRequest:
+    """A prepared image generation: client, contents, settings and retry state"""
+
+    def __init__(self, api_key: str, prompt: str, instructions: Optional[str], contents: list,
+                 reference_parts: list, metadata: Optional[dict], hedge: Optional[bool],
+                 budget: MemoryBudget):
+        self.api_key = api_key
+        # Leased for every attempt, so eviction cannot close it mid-retry
+        self.lease = client_registry.lease_genai_client(api_key, timeout_ms=180000)
+        self.client = self.lease.client
+        self.prompt = prompt
+        self.instructions = instructions
+        self.contents = contents
+        self.reference_parts = reference_parts
+        self.metadata = metadata
+        self.hedge = hedge
+        self.budget = budget
+        self.aspect_ratio = "9:16"
+        self.image_size = "2K"
+        self.temperature = 0.2
+        self.cache_key: Optional[str] = None
+        self.cached_content: Optional[str] = None
+        self.stable_count = 0
+
+    @property
+    def latency_kind(self) -> str:
+        return f"{IMAGE_MODEL_ID}:{self.image_size}"
+
+    def call_args(self, remaining: float) -> tuple[list, GenerateContentConfig]:
+        """Contents and config for one attempt with ``remaining`` seconds of retry budget"""
+        call_contents = self.contents
+        if self.cached_content:
+            call_contents = [self.prompt] + self.reference_parts[self.stable_count:]
+        # Never let one attempt outlive the whole retry budget
+        timeout_ms = int(max(1.0, min(IMAGE_ATTEMPT_TIMEOUT, remaining)) * 1000)
+        config = GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE'],
+            temperature=self.temperature,
+            image_config=ImageConfig(
+                aspect_ratio=self.aspect_ratio,
+                image_size=self.image_size,
+            ),
+            cached_content=self.cached_content,
+            http_options=types.HttpOptions(timeout=timeout_ms),
+        )
+        return call_contents, config
+
+    @staticmethod
+    def upload_bytes(call_contents: list) -> int:
+        """Encoded reference bytes sent inline by one call"""
+        return sum(
+            len(part.inline_data.data) for part in call_contents
+            if isinstance(part, types.Part) and part.inline_data is not None
+        )
+
+    def release(self):
+        """Drop the reference parts and the client once the request is finished, successful or not"""
+        self.contents = []
+        self.reference_parts = []
+        self.budget.release(self.budget.used)
+        self.lease.release()
+
+    def drop_context_cache(self, error: BaseException) -> bool:
+        """Retry hook: stop using a context cache the provider rejected; True if one was dropped"""
+        if not self.cached_content:
+            return False
+        # A client error while a cache is referenced usually means it expired
+        # or was deleted provider-side; transient failures keep it
+        if not isinstance(error, genai_errors.ClientError) or error.code in RETRYABLE_STATUS_CODES:
+            return False
+        logger.info(f"Dropping context cache {self.cached_content} after {error.code}, retrying inline")
+        context_cache_manager.invalidate(self.cached_content)
+        self.cached_content = None
+        return True
+
+
+def _prepare_image_request(
+        prompt: str,
+        reference_img: Optional[str | list],
+        google_api_key: Optional[str],
+        metadata: Optional[dict],
+        bypass_cache: bool,
+        comic_id: Optional[str],
+        instructions: Optional[str],
+        hedge: Optional[bool],
+        stable_references: int = 0
+    ) -> tuple[Optional[_ImageRequest], Optional[str]]:
+    """
+    Load references and look up caches for an image generation
+
+    Returns:
+        Tuple of (request, cached_url); cached_url is set on a result cache hit
+    """
     # Use provided API key or fall back to environment variable
     api_key = google_api_key or os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
     if not api_key:
         raise ValueError("Google API key is required. Please provide google_api_key parameter or set GOOGLE_API_KEY environment variable.")
-    
-    client = genai.Client(api_key=api_key, vertexai=False, http_options={'timeout':180000})
-    MODEL_ID = "gemini-3-pro-image-preview"
-    
+
     logger.info(f"Generating social media image for: {prompt}")
     
     # Prepare contents
     contents = [prompt]
+    budget = MemoryBudget(REFERENCE_REQUEST_MAX_BYTES)
+    # Loaded parts of the leading stable references (context cache prefix)
+    stable_count = 0
     
     # Handle reference images
     if reference_img:
@@ -50,100 +393,273 @@ def generate_social_media_image_core(
         elif isinstance(reference_img, str):
             image_urls.append(reference_img)
             
-        for img_str in image_urls:
+        # References are prepared one at a time; each part stays charged to
+        # the budget until the request is released
+        for index, img_str in enumerate(image_urls):
             try:
-                if img_str.startswith('http'):
-                    logger.info(f"Downloading reference image: {img_str}")
-                    resp = requests.get(img_str, timeout=60)
-                    resp.raise_for_status()
-                    img = Image.open(io.BytesIO(resp.content))
-                    contents.append(img)
-                elif img_str.startswith("/backend/static/images/"):
-                    logger.info(f"Processing reference image: {img_str}")
-                    img_str = img_str.replace("/backend/", "")
-                    img = Image.open(f"{os.getcwd()}/{img_str}")
-                    contents.append(img)
-                elif img_str.startswith('data:image'):
-                    logger.info("Processing base64 reference image")
-                    # Extract base64 data
-                    if "," in img_str:
-                        header, encoded = img_str.split(",", 1)
-                    else:
-                        encoded = img_str
-                    data = base64.b64decode(encoded)
-                    img = Image.open(io.BytesIO(data))
-                    contents.append(img)
+                with stage_timer('reference_load', IMAGE_MODEL_ID):
+                    part = load_reference_image(img_str, budget)
+                if part is not None:
+                    budget.reserve(len(part.inline_data.data), "Reference part")
+                    contents.append(part)
+                    if index < stable_references and stable_count == index:
+                        stable_count += 1
             except Exception as e:
                 logger.warning(f"Failed to process reference image {img_str[:50]}...: {e}")
+        logger.debug(f"Reference cache stats: {reference_cache.stats()}, request memory: {budget.stats()}")
 
-    # Extract config from extra_body
-    aspect_ratio = "9:16"
-    image_size = "2K"
-
-    # Retry logic
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Calling Gemini API (Attempt {attempt + 1}/{max_retries})")
-            response = client.models.generate_content(
-                model=MODEL_ID,
-                contents=contents,
-                config=GenerateContentConfig(
-                    response_modalities=['TEXT', 'IMAGE'],
-                    temperature=0.2,
-                    image_config=ImageConfig(
-                        aspect_ratio=aspect_ratio,
-                        image_size=image_size,
-                    ),
-                ),
-            )
+    reference_parts = contents[1:]
+    if instructions:
+        # Static instructions lead the request unless they live in a context cache
+        contents = [instructions] + contents
 
-            # Check for errors
-            if not response.candidates or response.candidates[0].finish_reason != FinishReason.STOP:
-                reason = "Unknown"
-                if response.candidates:
-                    reason = response.candidates[0].finish_reason
-                raise ValueError(f"Prompt Content Error: {reason}")
-
-            # Extract image
-            generated_image = None
-            for part in response.candidates[0].content.parts:
-                if part.inline_data:
-                    generated_image = part.inline_data.as_image()
-                    break
-            
-            if generated_image:
-                # Save image to static/images
-                filename = f"{uuid.uuid4()}.png"
-                # Use absolute path to ensure correctness
-                base_dir = os.path.dirname(os.path.abspath(__file__))
-                static_dir = os.path.join(base_dir, "static", "images")
-                os.makedirs(static_dir, exist_ok=True)
-                
-                save_path = os.path.join(static_dir, filename)
-                generated_image.save(save_path)
-                logger.info(f"Image saved to {save_path}")
-                
-                # Return URL path relative to static folder
-                return f"/backend/static/images/{filename}"
-            else:
-                raise ValueError("No image generated in response")
-
-        except Exception as e:
-            last_exception = e
-            logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-            
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)
-                logger.info(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                logger.error(f"All {max_retries} attempts failed")
-                raise last_exception
+    request = _ImageRequest(api_key, prompt, instructions, contents, reference_parts, metadata, hedge, budget)
+    request.stable_count = min(stable_count, context_cache_manager.reference_count)
+    try:
+        cached_url = _lookup_caches(request, reference_parts, bypass_cache, comic_id)
+    except BaseException:
+        request.release()
+        raise
+    if cached_url:
+        request.release()
+        return None, cached_url
+    return request, None
 
+
+def _lookup_caches(request: _ImageRequest, reference_parts: list, bypass_cache: bool,
+                   comic_id: Optional[str]) -> Optional[str]:
+    """Set the request's cache key and context cache; returns the URL of a cached result"""
+    prompt, instructions = request.prompt, request.instructions
+    # Deterministic result cache (opt-in): identical prompt, references and
+    # generation settings return the previously stored image
+    if image_result_cache.enabled:
+        request.cache_key = image_result_cache.make_key(
+            prompt=prompt,
+            instructions=instructions,
+            references=[
+                hashlib.sha256(part.inline_data.data).hexdigest()
+                for part in reference_parts
+            ],
+            model=IMAGE_MODEL_ID,
+            aspect_ratio=request.aspect_ratio,
+            image_size=request.image_size,
+            temperature=request.temperature
+        )
+        if not bypass_cache:
+            cached_url = image_result_cache.get(request.cache_key)
+            if cached_url:
+                logger.info(f"Image result cache hit: {cached_url}")
+                return cached_url
+
+    # Explicit context cache (opt-in): the comic's instructions and stable
+    # references are uploaded once and referenced by name afterwards
+    if instructions and comic_id:
+        request.cached_content = context_cache_manager.get_or_create(
+            request.client, request.api_key, comic_id, IMAGE_MODEL_ID, instructions,
+            reference_parts[:request.stable_count]
+        )
     return None
 
 
+def _retry_policy(request: _ImageRequest, max_retries: int, retry_delay: float):
+    """Retry policy and per-key circuit breaker for an image request"""
+    # Only transient failures are retried, with full jitter inside a time
+    # budget; a key that keeps failing trips its circuit breaker
+    policy = RetryPolicy(
+        max_attempts=max_retries,
+        base_delay=retry_delay,
+        max_delay=IMAGE_RETRY_MAX_DELAY,
+        budget=IMAGE_RETRY_BUDGET,
+        model=IMAGE_MODEL_ID
+    )
+    breaker = circuit_breakers.get(f"gemini-image:{hashlib.sha256(request.api_key.encode('utf-8')).hexdigest()[:16]}")
+    return policy, breaker
+
+
+def _extract_image(response: types.GenerateContentResponse) -> types.Image:
+    """Return the generated image, or raise a (non-)retryable error"""
+    if not response.candidates or response.candidates[0].finish_reason != FinishReason.STOP:
+        reason = "Unknown"
+        if response.candidates:
+            reason = response.candidates[0].finish_reason
+        if reason in BLOCKED_FINISH_REASONS:
+            # Safety/policy blocks repeat deterministically for the same prompt
+            count_provider_error(IMAGE_MODEL_ID, "blocked")
+            raise NonRetryableError(f"Prompt Content Error: {reason}")
+        count_provider_error(IMAGE_MODEL_ID, "unfinished")
+        raise RuntimeError(f"Prompt Content Error: {reason}")
+
+    for part in response.candidates[0].content.parts:
+        if part.inline_data:
+            return part.inline_data.as_image()
+    count_provider_error(IMAGE_MODEL_ID, "no_image")
+    raise RuntimeError("No image generated in response")
+
+
+def _store_generated_image(request: _ImageRequest, generated_image: types.Image, latency_ms: float) -> str:
+    """Encode, store and index a generated image; returns its URL"""
+    image_bytes, ext, width, height = image_io_pool.encode_output(
+        generated_image.image_bytes,
+        generated_image.mime_type
+    )
+    index_fields = dict(request.metadata or {})
+    index_fields.update({
+        'prompt_hash': image_store.prompt_hash(request.prompt),
+        'model': IMAGE_MODEL_ID,
+        'aspect_ratio': request.aspect_ratio,
+        'image_size': request.image_size,
+        'width': width,
+        'height': height,
+        'latency_ms': latency_ms
+    })
+    stored = image_store.save(image_bytes, ext, index_fields)
+    logger.info(f"Image saved to {stored.path}")
+    _save_variants(stored.content_hash, image_bytes)
+    if request.cache_key:
+        image_result_cache.put(request.cache_key, stored.url, stored.path, len(image_bytes))
+
+    # Return URL path relative to static folder
+    return stored.url
+
+
+def generate_social_media_image_core(
+        prompt: str, 
+        reference_img: Optional[str | list] = None,
+        google_api_key: Optional[str] = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        metadata: Optional[dict] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        instructions: Optional[str] = None,
+        hedge: Optional[bool] = None,
+        stable_references: int = 0
+    ) -> Optional[str]:
+    """
+    Generate an image with Gemini and store it
+
+    Args:
+        prompt: Request-specific prompt text
+        reference_img: Reference image string(s) or {"imageUrl": ...} dicts
+        google_api_key: Google API key (falls back to GOOGLE_API_KEY)
+        max_retries: Attempts before giving up
+        retry_delay: Base delay between attempts in seconds
+        metadata: Extra image index fields (e.g. style)
+        bypass_cache: Skip the image result cache lookup
+        comic_id: Comic the image belongs to; with GEMINI_CONTEXT_CACHE_ENABLED
+            the static ``instructions`` and stable references are sent once
+            per comic as a provider-side cached content
+        instructions: Static instructions sent before ``prompt``
+        stable_references: Number of leading references that are the same
+            for every page of the comic (anchors, first page)
+        hedge: Send a duplicate request when a call is slower than the
+            IMAGE_HEDGE_PERCENTILE latency (defaults to IMAGE_HEDGE_ENABLED)
+
+    Returns:
+        URL of the stored image
+    """
+    request, cached_url = _prepare_image_request(
+        prompt, reference_img, google_api_key, metadata, bypass_cache, comic_id, instructions, hedge,
+        stable_references
+    )
+    if cached_url:
+        return cached_url
+    policy, breaker = _retry_policy(request, max_retries, retry_delay)
+
+    def attempt(remaining: float):
+        call_contents, config = request.call_args(remaining)
+        upload_bytes = request.upload_bytes(call_contents)
+
+        def call():
+            count_reference_bytes(IMAGE_MODEL_ID, upload_bytes)
+            return request.client.models.generate_content(
+                model=IMAGE_MODEL_ID, contents=call_contents, config=config
+            )
+
+        call_started = time.monotonic()
+        with stage_timer('generate', IMAGE_MODEL_ID):
+            # Every provider call, hedges included, takes a per-key scheduler
+            # slot; the hedger times calls from the moment it is granted
+            response = image_hedger.run(
+                request.latency_kind, request.api_key, call, hedge=request.hedge,
+                slot=lambda: provider_scheduler.slot(request.api_key, model=IMAGE_MODEL_ID)
+            )
+        latency_ms = (time.monotonic() - call_started) * 1000
+        with stage_timer('extract', IMAGE_MODEL_ID):
+            return _extract_image(response), latency_ms
+
+    try:
+        generated_image, latency_ms = policy.run(
+            attempt, breaker=breaker, on_error=request.drop_context_cache, label="Gemini image"
+        )
+    finally:
+        # Reference buffers are not needed for storage; free them before encoding the output
+        request.release()
+    # Storage is outside the retry loop: a local write error must not buy another generation
+    with stage_timer('store', IMAGE_MODEL_ID):
+        return _store_generated_image(request, generated_image, latency_ms)
+
+
+async def generate_social_media_image_core_async(
+        prompt: str,
+        reference_img: Optional[str | list] = None,
+        google_api_key: Optional[str] = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        metadata: Optional[dict] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        instructions: Optional[str] = None,
+        hedge: Optional[bool] = None,
+        stable_references: int = 0
+    ) -> Optional[str]:
+    """
+    Async variant of generate_social_media_image_core
+
+    The Gemini call, scheduling, hedging and retry sleeps run on the event
+    loop via ``client.aio``, so a waiting request holds no thread.
+    Reference loading and storage are file/CPU work and run in worker
+    threads. Takes the same arguments.
+    """
+    request, cached_url = await asyncio.to_thread(
+        _prepare_image_request,
+        prompt, reference_img, google_api_key, metadata, bypass_cache, comic_id, instructions, hedge,
+        stable_references
+    )
+    if cached_url:
+        return cached_url
+    policy, breaker = _retry_policy(request, max_retries, retry_delay)
+
+    async def attempt(remaining: float):
+        call_contents, config = request.call_args(remaining)
+        upload_bytes = request.upload_bytes(call_contents)
+
+        async def call():
+            count_reference_bytes(IMAGE_MODEL_ID, upload_bytes)
+            return await request.client.aio.models.generate_content(
+                model=IMAGE_MODEL_ID, contents=call_contents, config=config
+            )
+
+        call_started = time.monotonic()
+        with stage_timer('generate', IMAGE_MODEL_ID):
+            response = await image_hedger.run_async(
+                request.latency_kind, request.api_key, call, hedge=request.hedge,
+                slot=lambda: provider_scheduler.aslot(request.api_key, model=IMAGE_MODEL_ID)
+            )
+        latency_ms = (time.monotonic() - call_started) * 1000
+        with stage_timer('extract', IMAGE_MODEL_ID):
+            return _extract_image(response), latency_ms
+
+    try:
+        generated_image, latency_ms = await policy.run_async(
+            attempt, breaker=breaker, on_error=request.drop_context_cache, label="Gemini image"
+        )
+    finally:
+        request.release()
+    with stage_timer('store', IMAGE_MODEL_ID):
+        return await asyncio.to_thread(_store_generated_image, request, generated_image, latency_ms)
+
+
 if __name__ == "__main__":
     # Test the function
     try:
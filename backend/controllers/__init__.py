@@ -4,5 +4,9 @@ from .image_controller import image_bp
 from .social_media_controller import social_bp
 from .prompt_controller import prompt_bp
 from .session_controller import session_bp
+from .pipeline_controller import pipeline_bp
+from .job_controller import job_bp
+from .media_controller import media_bp
+from .ops_controller import ops_bp
 
-__all__ = ['comic_bp', 'image_bp', 'social_bp', 'prompt_bp', 'session_bp']
+__all__ = ['comic_bp', 'image_bp', 'social_bp', 'prompt_bp', 'session_bp', 'pipeline_bp', 'job_bp', 'media_bp', 'ops_bp']
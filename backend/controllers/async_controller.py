@@ -0,0 +1,193 @@
+"""Async controller - native asyncio versions of the provider-bound endpoints for the ASGI app"""
+import json
+import time
+from typing import Awaitable, Callable
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from controllers.comic_controller import _script_request
+from controllers.image_controller import (
+    _cover_params, _image_result, _job_response_body, _page_params, _run_image_job
+)
+from core.job_queue import QueueFullError, image_job_queue
+from core.metrics import current_endpoint, http_request_seconds, metrics
+from core.retry_policy import CircuitOpenError
+from core.scheduler import RateLimitedError
+from core.single_flight import IdempotencyConflictError, request_deduplicator
+from services.comic_service import ComicService
+from services.image_service import ImageService
+
+
+def _cors(handler: Callable[[Request], Awaitable[Response]]) -> Callable[[Request], Awaitable[Response]]:
+    """Answer preflights and add the same CORS headers Flask-CORS adds to the WSGI routes"""
+    async def wrapped(request: Request) -> Response:
+        if request.method == 'OPTIONS':
+            response = Response(status_code=200)
+            response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+            requested = request.headers.get('access-control-request-headers')
+            if requested:
+                response.headers['Access-Control-Allow-Headers'] = requested
+        else:
+            response = await handler(request)
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Expose-Headers'] = 'X-Cache, X-Run-Id, Idempotent-Replayed'
+        return response
+    return wrapped
+
+
+def _instrumented(handler: Callable[[Request], Awaitable[Response]]) -> Callable[[Request], Awaitable[Response]]:
+    """Label provider work with the endpoint and record request latency, as the Flask hooks do"""
+    async def wrapped(request: Request) -> Response:
+        endpoint = request.url.path
+        token = current_endpoint.set(endpoint)
+        started = time.perf_counter()
+        try:
+            response = await handler(request)
+        finally:
+            current_endpoint.reset(token)
+        if metrics.enabled:
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                endpoint=endpoint, method=request.method, status=str(response.status_code)
+            )
+        return response
+    return wrapped
+
+
+def _error_response(error: Exception) -> JSONResponse:
+    """Map scheduling and provider errors to the status codes of the Flask endpoints"""
+    if isinstance(error, IdempotencyConflictError):
+        return JSONResponse({"error": str(error)}, 422)
+    if isinstance(error, (RateLimitedError, CircuitOpenError)):
+        status_code = 429 if isinstance(error, RateLimitedError) else 503
+        return JSONResponse(
+            {"error": str(error)}, status_code,
+            headers={'Retry-After': str(max(1, int(error.retry_after + 0.5)))}
+        )
+    return JSONResponse({"error": str(error)}, 500)
+
+
+async def _json_body(request: Request):
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+def _wants_async(request: Request, data: dict) -> bool:
+    if data.get('async'):
+        return True
+    return request.query_params.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+async def _generate_image(request: Request, kind: str, parse, generate_async, generate_sync) -> Response:
+    """Shared body of the page and cover endpoints"""
+    data = await _json_body(request)
+    if not data:
+        return JSONResponse({"error": "No JSON data provided"}, 400)
+
+    params, error = parse(data)
+    if error:
+        return JSONResponse({"error": error}, 400)
+
+    wants_async = _wants_async(request, data)
+
+    async def outcome():
+        if wants_async:
+            # Background jobs keep running on the thread-based job queue
+            try:
+                job = image_job_queue.submit(kind, _run_image_job, generate_sync, **params)
+            except QueueFullError as e:
+                return 503, {"error": str(e)}, {}
+            return 202, _job_response_body(job), {}
+
+        image_url, prompt = await generate_async(**params)
+        if not image_url:
+            return 500, {"error": f"{kind.capitalize()} generation failed"}, {}
+        return 200, await run_in_threadpool(_image_result, image_url, prompt), {}
+
+    try:
+        status_code, body, headers = await request_deduplicator.run_async(
+            request.url.path, {"body": data, "async": wants_async}, request.headers.get('idempotency-key'),
+            params['google_api_key'], outcome
+        )
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse(body, status_code, headers=headers)
+
+
+@_cors
+@_instrumented
+async def generate_comic_image(request: Request) -> Response:
+    """Async /api/generate-image; same request and response as the Flask endpoint"""
+    return await _generate_image(
+        request, 'image', _page_params, ImageService.generate_comic_image_async, ImageService.generate_comic_image
+    )
+
+
+@_cors
+@_instrumented
+async def generate_comic_cover(request: Request) -> Response:
+    """Async /api/generate-cover; same request and response as the Flask endpoint"""
+    return await _generate_image(
+        request, 'cover', _cover_params, ImageService.generate_comic_cover_async, ImageService.generate_comic_cover
+    )
+
+
+async def _ndjson_script_stream(service: ComicService, prompt: str, page_count: int, rows_per_page: int, bypass_cache: bool):
+    """Async twin of comic_controller._ndjson_script_stream"""
+    index = 0
+    try:
+        async for page in service.stream_comic_script_async(prompt, page_count, rows_per_page, bypass_cache=bypass_cache):
+            yield json.dumps({"type": "page", "index": index, "page": page}, ensure_ascii=False) + "\n"
+            index += 1
+        yield json.dumps({"type": "done", "page_count": index, "cached": service.cache_hit}) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+
+@_cors
+@_instrumented
+async def generate_comic(request: Request) -> Response:
+    """Async /api/generate; same request and response as the Flask endpoint"""
+    data = await _json_body(request)
+    if not data:
+        return JSONResponse({"error": "No JSON data provided"}, 400)
+
+    service, script_args, error = _script_request(data)
+    if error:
+        return JSONResponse({"error": error}, 400)
+    prompt, page_count, rows_per_page, bypass_cache = script_args
+
+    if data.get('stream'):
+        return StreamingResponse(
+            _ndjson_script_stream(service, prompt, page_count, rows_per_page, bypass_cache),
+            media_type='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    async def outcome():
+        comic_pages = await service.generate_comic_script_async(
+            prompt, page_count, rows_per_page, bypass_cache=bypass_cache
+        )
+        body = {"success": True, "pages": comic_pages, "page_count": len(comic_pages)}
+        return 200, body, {'X-Cache': 'HIT' if service.cache_hit else 'MISS'}
+
+    try:
+        status_code, body, headers = await request_deduplicator.run_async(
+            request.url.path, data, request.headers.get('idempotency-key'),
+            data.get('api_key') or data.get('google_api_key'), outcome
+        )
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse(body, status_code, headers=headers)
+
+
+async_routes = [
+    Route('/api/generate', generate_comic, methods=['POST', 'OPTIONS']),
+    Route('/api/generate-image', generate_comic_image, methods=['POST', 'OPTIONS']),
+    Route('/api/generate-cover', generate_comic_cover, methods=['POST', 'OPTIONS']),
+]
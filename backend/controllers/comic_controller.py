@@ -1,11 +1,66 @@
 """Comic controller - handles comic script generation endpoints"""
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import json
+from typing import Optional
+from core.scheduler import RateLimitedError
+from core.single_flight import IdempotencyConflictError, request_deduplicator
 from services.comic_service import ComicService, validate_script
 
 comic_bp = Blueprint('comic', __name__)
 
 
+def _ndjson_script_stream(service: ComicService, prompt: str, page_count: int, rows_per_page: int, bypass_cache: bool):
+    """Yield one NDJSON line per completed page, then a done (or error) line"""
+    index = 0
+    try:
+        for page in service.stream_comic_script(prompt, page_count, rows_per_page, bypass_cache=bypass_cache):
+            yield json.dumps({"type": "page", "index": index, "page": page}, ensure_ascii=False) + "\n"
+            index += 1
+        yield json.dumps({"type": "done", "page_count": index, "cached": service.cache_hit}) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+
+def _script_request(data: dict) -> tuple[Optional[ComicService], tuple, Optional[str]]:
+    """Service and (prompt, page_count, rows_per_page, bypass_cache) for a script request, or an error"""
+    api_key = data.get('api_key')
+    google_api_key = data.get('google_api_key')
+    prompt = data.get('prompt')
+
+    if not api_key and not google_api_key:
+        return None, (), "Either OpenAI API key or Google API key is required"
+
+    if not prompt:
+        return None, (), "Prompt is required"
+
+    # Optional parameters
+    page_count = data.get('page_count', 3)
+    base_url = data.get('base_url', 'https://api.openai.com/v1')
+    model = data.get('model', 'gpt-4o-mini')
+    comic_style = data.get('comic_style', 'doraemon')
+    language = data.get('language', 'zh')
+    rows_per_page = data.get('rows_per_page', 4)
+
+    # Validate page count
+    if not isinstance(page_count, int) or page_count < 1 or page_count > 10:
+        return None, (), "Page count must be between 1 and 10"
+
+    # Validate rows per page
+    if not isinstance(rows_per_page, int) or rows_per_page < 1 or rows_per_page > 5:
+        return None, (), "Rows per page must be between 1 and 5"
+
+    service = ComicService(api_key, base_url, model, comic_style, language, google_api_key=google_api_key)
+    return service, (prompt, page_count, rows_per_page, bool(data.get('bypass_cache', False))), None
+
+
+def _script_outcome(service: ComicService, prompt: str, page_count: int, rows_per_page: int,
+                    bypass_cache: bool) -> tuple[int, dict, dict]:
+    """Status, body and headers of a non-streaming script request"""
+    comic_pages = service.generate_comic_script(prompt, page_count, rows_per_page, bypass_cache=bypass_cache)
+    body = {"success": True, "pages": comic_pages, "page_count": len(comic_pages)}
+    return 200, body, {'X-Cache': 'HIT' if service.cache_hit else 'MISS'}
+
+
 @comic_bp.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -23,8 +78,20 @@ def generate_comic():
         "prompt": "description of the comic",
         "page_count": 3,
         "base_url": "https://api.openai.com/v1",  # optional
-        "model": "gpt-4o-mini"  # optional
+        "model": "gpt-4o-mini",  # optional
+        "bypass_cache": false,  # optional, skip the script memo cache
+        "stream": false  # optional, stream pages as NDJSON as they complete
     }
+
+    With "stream": true the response is application/x-ndjson with lines
+    {"type": "page", "index": 0, "page": {...}} for each page, followed by
+    {"type": "done", "page_count": N, "cached": false} or
+    {"type": "error", "error": "..."}.
+
+    The X-Cache response header is HIT when the script came from the
+    memo cache and MISS otherwise. Concurrent identical non-streaming
+    requests share one generation, and a request with an Idempotency-Key
+    header replays the stored response of an earlier success with that key.
     """
     try:
         data = request.get_json()
@@ -32,45 +99,32 @@ def generate_comic():
         # Validate required fields
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
-        
-        api_key = data.get('api_key')
-        google_api_key = data.get('google_api_key')
-        prompt = data.get('prompt')
-        
-        if not api_key and not google_api_key:
-            return jsonify({"error": "Either OpenAI API key or Google API key is required"}), 400
-        
-        if not prompt:
-            return jsonify({"error": "Prompt is required"}), 400
-        
-        # Optional parameters
-        page_count = data.get('page_count', 3)
-        base_url = data.get('base_url', 'https://api.openai.com/v1')
-        model = data.get('model', 'gpt-4o-mini')
-        comic_style = data.get('comic_style', 'doraemon')
-        language = data.get('language', 'zh')
-        rows_per_page = data.get('rows_per_page', 4)
-
-        # Validate page count
-        if not isinstance(page_count, int) or page_count < 1 or page_count > 10:
-            return jsonify({"error": "Page count must be between 1 and 10"}), 400
-
-        # Validate rows per page
-        if not isinstance(rows_per_page, int) or rows_per_page < 1 or rows_per_page > 5:
-            return jsonify({"error": "Rows per page must be between 1 and 5"}), 400
-
-        # Generate comic script
-        service = ComicService(api_key, base_url, model, comic_style, language, google_api_key=google_api_key)
-        comic_pages = service.generate_comic_script(prompt, page_count, rows_per_page)
-        
-        return jsonify({
-            "success": True,
-            "pages": comic_pages,
-            "page_count": len(comic_pages)
-        })
+
+        service, script_args, error = _script_request(data)
+        if error:
+            return jsonify({"error": error}), 400
+        prompt, page_count, rows_per_page, bypass_cache = script_args
+
+        if data.get('stream'):
+            return Response(
+                stream_with_context(_ndjson_script_stream(service, prompt, page_count, rows_per_page, bypass_cache)),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        status_code, body, headers = request_deduplicator.run(
+            request.path, data, request.headers.get('Idempotency-Key'),
+            data.get('api_key') or data.get('google_api_key'),
+            lambda: _script_outcome(service, prompt, page_count, rows_per_page, bypass_cache)
+        )
+        return jsonify(body), status_code, headers
         
     except json.JSONDecodeError:
         return jsonify({"error": "Invalid JSON format"}), 400
+    except IdempotencyConflictError as e:
+        return jsonify({"error": str(e)}), 422
+    except RateLimitedError as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1,11 +1,145 @@
 """Image controller - handles image generation and proxy endpoints"""
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+import logging
 import os
+from typing import Optional
+from core.image_proxy import ProxyError
+from core.image_store import image_store
+from core.job_queue import image_job_queue, QueueFullError
+from core.logging_config import summarize
+from core.retry_policy import CircuitOpenError
+from core.scheduler import RateLimitedError
+from core.single_flight import IdempotencyConflictError, request_deduplicator
 from services.image_service import ImageService
+from services.reference_selection import validate_strategy
+
+logger = logging.getLogger(__name__)
 
 image_bp = Blueprint('image', __name__)
 
 
+def _wants_async(data) -> bool:
+    """Whether the caller asked for a background job instead of a blocking call"""
+    if data.get('async'):
+        return True
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def _image_result(image_url: str, prompt: str) -> dict:
+    """Response body for a generated image, including its downscaled variants"""
+    return {
+        "success": True,
+        "image_url": image_url,
+        "variants": image_store.variants_for_url(image_url),
+        "prompt": prompt
+    }
+
+
+def _retry_later_response(error, status_code: int):
+    """Error response telling the client when the call may be tried again"""
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.5)))
+    return response, status_code
+
+
+def _page_params(data: dict) -> tuple[Optional[dict], Optional[str]]:
+    """Service arguments for a page request, or an error message"""
+    page_data = data.get('page_data')
+    if not page_data:
+        return None, "Page data is required"
+
+    google_api_key = data.get('google_api_key')
+    if not google_api_key:
+        return None, "Google API key is required"
+
+    reference_strategy = data.get('reference_strategy')
+    strategy_error = validate_strategy(reference_strategy)
+    if strategy_error:
+        return None, strategy_error
+
+    return {
+        "page_data": page_data,
+        "comic_style": data.get('comic_style', 'doraemon'),
+        "reference_img": data.get('reference_img'),
+        "extra_body": data.get('extra_body'),
+        "google_api_key": google_api_key,
+        "rows_per_page": data.get('rows_per_page'),
+        "language": data.get('language', 'en'),
+        "reference_strategy": reference_strategy,
+        "bypass_cache": bool(data.get('bypass_cache', False)),
+        "comic_id": data.get('comic_id'),
+        "hedge": None if data.get('hedge') is None else bool(data.get('hedge'))
+    }, None
+
+
+def _cover_params(data: dict) -> tuple[Optional[dict], Optional[str]]:
+    """Service arguments for a cover request, or an error message"""
+    google_api_key = data.get('google_api_key')
+    if not google_api_key:
+        return None, "Google API key is required"
+
+    reference_strategy = data.get('reference_strategy')
+    strategy_error = validate_strategy(reference_strategy)
+    if strategy_error:
+        return None, strategy_error
+
+    return {
+        "comic_style": data.get('comic_style', 'doraemon'),
+        "google_api_key": google_api_key,
+        "reference_imgs": data.get('reference_imgs'),
+        "language": data.get('language', 'en'),
+        "custom_requirements": data.get('custom_requirements', ''),
+        "reference_strategy": reference_strategy,
+        "bypass_cache": bool(data.get('bypass_cache', False)),
+        "comic_id": data.get('comic_id'),
+        "hedge": None if data.get('hedge') is None else bool(data.get('hedge'))
+    }, None
+
+
+def _job_response_body(job) -> dict:
+    """Body of the 202 response pointing at a queued job"""
+    return {
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.job_id}",
+        "events_url": f"/api/jobs/{job.job_id}/events"
+    }
+
+
+def _run_image_job(generate, **kwargs):
+    """Job body shared by page and cover generation"""
+    image_url, prompt = generate(**kwargs)
+    if not image_url:
+        raise ValueError("Image generation failed")
+    return _image_result(image_url, prompt)
+
+
+def _image_outcome(kind: str, wants_async: bool, generate, params: dict) -> tuple[int, dict, dict]:
+    """Status, body and headers of a page or cover request"""
+    if wants_async:
+        try:
+            job = image_job_queue.submit(kind, _run_image_job, generate, **params)
+        except QueueFullError as e:
+            return 503, {"error": str(e)}, {}
+        return 202, _job_response_body(job), {}
+
+    image_url, prompt = generate(**params)
+    if not image_url:
+        return 500, {"error": f"{kind.capitalize()} generation failed"}, {}
+    return 200, _image_result(image_url, prompt), {}
+
+
+def _deduplicated_image(kind: str, data: dict, params: dict, generate):
+    """Run a page or cover request once for concurrent duplicates and Idempotency-Key retries"""
+    wants_async = _wants_async(data)
+    status_code, body, headers = request_deduplicator.run(
+        request.path, {"body": data, "async": wants_async}, request.headers.get('Idempotency-Key'),
+        params['google_api_key'], lambda: _image_outcome(kind, wants_async, generate, params)
+    )
+    return jsonify(body), status_code, headers
+
+
 @image_bp.route('/api/generate-image', methods=['POST'])
 def generate_comic_image():
     """
@@ -16,8 +150,17 @@ def generate_comic_image():
         "page_data": {...},  # comic page data
         "reference_img": "url" or ["url1", "url2"],  # optional reference image(s)
         "comic_style": "doraemon",  # optional comic style
-        "google_api_key": "your-google-api-key"  # required Google API key
+        "google_api_key": "your-google-api-key",  # required Google API key
+        "reference_strategy": "all",  # optional, or {"name": "first_and_recent", "k": 2, "max_refs": 4}
+        "bypass_cache": false,  # optional, skip the image result cache
+        "comic_id": "session-id",  # optional, share a provider context cache across pages
+        "hedge": true,  # optional, duplicate slow provider calls (default IMAGE_HEDGE_ENABLED)
+        "async": false  # optional, return a job id immediately (202)
     }
+
+    Concurrent identical requests share one generation. With an
+    Idempotency-Key header the successful response is stored and replayed
+    (Idempotent-Replayed: true) for retries carrying the same key.
     """
     try:
         data = request.get_json()
@@ -25,45 +168,23 @@ def generate_comic_image():
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
         
-        page_data = data.get('page_data')
-        if not page_data:
-            return jsonify({"error": "Page data is required"}), 400
-        
-        google_api_key = data.get('google_api_key')
-        if not google_api_key:
-            return jsonify({"error": "Google API key is required"}), 400
-        
-        # Optional parameters
-        comic_style = data.get('comic_style', 'doraemon')
-        reference_img = data.get('reference_img')
-        extra_body = data.get('extra_body')
-        rows_per_page = data.get('rows_per_page')
-        language = data.get('language', 'en')
-
-        print(f"extra_body: {extra_body}")
-        print(f"rows_per_page: {rows_per_page}")
-        print(f"language: {language}")
-
-        # Generate image using service
-        image_url, prompt = ImageService.generate_comic_image(
-            page_data=page_data,
-            comic_style=comic_style,
-            reference_img=reference_img,
-            extra_body=extra_body,
-            google_api_key=google_api_key,
-            rows_per_page=rows_per_page,
-            language=language
-        )
-        
-        if not image_url:
-            return jsonify({"error": "Image generation failed"}), 500
-        
-        return jsonify({
-            "success": True,
-            "image_url": image_url,
-            "prompt": prompt
-        })
+        params, error = _page_params(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        logger.info(f"Page request: rows_per_page={params['rows_per_page']}, language={params['language']}")
+        if logger.isEnabledFor(logging.DEBUG):
+            # extra_body carries earlier pages, often as multi-megabyte data URLs
+            logger.debug(f"Page request extra_body: {summarize(params['extra_body'])}")
+
+        return _deduplicated_image('image', data, params, ImageService.generate_comic_image)
         
+    except IdempotencyConflictError as e:
+        return jsonify({"error": str(e)}), 422
+    except RateLimitedError as e:
+        return _retry_later_response(e, 429)
+    except CircuitOpenError as e:
+        return _retry_later_response(e, 503)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -77,49 +198,43 @@ def generate_comic_cover_endpoint():
     {
         "comic_style": "doraemon",
         "google_api_key": "your-google-api-key",
-        "reference_imgs": [...]  # optional reference images
+        "reference_imgs": [...],  # optional reference images
+        "reference_strategy": "all",  # optional reference selection strategy
+        "bypass_cache": false,  # optional, skip the image result cache
+        "comic_id": "session-id",  # optional, share a provider context cache with the pages
+        "hedge": true,  # optional, duplicate slow provider calls (default IMAGE_HEDGE_ENABLED)
+        "async": false  # optional, return a job id immediately (202)
     }
+
+    Duplicate requests and Idempotency-Key retries are handled as for
+    /api/generate-image.
     """
     try:
         data = request.get_json()
-        print(f"[Cover Generation] Received data: {data}")
         
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
-            
-        google_api_key = data.get('google_api_key')
-        if not google_api_key:
-            return jsonify({"error": "Google API key is required"}), 400
-
-        comic_style = data.get('comic_style', 'doraemon')
-        reference_imgs = data.get('reference_imgs')
-        language = data.get('language', 'en')
-        custom_requirements = data.get('custom_requirements', '')
-
-        print(f"[Cover Generation] Language: {language}")
-        print(f"[Cover Generation] Custom requirements: {custom_requirements}")
-        print(f"[Cover Generation] Reference images count: {len(reference_imgs) if reference_imgs else 0}")
-        if reference_imgs:
-            print(f"[Cover Generation] First reference: {reference_imgs[0] if len(reference_imgs) > 0 else 'None'}")
-
-        # Generate cover using service
-        image_url, prompt = ImageService.generate_comic_cover(
-            comic_style=comic_style,
-            google_api_key=google_api_key,
-            reference_imgs=reference_imgs,
-            language=language,
-            custom_requirements=custom_requirements
+
+        params, error = _cover_params(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        reference_imgs = params['reference_imgs']
+        logger.info(
+            f"Cover request: language={params['language']}, "
+            f"references={len(reference_imgs) if reference_imgs else 0}"
         )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Cover request body: {summarize(data)}")
+
+        return _deduplicated_image('cover', data, params, ImageService.generate_comic_cover)
         
-        if not image_url:
-            return jsonify({"error": "Cover generation failed"}), 500
-        
-        return jsonify({
-            "success": True,
-            "image_url": image_url,
-            "prompt": prompt
-        })
-        
+    except IdempotencyConflictError as e:
+        return jsonify({"error": str(e)}), 422
+    except RateLimitedError as e:
+        return _retry_later_response(e, 429)
+    except CircuitOpenError as e:
+        return _retry_later_response(e, 503)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -137,18 +252,20 @@ def proxy_image():
         if not image_url:
             return jsonify({"error": "Image URL is required"}), 400
         
-        # Use service to download image
-        image_content, content_type = ImageService.proxy_image_download(image_url)
-        
-        # Return the image with appropriate headers
-        return Response(
-            image_content,
-            mimetype=content_type,
-            headers={
-                'Content-Disposition': f'attachment; filename=comic-{os.urandom(4).hex()}.png',
-                'Access-Control-Allow-Origin': '*'
-            }
-        )
-        
+        # Use service to open the image; the body is streamed, not buffered
+        image = ImageService.proxy_image_download(image_url)
+
+        headers = {
+            'Content-Disposition': f'attachment; filename=comic-{os.urandom(4).hex()}.png',
+            'Access-Control-Allow-Origin': '*',
+            'X-Cache': image.cache_status
+        }
+        if image.size is not None:
+            headers['Content-Length'] = str(image.size)
+
+        return Response(stream_with_context(image.body), mimetype=image.content_type, headers=headers)
+
+    except ProxyError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
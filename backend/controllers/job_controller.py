@@ -0,0 +1,40 @@
+"""Job controller - handles background job status endpoints"""
+from flask import Blueprint, request, jsonify
+from core.event_stream import sse_response, parse_last_event_id
+from core.job_queue import image_job_queue
+
+job_bp = Blueprint('job', __name__)
+
+
+@job_bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll a background job
+
+    Returns the job status (queued, running, succeeded, failed) and, once
+    finished, its result or error.
+    """
+    job = image_job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@job_bp.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    """
+    Follow a background job over Server-Sent Events
+
+    Emits ``status`` events on state changes and a final ``done`` event
+    carrying the same payload as GET /api/jobs/<job_id>.
+    """
+    job = image_job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    try:
+        after_id = parse_last_event_id(request.headers, request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    return sse_response(job.events, after_id)
@@ -0,0 +1,62 @@
+"""Media controller - serves generated images with long-lived caching"""
+import os
+from flask import Blueprint, request, jsonify, send_file
+from werkzeug.security import safe_join
+from core.image_store import image_store
+
+media_bp = Blueprint('media', __name__)
+
+# Content-addressed files never change under their name
+IMMUTABLE_MAX_AGE = int(os.getenv('IMAGE_IMMUTABLE_MAX_AGE', 31536000))
+# Anything else (legacy flat files) is revalidated after this many seconds
+MUTABLE_MAX_AGE = int(os.getenv('IMAGE_MUTABLE_MAX_AGE', 300))
+
+
+def _select_variant(filename: str, content_hash: str, width: int) -> str:
+    """Return the narrowest stored variant at least ``width`` wide, or the original"""
+    for variant in image_store.variants(content_hash):
+        if variant['width'] >= width:
+            return variant['relative_path'].replace(os.sep, '/')
+    return filename
+
+
+@media_bp.route('/backend/static/images/<path:filename>', methods=['GET', 'HEAD'])
+@media_bp.route('/static/images/<path:filename>', methods=['GET', 'HEAD'])
+def serve_image(filename):
+    """
+    Serve a stored image
+
+    Query parameters:
+        w: Optional display width; the smallest variant at least this wide
+           is served instead of the full-size image
+
+    Content-addressed files get a strong ETag (their hash) and
+    ``Cache-Control: public, max-age=..., immutable``. Conditional requests
+    (If-None-Match / If-Modified-Since) and byte ranges are honoured, and
+    the file body is handed to the server's file wrapper (or X-Sendfile
+    when USE_X_SENDFILE is set) rather than read into memory.
+    """
+    content_hash = image_store.hash_from_url(f"{image_store.url_prefix}/{filename}")
+
+    width = request.args.get('w')
+    if width and content_hash:
+        if not width.isdigit():
+            return jsonify({"error": "w must be a positive integer"}), 400
+        filename = _select_variant(filename, content_hash, int(width))
+
+    path = safe_join(image_store.root, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Image not found"}), 404
+
+    if content_hash:
+        # The file name (hash plus variant suffix) identifies its bytes exactly
+        etag = os.path.splitext(os.path.basename(path))[0]
+        response = send_file(path, conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response = send_file(path, conditional=True, max_age=MUTABLE_MAX_AGE)
+        response.cache_control.public = True
+
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
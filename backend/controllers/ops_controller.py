@@ -0,0 +1,147 @@
+"""Operations controller - exposes scheduler and provider health counters and Prometheus metrics"""
+import time
+
+from flask import Blueprint, Response, g, jsonify, request
+
+from core.hedging import image_hedger
+from core.image_proxy import image_proxy
+from core.job_queue import image_job_queue
+from core.logging_config import logging_stats
+from core.memo_cache import script_memo_cache
+from core.metrics import current_endpoint, http_request_seconds, label_id, metrics
+from core.reference_cache import reference_cache
+from core.result_cache import image_result_cache
+from core.retry_policy import circuit_breakers
+from core.scheduler import provider_scheduler
+from core.single_flight import request_deduplicator
+
+ops_bp = Blueprint('ops', __name__)
+
+
+def _route_label() -> str:
+    """Route template of the current request, so ids in paths do not become labels"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@ops_bp.before_app_request
+def _start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.metrics_token = current_endpoint.set(_route_label())
+
+
+@ops_bp.after_app_request
+def _observe_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None and metrics.enabled:
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=_route_label(), method=request.method, status=str(response.status_code)
+        )
+    return response
+
+
+@ops_bp.teardown_app_request
+def _reset_request_metrics(error):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        try:
+            current_endpoint.reset(token)
+        except ValueError:
+            # Streamed responses may finish in another context
+            pass
+
+
+def _cache_stats() -> dict:
+    return {
+        "script": script_memo_cache.stats(),
+        "idempotency": request_deduplicator.store.stats(),
+        "image_result": image_result_cache.stats(),
+        "reference": reference_cache.stats(),
+        "proxy": image_proxy.stats()
+    }
+
+
+def _cache_request_samples():
+    for cache, stats in _cache_stats().items():
+        for field, result in (('hits', 'hit'), ('misses', 'miss'), ('revalidated', 'revalidated')):
+            if field in stats:
+                yield 'comic_cache_requests_total', {"cache": cache, "result": result}, stats[field]
+
+
+def _cache_hit_ratio_samples():
+    for cache, stats in _cache_stats().items():
+        hits = stats['hits'] + stats.get('revalidated', 0)
+        total = hits + stats['misses']
+        if total:
+            yield 'comic_cache_hit_ratio', {"cache": cache}, hits / total
+
+
+def _queue_samples():
+    scheduler = provider_scheduler.stats()
+    jobs = image_job_queue.stats()
+    yield 'comic_queue_depth', {"queue": "provider_in_flight"}, scheduler['in_flight']
+    yield 'comic_queue_depth', {"queue": "provider_waiting"}, scheduler['queued']
+    yield 'comic_queue_depth', {"queue": "image_jobs_queued"}, jobs['queued']
+    yield 'comic_queue_depth', {"queue": "image_jobs_running"}, jobs['running']
+
+
+def _breaker_label(name: str) -> str:
+    """Breakers are named "<provider>:<key fingerprint>"; never export the fingerprint itself"""
+    provider, _, fingerprint = name.rpartition(':')
+    return f"{provider}:{label_id(fingerprint)}" if provider else label_id(name)
+
+
+def _circuit_samples():
+    for name, stats in circuit_breakers.stats().items():
+        yield 'comic_circuit_open', {"breaker": _breaker_label(name)}, 0 if stats['state'] == 'closed' else 1
+
+
+metrics.register_collector(
+    'comic_cache_requests_total', 'counter', 'Cache lookups by cache and result', _cache_request_samples
+)
+metrics.register_collector(
+    'comic_cache_hit_ratio', 'gauge', 'Share of cache lookups served from the cache', _cache_hit_ratio_samples
+)
+metrics.register_collector(
+    'comic_queue_depth', 'gauge', 'Provider calls and image jobs in flight or waiting', _queue_samples
+)
+metrics.register_collector(
+    'comic_circuit_open', 'gauge', '1 while a provider circuit breaker is open or half-open', _circuit_samples
+)
+
+
+@ops_bp.route('/api/stats', methods=['GET'])
+def stats():
+    """
+    Provider scheduling statistics
+
+    Returns queue depth, in-flight calls and token bucket state per API key
+    and circuit breaker states (keys appear as salted label ids, never as
+    fingerprints), hedging counters and the image
+    job queue depth, plus request coalescing and idempotent replay counts
+    and the logging queue (records waiting and dropped).
+    """
+    scheduler = provider_scheduler.stats()
+    scheduler["keys"] = {label_id(fingerprint): state for fingerprint, state in scheduler["keys"].items()}
+    return jsonify({
+        "scheduler": scheduler,
+        "circuit_breakers": {_breaker_label(name): state for name, state in circuit_breakers.stats().items()},
+        "hedging": image_hedger.stats(),
+        "image_jobs": image_job_queue.stats(),
+        "deduplication": request_deduplicator.stats(),
+        "logging": logging_stats()
+    })
+
+
+@ops_bp.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Metrics in the Prometheus text exposition format
+
+    Request latency per route, image generation stage latency, provider
+    call latency, retries and error classes per model and endpoint,
+    reference bytes uploaded, cache hit ratios and queue depths.
+    """
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,124 @@
+"""Pipeline controller - handles server-side whole-comic generation endpoints"""
+from flask import Blueprint, request, jsonify
+from core.event_stream import sse_response, parse_last_event_id
+from services.comic_pipeline_service import ComicPipelineService, PipelineBusyError
+from services.reference_selection import validate_strategy
+
+pipeline_bp = Blueprint('pipeline', __name__)
+
+
+@pipeline_bp.route('/api/generate-comic', methods=['POST'])
+def generate_comic_pipeline():
+    """
+    Generate a whole comic (script, page images, cover) on the server
+
+    Streams Server-Sent Events: run, script, page, page_error, cover,
+    cover_error, error and finally done. The run keeps going if the client
+    disconnects; reconnect with GET /api/generate-comic/<run_id>/events.
+
+    Expected JSON body:
+    {
+        "google_api_key": "your-google-api-key",  # required for images
+        "api_key": "your-openai-api-key",  # optional, used for the script
+        "prompt": "description of the comic",  # required unless pages given
+        "pages": [...],  # optional, skip script generation
+        "page_count": 3,
+        "rows_per_page": 4,
+        "comic_style": "doraemon",
+        "language": "zh",
+        "base_url": "https://api.openai.com/v1",  # optional
+        "model": "gpt-4o-mini",  # optional
+        "reference_img": "data:image/png;base64,...",  # optional
+        "parallel_pages": false,  # pages 2..N only reference page 1
+        "reference_strategy": "all",  # optional, per-page reference selection
+        "cover_reference_strategy": "all",  # optional, cover reference selection
+        "generate_cover": true,
+        "cover_requirements": ""  # optional
+    }
+    """
+    try:
+        data = request.get_json()
+
+        if not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+
+        google_api_key = data.get('google_api_key')
+        if not google_api_key:
+            return jsonify({"error": "Google API key is required"}), 400
+
+        pages = data.get('pages')
+        prompt = data.get('prompt')
+        if not pages and not prompt:
+            return jsonify({"error": "Prompt is required"}), 400
+        if pages is not None and not isinstance(pages, list):
+            return jsonify({"error": "Pages must be a list"}), 400
+
+        page_count = data.get('page_count', 3)
+        rows_per_page = data.get('rows_per_page', 4)
+
+        if not isinstance(page_count, int) or page_count < 1 or page_count > 10:
+            return jsonify({"error": "Page count must be between 1 and 10"}), 400
+
+        if not isinstance(rows_per_page, int) or rows_per_page < 1 or rows_per_page > 5:
+            return jsonify({"error": "Rows per page must be between 1 and 5"}), 400
+
+        for field in ('reference_strategy', 'cover_reference_strategy'):
+            strategy_error = validate_strategy(data.get(field))
+            if strategy_error:
+                return jsonify({"error": strategy_error}), 400
+
+        params = {
+            "api_key": data.get('api_key'),
+            "google_api_key": google_api_key,
+            "prompt": prompt,
+            "pages": pages,
+            "page_count": page_count,
+            "rows_per_page": rows_per_page,
+            "comic_style": data.get('comic_style', 'doraemon'),
+            "language": data.get('language', 'zh'),
+            "base_url": data.get('base_url', 'https://api.openai.com/v1'),
+            "model": data.get('model', 'gpt-4o-mini'),
+            "reference_img": data.get('reference_img'),
+            "parallel_pages": bool(data.get('parallel_pages', False)),
+            "generate_cover": bool(data.get('generate_cover', True)),
+            "cover_requirements": data.get('cover_requirements', ''),
+            "reference_strategy": data.get('reference_strategy'),
+            "cover_reference_strategy": data.get('cover_reference_strategy')
+        }
+
+        run = ComicPipelineService.start(params)
+        return sse_response(run.events, headers={'X-Run-Id': run.run_id})
+
+    except PipelineBusyError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@pipeline_bp.route('/api/generate-comic/<run_id>', methods=['GET'])
+def get_comic_pipeline(run_id):
+    """Return the current state of a pipeline run"""
+    run = ComicPipelineService.get_run(run_id)
+    if not run:
+        return jsonify({"error": "Pipeline run not found"}), 404
+    return jsonify(run.to_dict())
+
+
+@pipeline_bp.route('/api/generate-comic/<run_id>/events', methods=['GET'])
+def stream_comic_pipeline(run_id):
+    """
+    Re-attach to a pipeline run's event stream
+
+    Replays events after the Last-Event-ID header (or ``last_event_id``
+    query parameter), then follows live events until the run is done.
+    """
+    run = ComicPipelineService.get_run(run_id)
+    if not run:
+        return jsonify({"error": "Pipeline run not found"}), 404
+
+    try:
+        after_id = parse_last_event_id(request.headers, request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    return sse_response(run.events, after_id, headers={'X-Run-Id': run.run_id})
@@ -1,6 +1,7 @@
 """Prompt optimization controller - handles prompt optimization endpoints"""
 from flask import Blueprint, request, jsonify
 import json
+from core.scheduler import RateLimitedError
 from services.prompt_optimizer_service import PromptOptimizerService
 
 prompt_bp = Blueprint('prompt', __name__)
@@ -68,5 +69,7 @@ def optimize_prompt():
         
     except json.JSONDecodeError:
         return jsonify({"error": "Invalid JSON format"}), 400
+    except RateLimitedError as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
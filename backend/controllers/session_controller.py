@@ -1,6 +1,7 @@
 """Session controller - handles session title generation endpoints"""
 from flask import Blueprint, request, jsonify
 import json
+from core.scheduler import RateLimitedError
 from services.session_title_service import SessionTitleService
 
 session_bp = Blueprint('session', __name__)
@@ -67,5 +68,7 @@ def generate_session_title():
 
     except json.JSONDecodeError:
         return jsonify({"error": "Invalid JSON format"}), 400
+    except RateLimitedError as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,6 +1,7 @@
 """Social media controller - handles social media content generation endpoints"""
 from flask import Blueprint, request, jsonify
 import json
+from core.scheduler import RateLimitedError
 from services.social_media_service import SocialMediaService
 
 social_bp = Blueprint('social', __name__)
@@ -52,5 +53,7 @@ def generate_xiaohongshu_content():
         
     except json.JSONDecodeError as e:
         return jsonify({"error": f"JSON parsing failed: {str(e)}"}), 500
+    except RateLimitedError as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
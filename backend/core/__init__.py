@@ -0,0 +1,31 @@
+# Core infrastructure package
+from .client_registry import ClientRegistry, client_registry
+from .event_stream import EventLog
+from .stream_buffer import StreamBufferTimeoutError, drain_stream, adrain_stream
+from .job_queue import JobQueue, Job, QueueFullError, image_job_queue
+from .reference_cache import ReferenceImageCache, reference_cache
+from .memory_budget import MemoryBudget, MemoryBudgetExceededError
+from .image_io import ImageIOPool, image_io_pool, atomic_write
+from .image_proxy import ImageProxy, ProxiedImage, ProxyError, image_proxy
+from .image_store import ImageStore, StoredImage, image_store
+from .sqlite_lru import SqliteLRU
+from .result_cache import ImageResultCache, image_result_cache
+from .memo_cache import MemoCache, script_memo_cache, normalize_prompt
+from .hedging import Hedger, image_hedger
+from .scheduler import ProviderScheduler, RateLimitedError, provider_scheduler
+from .retry_policy import RetryPolicy, CircuitBreaker, CircuitOpenError, NonRetryableError, circuit_breakers
+from .metrics import MetricsRegistry, metrics
+from .logging_config import BoundedQueueHandler, configure_logging, summarize
+from .single_flight import SingleFlight, RequestDeduplicator, IdempotencyConflictError, request_deduplicator
+
+__all__ = ['ClientRegistry', 'client_registry', 'EventLog',
+           'StreamBufferTimeoutError', 'drain_stream', 'adrain_stream', 'JobQueue', 'Job', 'QueueFullError', 'image_job_queue',
+           'ReferenceImageCache', 'reference_cache', 'MemoryBudget', 'MemoryBudgetExceededError',
+           'ImageStore', 'StoredImage', 'image_store',
+           'ImageIOPool', 'image_io_pool', 'atomic_write',
+           'ImageProxy', 'ProxiedImage', 'ProxyError', 'image_proxy', 'ImageResultCache', 'image_result_cache',
+           'SqliteLRU', 'MemoCache', 'script_memo_cache', 'normalize_prompt',
+           'RetryPolicy', 'CircuitBreaker', 'CircuitOpenError', 'NonRetryableError', 'circuit_breakers',
+           'Hedger', 'image_hedger', 'ProviderScheduler', 'RateLimitedError', 'provider_scheduler',
+           'SingleFlight', 'RequestDeduplicator', 'IdempotencyConflictError', 'request_deduplicator',
+           'MetricsRegistry', 'metrics', 'BoundedQueueHandler', 'configure_logging', 'summarize']
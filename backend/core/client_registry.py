@@ -0,0 +1,343 @@
+"""Shared provider client registry with keep-alive connection pools"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import httpx
+from google import genai
+from langchain_openai import ChatOpenAI
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+
+# Close tasks scheduled on an event loop, referenced until they finish
+_closing: Set["asyncio.Future[Any]"] = set()
+
+
+class _Entry:
+    """A cached client, the callable that releases it and its lease count"""
+
+    def __init__(self, client: Any, closer: Callable[[Optional[asyncio.AbstractEventLoop]], None]):
+        self.client = client
+        self.closer = closer
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+        # Event loop the client was last leased or released on; async
+        # connections belong to it and must be closed there
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def note_loop(self):
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+
+
+def _close_async(aclose: Callable[[], Any], loop: Optional[asyncio.AbstractEventLoop]):
+    """
+    Close an async client on the event loop its connections belong to
+
+    From that loop's thread the close runs as a task, from any other thread
+    it is submitted to the loop. A client never used on a loop holds no
+    loop-bound connections and is closed on a temporary loop.
+    """
+    if loop is not None and loop.is_closed():
+        # Its connections were torn down with the loop
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    target = loop or running
+    if target is None:
+        asyncio.run(aclose())
+        return
+    if target is running:
+        task = target.create_task(aclose())
+    else:
+        task = asyncio.run_coroutine_threadsafe(aclose(), target)
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+class ClientLease:
+    """
+    One caller's hold on a registry client.
+
+    An evicted client is only closed once every lease on it is released,
+    so a request can keep using its client across retries. Use it as a
+    context manager (``with registry.lease_genai_client(key) as client:``,
+    or ``async with`` next to other async context managers) or keep it and
+    call ``release()`` when done.
+    """
+
+    def __init__(self, registry: "ClientRegistry", entry: _Entry):
+        self.client = entry.client
+        self._registry = registry
+        self._entry: Optional[_Entry] = entry
+
+    def release(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._registry._release(entry)
+
+    def __enter__(self) -> Any:
+        return self.client
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self) -> Any:
+        return self.client
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of provider SDK clients.
+
+    Clients are keyed by (provider, API key fingerprint, base_url, options) so
+    that repeated requests with the same credentials reuse one client and its
+    keep-alive HTTP connection pool instead of paying SDK setup and TLS
+    handshakes on every call. The registry is bounded: the least recently
+    used client is evicted once ``max_clients`` is exceeded, and clients
+    unleased for longer than ``idle_timeout`` seconds are evicted on the next
+    lookup. Callers hold a ClientLease for as long as they use a client; an
+    evicted client is closed when its last lease is released.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = 32,
+        idle_timeout: float = 300.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0
+    ):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _fingerprint(api_key: str) -> str:
+        """Hash the API key so raw secrets are never used as dictionary keys"""
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def _lease(self, key: Tuple, factory: Callable[[], _Entry]) -> ClientLease:
+        """Lease the cached client for ``key``, creating it with ``factory`` on a miss"""
+        to_close = []
+        with self._lock:
+            now = time.monotonic()
+            for stale_key, entry in list(self._entries.items()):
+                if entry.leases == 0 and now - entry.last_used > self.idle_timeout:
+                    to_close.append(self._evict(stale_key))
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+                entry = factory()
+                self._entries[key] = entry
+                while len(self._entries) > self.max_clients:
+                    evicted = self._evict(next(iter(self._entries)))
+                    if evicted.leases == 0:
+                        to_close.append(evicted)
+            entry.leases += 1
+            entry.last_used = now
+            entry.note_loop()
+
+        # Close outside the lock; evicted clients still leased are closed
+        # by their last release instead
+        for stale in to_close:
+            self._close(stale)
+        return ClientLease(self, entry)
+
+    def _evict(self, key: Tuple) -> _Entry:
+        """Remove ``key`` from the registry (caller holds the lock)"""
+        entry = self._entries.pop(key)
+        entry.evicted = True
+        self._evictions += 1
+        return entry
+
+    def _release(self, entry: _Entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            entry.note_loop()
+            close = entry.evicted and entry.leases == 0
+        if close:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry: _Entry):
+        try:
+            entry.closer(entry.loop)
+        except Exception as e:
+            logger.warning(f"Failed to close provider client: {e}")
+
+    def lease_genai_client(self, api_key: str, timeout_ms: Optional[int] = None) -> ClientLease:
+        """
+        Lease a shared Google GenAI client
+
+        Args:
+            api_key: Google API key
+            timeout_ms: Optional request timeout in milliseconds
+
+        Returns:
+            ClientLease of a genai.Client bound to a pooled httpx connection;
+            ``client.aio`` shares the key and options with its own async pool
+        """
+        base_url = os.getenv('GOOGLE_GEMINI_BASE_URL')
+        key = ('genai', self._fingerprint(api_key), base_url, timeout_ms)
+
+        def factory() -> _Entry:
+            http_options: Dict[str, Any] = {
+                'client_args': {'limits': self.limits},
+                'async_client_args': {'limits': self.limits}
+            }
+            if timeout_ms is not None:
+                http_options['timeout'] = timeout_ms
+            if base_url:
+                http_options['base_url'] = base_url
+            client = genai.Client(api_key=api_key, vertexai=False, http_options=http_options)
+
+            def close(loop: Optional[asyncio.AbstractEventLoop]):
+                client.close()
+                _close_async(client.aio.aclose, loop)
+
+            return _Entry(client, close)
+
+        return self._lease(key, factory)
+
+    def lease_openai_client(self, api_key: str, base_url: str) -> ClientLease:
+        """
+        Lease a shared OpenAI SDK client
+
+        Args:
+            api_key: OpenAI API key
+            base_url: OpenAI-compatible base URL
+
+        Returns:
+            ClientLease of an OpenAI client bound to a pooled httpx connection
+        """
+        key = ('openai', self._fingerprint(api_key), base_url)
+
+        def factory() -> _Entry:
+            http_client = httpx.Client(limits=self.limits, timeout=httpx.Timeout(600.0, connect=10.0))
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+            return _Entry(client, lambda loop: client.close())
+
+        return self._lease(key, factory)
+
+    def lease_async_openai_client(self, api_key: str, base_url: str) -> ClientLease:
+        """
+        Lease a shared AsyncOpenAI SDK client
+
+        Args:
+            api_key: OpenAI API key
+            base_url: OpenAI-compatible base URL
+
+        Returns:
+            ClientLease of an AsyncOpenAI client bound to a pooled async
+            httpx connection
+        """
+        key = ('async_openai', self._fingerprint(api_key), base_url)
+
+        def factory() -> _Entry:
+            http_client = httpx.AsyncClient(limits=self.limits, timeout=httpx.Timeout(600.0, connect=10.0))
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+            return _Entry(client, lambda loop: _close_async(client.close, loop))
+
+        return self._lease(key, factory)
+
+    def lease_chat_openai(
+        self,
+        api_key: str,
+        base_url: str,
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> ClientLease:
+        """
+        Lease a shared LangChain ChatOpenAI model
+
+        Args:
+            api_key: OpenAI API key
+            base_url: OpenAI-compatible base URL
+            model: Model name
+            temperature: Sampling temperature
+            max_tokens: Maximum completion tokens
+
+        Returns:
+            ClientLease of a ChatOpenAI instance bound to a pooled httpx connection
+        """
+        key = ('chat_openai', self._fingerprint(api_key), base_url, model, temperature, max_tokens)
+
+        def factory() -> _Entry:
+            http_client = httpx.Client(limits=self.limits, timeout=httpx.Timeout(600.0, connect=10.0))
+            # Used by ainvoke/astream in the async serving mode
+            http_async_client = httpx.AsyncClient(limits=self.limits, timeout=httpx.Timeout(600.0, connect=10.0))
+            llm = ChatOpenAI(
+                model=model,
+                openai_api_key=api_key,
+                base_url=base_url,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+
+            def close(loop: Optional[asyncio.AbstractEventLoop]):
+                http_client.close()
+                _close_async(http_async_client.aclose, loop)
+
+            return _Entry(llm, close)
+
+        return self._lease(key, factory)
+
+    def close_all(self):
+        """Evict every cached client; leased ones close on their last release"""
+        with self._lock:
+            entries = [self._evict(key) for key in list(self._entries)]
+        for entry in entries:
+            if entry.leases == 0:
+                self._close(entry)
+
+    def stats(self) -> Dict[str, int]:
+        """Return registry counters"""
+        with self._lock:
+            return {
+                "live_clients": len(self._entries),
+                "leased": sum(1 for entry in self._entries.values() if entry.leases),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
+client_registry = ClientRegistry(
+    max_clients=int(os.getenv('CLIENT_POOL_MAX_CLIENTS', 32)),
+    idle_timeout=float(os.getenv('CLIENT_POOL_IDLE_TIMEOUT', 300)),
+    max_connections=int(os.getenv('CLIENT_POOL_MAX_CONNECTIONS', 20)),
+    max_keepalive_connections=int(os.getenv('CLIENT_POOL_MAX_KEEPALIVE', 10))
+)
@@ -0,0 +1,243 @@
+"""Provider-side (Gemini explicit) context caches scoped to one comic"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.genai import types
+
+from core.client_registry import client_registry
+from core.scheduler import RateLimitedError, provider_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    """A created provider cache, or a remembered failure to create one"""
+
+    def __init__(self, comic_id: str, key_id: str, name: Optional[str], expires_at: float,
+                 part_hashes: List[str]):
+        self.comic_id = comic_id
+        # Fingerprint of the API key that owns the cache
+        self.key_id = key_id
+        self.name = name
+        self.expires_at = expires_at
+        # Digests of the reference parts the cache holds, in order
+        self.part_hashes = part_hashes
+
+
+class ContextCacheManager:
+    """
+    Create one Gemini cached-content object per comic and reuse it.
+
+    The stable part of every page request of a comic (the static
+    instructions and the references that do not change from page to page:
+    user anchors and the first page) is uploaded once with
+    ``client.caches.create``; later calls pass the returned name as
+    ``cached_content`` and send only what changes. There is one cache per
+    comic, API key fingerprint, model and instructions. It is replaced only
+    when a request's stable references extend what it holds (the first page
+    becomes available); a request whose stable references differ in any
+    other way is sent inline rather than creating another cache. Caches
+    expire after ``ttl`` seconds on both sides and are deleted early by
+    ``release``.
+
+    Creation may be refused by the provider (too few tokens, model without
+    caching support); the failure is remembered for ``ttl`` so callers fall
+    back to inline content without retrying on every page. Creation takes
+    a provider scheduler slot like any other call.
+
+    Expired entries are dropped on lookup and at most ``max_entries`` are
+    tracked; the least recently used one is forgotten beyond that (its
+    provider cache then simply runs out its TTL).
+    """
+
+    def __init__(self, enabled: bool = False, ttl: float = 3600.0, reference_count: int = 2,
+                 max_entries: int = 256):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.reference_count = reference_count
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, _CacheEntry]" = OrderedDict()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+        self._failed = 0
+
+    @staticmethod
+    def _key_id(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def _forget(self, key: Tuple):
+        """Drop an entry and its creation lock (caller holds ``_lock``)"""
+        self._entries.pop(key, None)
+        self._key_locks.pop(key, None)
+
+    def _prune(self, now: float):
+        """Drop expired entries (caller holds ``_lock``)"""
+        for key, entry in list(self._entries.items()):
+            if entry.expires_at <= now:
+                self._forget(key)
+
+    @staticmethod
+    def _part_hashes(parts: List[types.Part]) -> List[str]:
+        return [hashlib.sha256(part.inline_data.data).hexdigest() for part in parts]
+
+    def get_or_create(
+        self,
+        client: Any,
+        api_key: str,
+        comic_id: str,
+        model: str,
+        instructions: str,
+        parts: List[types.Part]
+    ) -> Optional[str]:
+        """
+        Return the name of the comic's cache if it holds ``instructions`` and ``parts``
+
+        Args:
+            client: genai Client for the API key
+            api_key: API key, only fingerprinted for the cache key
+            comic_id: Comic (session or pipeline run) the cache belongs to
+            model: Model the cache is created for
+            instructions: Static system instructions
+            parts: The request's stable reference Parts (anchors, first
+                page), which lead its references
+
+        Returns:
+            Cached content name, or None when the request must be sent inline
+        """
+        if not self.enabled or not comic_id:
+            return None
+        key_id = self._key_id(api_key)
+        key = (
+            comic_id,
+            key_id,
+            model,
+            hashlib.sha256(instructions.encode('utf-8')).hexdigest()
+        )
+        part_hashes = self._part_hashes(parts)
+        with self._lock:
+            self._prune(time.time())
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One creation per key; concurrent pages of the same comic wait for it
+        with key_lock:
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    if entry.part_hashes == part_hashes:
+                        if entry.name:
+                            self._reused += 1
+                        return entry.name
+                    held = len(entry.part_hashes)
+                    if len(part_hashes) <= held or part_hashes[:held] != entry.part_hashes:
+                        # Not an extension of the cached prefix: send inline
+                        return None
+                else:
+                    entry = None
+            # No cache yet, or the stable prefix grew (e.g. the first page exists now)
+            stale = entry
+
+            try:
+                with provider_scheduler.slot(api_key):
+                    cached = client.caches.create(
+                        model=model,
+                        config=types.CreateCachedContentConfig(
+                            display_name=f"comic-{comic_id}"[:128],
+                            system_instruction=instructions,
+                            contents=[types.Content(role='user', parts=parts)] if parts else None,
+                            ttl=f"{int(self.ttl)}s"
+                        )
+                    )
+                # Stop using the cache a little before the provider drops it
+                entry = _CacheEntry(comic_id, key_id, cached.name, now + self.ttl * 0.9, part_hashes)
+                logger.info(f"Created context cache {cached.name} for comic {comic_id} ({len(parts)} references)")
+                with self._lock:
+                    self._created += 1
+            except RateLimitedError as e:
+                # Congestion is not a property of the content; try again on a later page
+                logger.info(f"Context cache for comic {comic_id} deferred, sending inline: {e}")
+                return None
+            except Exception as e:
+                logger.warning(f"Context cache unavailable for comic {comic_id}, sending inline: {e}")
+                entry = _CacheEntry(comic_id, key_id, None, now + self.ttl, part_hashes)
+                with self._lock:
+                    self._failed += 1
+
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._forget(next(iter(self._entries)))
+            if stale is not None and stale.name:
+                self._delete(client, stale.name)
+            return entry.name
+
+    @staticmethod
+    def _delete(client: Any, name: str):
+        try:
+            client.caches.delete(name=name)
+            logger.info(f"Deleted context cache {name}")
+        except Exception as e:
+            logger.debug(f"Failed to delete context cache {name}: {e}")
+
+    def invalidate(self, name: str):
+        """Forget a cache the provider no longer knows (e.g. expired early)"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    self._forget(key)
+
+    def release(self, comic_id: str, api_key: Optional[str] = None):
+        """
+        Delete every provider cache created for a comic
+
+        Args:
+            comic_id: Comic whose caches are deleted
+            api_key: Key the caches were created with (defaults to
+                GOOGLE_API_KEY / GEMINI_API_KEY, like image generation)
+        """
+        with self._lock:
+            released = [
+                (key, entry) for key, entry in self._entries.items() if entry.comic_id == comic_id
+            ]
+            for key, _ in released:
+                self._forget(key)
+
+        api_key = api_key or os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
+        named = [entry for _, entry in released if entry.name]
+        if not named or not api_key:
+            return
+        key_id = self._key_id(api_key)
+        with client_registry.lease_genai_client(api_key) as client:
+            for entry in named:
+                if entry.key_id != key_id:
+                    # Created with another key; it expires on its own
+                    continue
+                self._delete(client, entry.name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "active": sum(1 for entry in self._entries.values() if entry.name),
+                "created": self._created,
+                "reused": self._reused,
+                "failed": self._failed
+            }
+
+
+context_cache_manager = ContextCacheManager(
+    enabled=os.getenv('GEMINI_CONTEXT_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    ttl=float(os.getenv('GEMINI_CONTEXT_CACHE_TTL', 3600)),
+    reference_count=int(os.getenv('GEMINI_CONTEXT_CACHE_REFERENCES', 2)),
+    max_entries=int(os.getenv('GEMINI_CONTEXT_CACHE_MAX_ENTRIES', 256))
+)
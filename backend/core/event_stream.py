@@ -0,0 +1,103 @@
+"""Replayable event logs and Server-Sent Events formatting"""
+import json
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Response, stream_with_context
+
+
+class EventLog:
+    """
+    Append-only, thread-safe log of events for one long-running task.
+
+    Every event gets a monotonically increasing integer id, so a client that
+    reconnects (for example after a browser tab reload) can pass the last id
+    it saw and replay everything it missed before following live events.
+    """
+
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def append(self, event: str, data: Dict[str, Any]) -> int:
+        """Append an event and wake up subscribers, returning its id"""
+        with self._cond:
+            event_id = len(self._events) + 1
+            self._events.append({"id": event_id, "event": event, "data": data})
+            self._cond.notify_all()
+            return event_id
+
+    def close(self):
+        """Mark the log as complete; subscribers stop after draining it"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        with self._cond:
+            return self._closed
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return a copy of all events recorded so far"""
+        with self._cond:
+            return list(self._events)
+
+    def follow(self, after_id: int = 0, heartbeat: float = 15.0) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Yield events with id greater than ``after_id`` as they arrive
+
+        Yields ``None`` whenever ``heartbeat`` seconds pass without a new
+        event so callers can keep idle connections alive. Returns once the
+        log is closed and fully drained.
+        """
+        cursor = after_id
+        while True:
+            with self._cond:
+                if cursor >= len(self._events) and not self._closed:
+                    self._cond.wait(timeout=heartbeat)
+                pending = self._events[cursor:]
+                done = self._closed
+
+            if not pending and not done:
+                yield None
+            for event in pending:
+                cursor = event["id"]
+                yield event
+            if done:
+                return
+
+
+def format_sse(event: Optional[Dict[str, Any]]) -> str:
+    """Format an event (or a heartbeat when ``None``) as an SSE frame"""
+    if event is None:
+        return ": keep-alive\n\n"
+    payload = json.dumps(event["data"], ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {payload}\n\n"
+
+
+def sse_stream(log: EventLog, after_id: int = 0) -> Iterator[str]:
+    """Generate SSE frames for a Flask streaming response"""
+    for event in log.follow(after_id):
+        yield format_sse(event)
+
+
+def sse_response(log: EventLog, after_id: int = 0, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Build a streaming text/event-stream response that follows ``log``"""
+    response_headers = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    }
+    response_headers.update(headers or {})
+    return Response(
+        stream_with_context(sse_stream(log, after_id)),
+        mimetype='text/event-stream',
+        headers=response_headers
+    )
+
+
+def parse_last_event_id(headers, args) -> int:
+    """Read the SSE resume position from Last-Event-ID or ?last_event_id="""
+    value = headers.get('Last-Event-ID') or args.get('last_event_id') or 0
+    return int(value)
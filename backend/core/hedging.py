@@ -0,0 +1,316 @@
+"""Hedged provider calls: race a duplicate request against a slow one"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncContextManager, Awaitable, Callable, ContextManager, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+@contextmanager
+def _no_slot():
+    yield
+
+
+@asynccontextmanager
+async def _no_aslot():
+    yield
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies, in seconds"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, or None when it is empty"""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+        return ordered[rank]
+
+
+class HedgeBudget:
+    """
+    Token bucket bounding duplicate calls for one API key.
+
+    Every primary call earns ``ratio`` tokens (up to ``burst``) and every
+    hedge spends one, so over time at most ``ratio`` extra calls are made
+    per call while short slow spells can still be hedged.
+    """
+
+    def __init__(self, ratio: float = 0.1, burst: float = 3.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    """
+    Fire a second identical request when the first is slower than usual.
+
+    A call that has not returned after the ``percentile`` latency of recent
+    calls of the same kind gets one duplicate; whichever succeeds first wins
+    and the other is cancelled if still queued, otherwise its result is
+    discarded (the sync provider SDKs cannot abort a request in flight;
+    ``run_async`` cancels the losing coroutine). Hedging
+    starts once ``min_samples`` latencies are known, never before
+    ``min_delay`` seconds after the call is in flight, and is capped per
+    API key by a HedgeBudget. Calls that must first take a scheduler slot
+    pass it as ``slot``: latency and the hedge delay are measured from the
+    moment the slot is granted, so local queueing never triggers a hedge.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        min_samples: int = 20,
+        min_delay: float = 5.0,
+        budget_ratio: float = 0.1,
+        budget_burst: float = 3.0,
+        window: int = 200,
+        max_workers: int = 32
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.window = window
+        self.max_workers = max_workers
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self._budgets: Dict[str, HedgeBudget] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._denied = 0
+
+    def _tracker(self, kind: str) -> LatencyTracker:
+        with self._lock:
+            tracker = self._trackers.get(kind)
+            if tracker is None:
+                tracker = self._trackers[kind] = LatencyTracker(self.window)
+            return tracker
+
+    def _budget(self, api_key: str) -> HedgeBudget:
+        fingerprint = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            budget = self._budgets.get(fingerprint)
+            if budget is None:
+                budget = self._budgets[fingerprint] = HedgeBudget(self.budget_ratio, self.budget_burst)
+            return budget
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+            return self._executor
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """Seconds to wait before hedging a call of ``kind``, or None if there is too little history"""
+        tracker = self._tracker(kind)
+        if len(tracker) < max(1, self.min_samples):
+            return None
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def run(self, kind: str, api_key: str, fn: Callable[[], T], hedge: Optional[bool] = None,
+            slot: Optional[Callable[[], ContextManager[Any]]] = None) -> T:
+        """
+        Call ``fn``, hedging it with a duplicate if it is slow
+
+        Args:
+            kind: Latency class of the call (e.g. model and image size)
+            api_key: Key the hedge budget is charged to
+            fn: The provider call; must be safe to run twice
+            hedge: Override the ``enabled`` default for this call
+            slot: Context manager factory held around every call (e.g. a
+                provider scheduler slot); timing starts once it is entered
+
+        Returns:
+            The result of the first call to succeed
+        """
+        tracker = self._tracker(kind)
+        slot = slot or _no_slot
+
+        def timed(in_flight: Optional[threading.Event] = None) -> T:
+            try:
+                with slot():
+                    if in_flight is not None:
+                        in_flight.set()
+                    started = time.monotonic()
+                    result = fn()
+                    tracker.record(time.monotonic() - started)
+                    return result
+            finally:
+                # Also wakes the caller when the slot could not be taken
+                if in_flight is not None:
+                    in_flight.set()
+
+        delay = self._plan(kind, hedge)
+        if delay is None:
+            return timed()
+
+        budget = self._budget(api_key)
+        budget.earn()
+        in_flight = threading.Event()
+        # Copy the caller's context so per-request metric labels follow the call
+        primary = self._pool().submit(contextvars.copy_context().run, timed, in_flight)
+        # The delay counts from when the call is in flight: waiting for a pool
+        # thread or a scheduler slot says nothing about the provider being slow
+        in_flight.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        if not self._spend(budget, kind, delay):
+            return primary.result()
+        backup = self._pool().submit(contextvars.copy_context().run, timed)
+        return self._first_success(primary, backup)
+
+    async def run_async(
+        self,
+        kind: str,
+        api_key: str,
+        fn: Callable[[], Awaitable[T]],
+        hedge: Optional[bool] = None,
+        slot: Optional[Callable[[], AsyncContextManager[Any]]] = None
+    ) -> T:
+        """Async variant of ``run``; ``fn`` creates a new coroutine per call and the loser is cancelled"""
+        tracker = self._tracker(kind)
+        slot = slot or _no_aslot
+
+        async def timed(in_flight: Optional[asyncio.Event] = None) -> T:
+            try:
+                async with slot():
+                    if in_flight is not None:
+                        in_flight.set()
+                    started = time.monotonic()
+                    result = await fn()
+                    tracker.record(time.monotonic() - started)
+                    return result
+            finally:
+                if in_flight is not None:
+                    in_flight.set()
+
+        delay = self._plan(kind, hedge)
+        if delay is None:
+            return await timed()
+
+        budget = self._budget(api_key)
+        budget.earn()
+        in_flight = asyncio.Event()
+        tasks = [asyncio.ensure_future(timed(in_flight))]
+        try:
+            await in_flight.wait()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._spend(budget, kind, delay):
+                return await tasks[0]
+            tasks.append(asyncio.ensure_future(timed()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            with self._lock:
+                                self._hedge_wins += 1
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            # The losing call, or both if we were cancelled ourselves
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _plan(self, kind: str, hedge: Optional[bool]) -> Optional[float]:
+        """Count a call and return its hedge delay, or None if it must not be hedged"""
+        with self._lock:
+            self._calls += 1
+        enabled = self.enabled if hedge is None else hedge
+        return self.hedge_delay(kind) if enabled else None
+
+    def _spend(self, budget: HedgeBudget, kind: str, delay: float) -> bool:
+        """Take a hedge from the key's budget"""
+        if not budget.try_spend():
+            with self._lock:
+                self._denied += 1
+            return False
+        logger.info(f"Hedging {kind} call still running after {delay:.1f}s")
+        with self._lock:
+            self._hedged += 1
+        return True
+
+    def _first_success(self, primary: Future, backup: Future) -> Any:
+        """Result of whichever future succeeds first; the primary's error if both fail"""
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is backup:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return future.result()
+        return primary.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            kinds = dict(self._trackers)
+            stats = {
+                "enabled": self.enabled,
+                "calls": self._calls,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "budget_denied": self._denied
+            }
+        stats["hedge_delay"] = {kind: self.hedge_delay(kind) for kind in kinds}
+        return stats
+
+
+image_hedger = Hedger(
+    enabled=os.getenv('IMAGE_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    percentile=float(os.getenv('IMAGE_HEDGE_PERCENTILE', 95)),
+    min_samples=int(os.getenv('IMAGE_HEDGE_MIN_SAMPLES', 20)),
+    min_delay=float(os.getenv('IMAGE_HEDGE_MIN_DELAY', 5)),
+    budget_ratio=float(os.getenv('IMAGE_HEDGE_BUDGET_RATIO', 0.1)),
+    budget_burst=float(os.getenv('IMAGE_HEDGE_BUDGET_BURST', 3)),
+    max_workers=int(os.getenv('IMAGE_HEDGE_WORKERS', 32))
+)
@@ -0,0 +1,264 @@
+"""Image encode/decode worker pool and durable file writes"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name, file extension and mime type per output format
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'png', 'image/png'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'webp': ('WEBP', 'webp', 'image/webp'),
+}
+
+MIME_FORMATS = {mime: name for name, (_, _, mime) in OUTPUT_FORMATS.items()}
+
+
+def _encode_options(fmt: str, settings: Dict[str, int]) -> Dict[str, Any]:
+    if fmt == 'png':
+        return {'compress_level': settings['png_compress_level']}
+    if fmt == 'jpeg':
+        return {'quality': settings['jpeg_quality'], 'optimize': True}
+    return {'quality': settings['webp_quality'], 'method': settings['webp_method']}
+
+
+def _transcode(data: bytes, fmt: str, settings: Dict[str, int]) -> Tuple[bytes, int, int]:
+    """Decode ``data`` and re-encode it as ``fmt``; runs inside the worker pool"""
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    with Image.open(io.BytesIO(data)) as source:
+        img = source
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        try:
+            buffer = io.BytesIO()
+            img.save(buffer, format=pil_format, **_encode_options(fmt, settings))
+            return buffer.getvalue(), img.width, img.height
+        finally:
+            if img is not source:
+                img.close()
+
+
+def _make_variants(data: bytes, widths: List[int], fmt: str, settings: Dict[str, int]) -> List[Tuple[int, bytes, int, int]]:
+    """
+    Downscale ``data`` to each width narrower than the source and encode as ``fmt``
+
+    The image is decoded once and the widths are produced from largest to
+    smallest, each resampled from the previous one. Runs inside the worker pool.
+
+    Returns:
+        List of (requested_width, encoded_bytes, width, height)
+    """
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    variants = []
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        current = img
+        try:
+            for target in sorted(set(widths), reverse=True):
+                if target <= 0 or target >= img.width:
+                    continue
+                height = max(1, round(img.height * target / img.width))
+                resized = current.resize((target, height), Image.LANCZOS)
+                # Each width is resampled from the previous one, which can go now
+                if current is not img:
+                    current.close()
+                current = resized
+                encoded = current
+                if pil_format == 'JPEG' and encoded.mode not in ('RGB', 'L'):
+                    encoded = encoded.convert('RGB')
+                buffer = io.BytesIO()
+                encoded.save(buffer, format=pil_format, **_encode_options(fmt, settings))
+                if encoded is not current:
+                    encoded.close()
+                variants.append((target, buffer.getvalue(), target, height))
+        finally:
+            if current is not img:
+                current.close()
+    return variants
+
+
+def resize_encode(data: bytes, max_side: int, pil_format: str, quality: int) -> Tuple[bytes, int, int]:
+    """
+    Shrink an image to ``max_side`` (0 keeps its size) and encode it
+
+    Alpha is flattened onto white for JPEG. Every intermediate image is
+    closed before returning, so the decoded pixels are freed at once
+    rather than whenever the garbage collector gets to them. Runs inside
+    the worker pool.
+
+    Returns:
+        Tuple of (encoded_bytes, width, height)
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        img = source
+        if max_side > 0:
+            # Let the JPEG decoder skip detail we are about to throw away
+            img.draft('RGB', (max_side, max_side))
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        if pil_format == 'JPEG' and img.mode != 'RGB':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            with img.convert('RGBA') as rgba:
+                alpha = rgba.getchannel('A')
+                background.paste(rgba, mask=alpha)
+                alpha.close()
+            img = background
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+        try:
+            buffer = io.BytesIO()
+            if pil_format == 'PNG':
+                img.save(buffer, format='PNG', optimize=True)
+            else:
+                img.save(buffer, format=pil_format, quality=quality)
+            return buffer.getvalue(), img.width, img.height
+        finally:
+            if img is not source:
+                img.close()
+
+
+def probe_size(data: bytes) -> Tuple[int, int]:
+    """Read image dimensions from the header without decoding pixels"""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def atomic_write(path: str, data: bytes, durable: bool = True):
+    """
+    Write ``data`` to ``path`` via a temporary file and rename
+
+    Readers never observe a partially written file. With ``durable`` the
+    file and its directory are fsynced before returning, so the bytes
+    survive a crash once the caller hands out the URL.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if durable and hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class ImageIOPool:
+    """
+    Run CPU-bound image encoding off the request thread.
+
+    Encoding a 2K image holds the GIL for a long time, so by default work
+    goes to a process pool (``mode='process'``); ``mode='thread'`` keeps it
+    in-process for environments where subprocesses are unavailable. The
+    pool is created lazily on first use.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        mode: str = 'process',
+        output_format: str = 'original',
+        png_compress_level: int = 6,
+        jpeg_quality: int = 92,
+        webp_quality: int = 90,
+        webp_method: int = 4
+    ):
+        self.workers = workers
+        self.mode = mode
+        self.output_format = output_format
+        self.settings = {
+            'png_compress_level': png_compress_level,
+            'jpeg_quality': jpeg_quality,
+            'webp_quality': webp_quality,
+            'webp_method': webp_method,
+        }
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.mode == 'process':
+                    # spawn avoids forking a process that already runs threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-io')
+            return self._executor
+
+    def submit(self, fn, *args):
+        """Run a module-level function in the pool and return its Future"""
+        return self._get_executor().submit(fn, *args)
+
+    def transcode(self, data: bytes, fmt: str) -> Tuple[bytes, int, int]:
+        """Re-encode image bytes as ``fmt`` in the pool, returning (bytes, width, height)"""
+        return self.submit(_transcode, data, fmt, self.settings).result()
+
+    def make_variants(self, data: bytes, widths: List[int], fmt: str) -> List[Tuple[int, bytes, int, int]]:
+        """Produce downscaled copies of ``data`` in the pool (see ``_make_variants``)"""
+        if not widths:
+            return []
+        return self.make_variants_async(data, widths, fmt).result()
+
+    def make_variants_async(self, data: bytes, widths: List[int], fmt: str) -> Future:
+        """Like ``make_variants`` but returns the Future instead of waiting for it"""
+        return self.submit(_make_variants, data, widths, fmt, self.settings)
+
+    def encode_output(self, data: bytes, mime_type: Optional[str]) -> Tuple[bytes, str, int, int]:
+        """
+        Prepare provider output for storage in the configured format
+
+        Args:
+            data: Encoded bytes returned by the provider
+            mime_type: Their mime type
+
+        Returns:
+            Tuple of (bytes, file_extension, width, height)
+        """
+        source_format = MIME_FORMATS.get(mime_type or '', 'png')
+        target_format = self.output_format if self.output_format in OUTPUT_FORMATS else source_format
+
+        if target_format == source_format:
+            width, height = probe_size(data)
+            return data, OUTPUT_FORMATS[source_format][1], width, height
+
+        encoded, width, height = self.transcode(data, target_format)
+        logger.info(f"Transcoded {source_format} -> {target_format}: {len(data)} -> {len(encoded)} bytes")
+        return encoded, OUTPUT_FORMATS[target_format][1], width, height
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+image_io_pool = ImageIOPool(
+    workers=int(os.getenv('IMAGE_IO_WORKERS', max(1, (os.cpu_count() or 2) // 2))),
+    mode=os.getenv('IMAGE_IO_MODE', 'process'),
+    output_format=os.getenv('IMAGE_OUTPUT_FORMAT', 'original').lower(),
+    png_compress_level=int(os.getenv('IMAGE_PNG_COMPRESS_LEVEL', 6)),
+    jpeg_quality=int(os.getenv('IMAGE_JPEG_QUALITY', 92)),
+    webp_quality=int(os.getenv('IMAGE_WEBP_QUALITY', 90)),
+    webp_method=int(os.getenv('IMAGE_WEBP_METHOD', 4))
+)
@@ -0,0 +1,287 @@
+"""Streaming image proxy with a pooled HTTP session and a revalidating disk cache"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ProxyError(Exception):
+    """Raised when an upstream image cannot or may not be proxied"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ProxiedImage:
+    """Headers and body iterator of a proxied image"""
+
+    def __init__(self, content_type: str, body: Iterator[bytes], size: Optional[int], cache_status: str):
+        self.content_type = content_type
+        self.body = body
+        self.size = size
+        self.cache_status = cache_status
+
+
+class ImageProxy:
+    """
+    Fetch remote images for the browser without buffering them.
+
+    Upstream connections come from one pooled ``requests.Session``. Bodies
+    are streamed to the client in chunks while being teed into a disk
+    cache keyed by URL; cached entries are served from disk and
+    revalidated with If-None-Match / If-Modified-Since once older than
+    ``fresh_ttl``. The cache is an LRU bounded by ``max_bytes``, indexed in
+    SQLite. Responses over ``max_image_bytes`` or with a non-image content
+    type are refused.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 512 * 1024 ** 2,
+        max_image_bytes: int = 25 * 1024 ** 2,
+        fresh_ttl: float = 300.0,
+        timeout: float = 60.0,
+        pool_size: int = 16
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.fresh_ttl = fresh_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite3'), check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    url_hash TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    bytes INTEGER NOT NULL,
+                    validated_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _path(self, url_hash: str) -> str:
+        return os.path.join(self.cache_dir, url_hash[:2], url_hash)
+
+    def _lookup(self, url_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT content_type, etag, last_modified, bytes, validated_at FROM entries WHERE url_hash = ?",
+                (url_hash,)
+            ).fetchone()
+        if row is None or not os.path.exists(self._path(url_hash)):
+            return None
+        return dict(zip(('content_type', 'etag', 'last_modified', 'bytes', 'validated_at'), row))
+
+    def _touch(self, url_hash: str, validated: bool):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            if validated:
+                conn.execute(
+                    "UPDATE entries SET last_access = ?, validated_at = ? WHERE url_hash = ?", (now, now, url_hash)
+                )
+            else:
+                conn.execute("UPDATE entries SET last_access = ? WHERE url_hash = ?", (now, url_hash))
+            conn.commit()
+
+    def _store(self, url_hash: str, url: str, content_type: str, etag: Optional[str],
+               last_modified: Optional[str], size: int):
+        """Index a completed cache file and evict least recently used entries over budget"""
+        now = time.time()
+        evicted = []
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(url_hash, url, content_type, etag, last_modified, bytes, validated_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url_hash, url, content_type, etag, last_modified, size, now, now)
+            )
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                for entry_hash, entry_bytes in conn.execute(
+                    "SELECT url_hash, bytes FROM entries ORDER BY last_access ASC"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM entries WHERE url_hash = ?", (entry_hash,))
+                    total -= entry_bytes
+                    evicted.append(entry_hash)
+            conn.commit()
+        for entry_hash in evicted:
+            try:
+                os.remove(self._path(entry_hash))
+            except FileNotFoundError:
+                pass
+        if evicted:
+            logger.info(f"Image proxy cache evicted {len(evicted)} entries")
+
+    @staticmethod
+    def _read_file(f) -> Iterator[bytes]:
+        try:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    def _from_cache(self, url_hash: str, entry: Dict[str, Any], cache_status: str) -> ProxiedImage:
+        # Open now so a concurrent eviction cannot remove the file under us
+        f = open(self._path(url_hash), 'rb')
+        return ProxiedImage(entry['content_type'], self._read_file(f), entry['bytes'], cache_status)
+
+    def _stream_and_cache(self, response: requests.Response, url_hash: str, url: str,
+                          content_type: str) -> Iterator[bytes]:
+        """Relay upstream chunks to the client while writing them to a cache file"""
+        path = self._path(url_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        received = 0
+        completed = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > self.max_image_bytes:
+                        # Headers are already sent; cut the body short
+                        logger.warning(f"Proxied image exceeded {self.max_image_bytes} bytes: {url}")
+                        return
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            response.close()
+            if completed:
+                os.replace(tmp_path, path)
+                self._store(
+                    url_hash, url, content_type,
+                    response.headers.get('ETag'), response.headers.get('Last-Modified'), received
+                )
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def fetch(self, url: str) -> ProxiedImage:
+        """
+        Open a remote image for streaming
+
+        Args:
+            url: http(s) URL of the image
+
+        Returns:
+            ProxiedImage whose ``body`` yields the image in chunks;
+            ``cache_status`` is HIT, REVALIDATED or MISS
+
+        Raises:
+            ProxyError: If the URL, upstream status, type or size is not acceptable
+        """
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise ProxyError("Only http(s) URLs can be proxied", 400)
+
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        entry = self._lookup(url_hash)
+        headers = {}
+        if entry is not None:
+            if time.time() - entry['validated_at'] < self.fresh_ttl:
+                self._touch(url_hash, validated=False)
+                self._hits += 1
+                return self._from_cache(url_hash, entry, 'HIT')
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            if entry is not None:
+                logger.warning(f"Upstream unavailable, serving cached copy of {url}: {e}")
+                self._hits += 1
+                return self._from_cache(url_hash, entry, 'STALE')
+            raise ProxyError(f"Failed to fetch image: {e}", 502)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self._touch(url_hash, validated=True)
+            self._revalidated += 1
+            return self._from_cache(url_hash, entry, 'REVALIDATED')
+
+        if response.status_code != 200:
+            response.close()
+            raise ProxyError(f"Failed to fetch image: {response.status_code}", 502)
+
+        content_type = response.headers.get('Content-Type', 'image/png').split(';', 1)[0].strip()
+        if not content_type.startswith('image/'):
+            response.close()
+            raise ProxyError(f"Upstream returned non-image content type: {content_type}", 415)
+
+        size = response.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+        if size is not None and size > self.max_image_bytes:
+            response.close()
+            raise ProxyError(f"Image exceeds {self.max_image_bytes} bytes", 413)
+
+        self._misses += 1
+        # A transfer-encoded body may be decompressed to a different length
+        if response.headers.get('Content-Encoding'):
+            size = None
+        return ProxiedImage(content_type, self._stream_and_cache(response, url_hash, url, content_type), size, 'MISS')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries").fetchone()
+        return {
+            "entries": row[0],
+            "bytes": row[1],
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "revalidated": self._revalidated
+        }
+
+
+image_proxy = ImageProxy(
+    cache_dir=os.getenv('IMAGE_PROXY_CACHE_DIR', os.path.join(BACKEND_DIR, 'data', 'proxy_cache')),
+    max_bytes=int(os.getenv('IMAGE_PROXY_CACHE_MAX_BYTES', 512 * 1024 ** 2)),
+    max_image_bytes=int(os.getenv('IMAGE_PROXY_MAX_IMAGE_BYTES', 25 * 1024 ** 2)),
+    fresh_ttl=float(os.getenv('IMAGE_PROXY_FRESH_TTL', 300)),
+    timeout=float(os.getenv('IMAGE_PROXY_TIMEOUT', 60)),
+    pool_size=int(os.getenv('IMAGE_PROXY_POOL_SIZE', 16))
+)
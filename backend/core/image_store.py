@@ -0,0 +1,252 @@
+"""Content-addressed, sharded storage for generated images"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from core.image_io import atomic_write
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANT_COLUMNS = ('width', 'height', 'format', 'url', 'relative_path', 'bytes')
+
+INDEX_COLUMNS = (
+    'content_hash', 'relative_path', 'url', 'prompt_hash', 'style', 'model',
+    'aspect_ratio', 'image_size', 'width', 'height', 'bytes', 'latency_ms', 'created_at'
+)
+
+
+class StoredImage:
+    """Result of saving an image into the store"""
+
+    def __init__(self, content_hash: str, path: str, url: str, deduplicated: bool):
+        self.content_hash = content_hash
+        self.path = path
+        self.url = url
+        self.deduplicated = deduplicated
+
+
+class ImageStore:
+    """
+    Store images under their SHA-256 content hash.
+
+    Files live at ``<root>/<h[0:2]>/<h[2:4]>/<hash>.<ext>`` so no directory
+    grows beyond a few hundred entries, identical outputs are written only
+    once (atomically, fsynced when ``durable``), and a SQLite index records
+    prompt hash, style, model, size, generation latency and creation time
+    for every stored image.
+
+    URLs are ``<base_url><url_prefix>/<relative path>``. With an empty
+    ``base_url`` they are relative to whatever serves the page; set it to
+    the backend's origin so browsers fetch images through its caching
+    media route. Either form is accepted back (e.g. as a reference image).
+    """
+
+    def __init__(self, root: str, url_prefix: str, index_path: str, durable: bool = True,
+                 base_url: str = ''):
+        self.root = root
+        self.durable = durable
+        self.url_prefix = url_prefix.rstrip('/')
+        self.base_url = base_url.rstrip('/')
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def prompt_hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def relative_path(self, content_hash: str, ext: str) -> str:
+        return os.path.join(content_hash[:2], content_hash[2:4], f"{content_hash}.{ext}")
+
+    def path_for(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    def url_for(self, relative_path: str) -> str:
+        return f"{self.base_url}{self.url_prefix}/{relative_path.replace(os.sep, '/')}"
+
+    def local_url(self, url: str) -> str:
+        """Strip ``base_url`` from a URL of this store, leaving other strings as they are"""
+        if self.base_url and url.startswith(self.base_url + self.url_prefix + '/'):
+            return url[len(self.base_url):]
+        return url
+
+    def hash_from_url(self, url: str) -> Optional[str]:
+        """Return the content hash of an image URL served from this store"""
+        url = self.local_url(url) if url else url
+        if not url or not url.startswith(self.url_prefix + '/'):
+            return None
+        name = url.rsplit('/', 1)[-1].split('.', 1)[0].split('_', 1)[0]
+        if len(name) != 64 or any(c not in '0123456789abcdef' for c in name):
+            return None
+        return name
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    content_hash TEXT PRIMARY KEY,
+                    relative_path TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    prompt_hash TEXT,
+                    style TEXT,
+                    model TEXT,
+                    aspect_ratio TEXT,
+                    image_size TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    bytes INTEGER,
+                    latency_ms REAL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_prompt_hash ON images(prompt_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_created_at ON images(created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS variants (
+                    content_hash TEXT NOT NULL,
+                    width INTEGER NOT NULL,
+                    format TEXT NOT NULL,
+                    relative_path TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    height INTEGER,
+                    bytes INTEGER,
+                    PRIMARY KEY (content_hash, width, format)
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def save(self, data: bytes, ext: str = 'png', metadata: Optional[Dict[str, Any]] = None) -> StoredImage:
+        """
+        Save encoded image bytes, deduplicating identical content
+
+        Args:
+            data: Encoded image bytes
+            ext: File extension matching the encoding
+            metadata: Optional index fields (prompt_hash, style, model,
+                aspect_ratio, image_size, width, height, latency_ms)
+
+        Returns:
+            StoredImage describing where the bytes live
+        """
+        digest = self.content_hash(data)
+        relative_path = self.relative_path(digest, ext)
+        path = self.path_for(relative_path)
+        url = self.url_for(relative_path)
+
+        deduplicated = os.path.exists(path)
+        if not deduplicated:
+            atomic_write(path, data, durable=self.durable)
+        else:
+            logger.info(f"Image {digest[:12]} already stored, reusing {url}")
+
+        row = dict(metadata or {})
+        row.update({
+            'content_hash': digest,
+            'relative_path': relative_path,
+            'url': url,
+            'bytes': len(data),
+            'created_at': time.time()
+        })
+        values = [row.get(column) for column in INDEX_COLUMNS]
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR IGNORE INTO images ({', '.join(INDEX_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in INDEX_COLUMNS)})",
+                values
+            )
+            conn.commit()
+
+        return StoredImage(digest, path, url, deduplicated)
+
+    def save_variant(self, content_hash: str, width: int, data: bytes, ext: str, height: int) -> str:
+        """
+        Save a downscaled derivative next to its original
+
+        Variants live at ``<h[0:2]>/<h[2:4]>/<hash>_w<width>.<ext>`` and are
+        recorded in the ``variants`` table.
+
+        Returns:
+            URL of the variant
+        """
+        relative_path = os.path.join(content_hash[:2], content_hash[2:4], f"{content_hash}_w{width}.{ext}")
+        path = self.path_for(relative_path)
+        url = self.url_for(relative_path)
+        if not os.path.exists(path):
+            atomic_write(path, data, durable=self.durable)
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO variants "
+                "(content_hash, width, format, relative_path, url, height, bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, width, ext, relative_path, url, height, len(data))
+            )
+            conn.commit()
+        return url
+
+    def variants(self, content_hash: str) -> List[Dict[str, Any]]:
+        """Return the stored variants of an image, narrowest first"""
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {', '.join(VARIANT_COLUMNS)} FROM variants WHERE content_hash = ? ORDER BY width",
+                (content_hash,)
+            )
+            rows = cursor.fetchall()
+        return [dict(zip(VARIANT_COLUMNS, row)) for row in rows]
+
+    def variants_for_url(self, url: str) -> List[Dict[str, Any]]:
+        """Return ``{"width", "height", "url"}`` for each variant of a stored image URL"""
+        content_hash = self.hash_from_url(url)
+        if content_hash is None:
+            return []
+        return [
+            {'width': v['width'], 'height': v['height'], 'url': v['url']}
+            for v in self.variants(content_hash)
+        ]
+
+    def lookup(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the index row for a content hash"""
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {', '.join(INDEX_COLUMNS)} FROM images WHERE content_hash = ?",
+                (content_hash,)
+            )
+            row = cursor.fetchone()
+        return dict(zip(INDEX_COLUMNS, row)) if row else None
+
+    def find_by_prompt(self, prompt_hash: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return stored images generated from a prompt, newest first"""
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {', '.join(INDEX_COLUMNS)} FROM images WHERE prompt_hash = ? "
+                f"ORDER BY created_at DESC LIMIT ?",
+                (prompt_hash, limit)
+            )
+            rows = cursor.fetchall()
+        return [dict(zip(INDEX_COLUMNS, row)) for row in rows]
+
+
+image_store = ImageStore(
+    root=os.getenv('IMAGE_STORE_ROOT', os.path.join(BACKEND_DIR, 'static', 'images')),
+    url_prefix='/backend/static/images',
+    index_path=os.getenv('IMAGE_INDEX_PATH', os.path.join(BACKEND_DIR, 'data', 'image_index.sqlite3')),
+    durable=os.getenv('IMAGE_STORE_FSYNC', 'true').lower() in ('1', 'true', 'yes'),
+    base_url=os.getenv('IMAGE_BASE_URL', '')
+)
@@ -0,0 +1,139 @@
+"""Bounded background job queue for long-running generation calls"""
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from core.event_stream import EventLog
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds its maximum number of pending jobs"""
+
+
+class Job:
+    """A single queued unit of work and its observable state"""
+
+    def __init__(self, kind: str):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.result: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events = EventLog()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobQueue:
+    """
+    Run submitted callables on a bounded worker pool.
+
+    Submitting returns immediately with a Job whose status can be polled or
+    followed through its event log, so request threads are not held for the
+    whole provider call. At most ``max_pending`` jobs may be waiting or
+    running; further submissions raise QueueFullError. Finished jobs are
+    forgotten ``job_ttl`` seconds after they end, checked on every submit,
+    lookup and stats call.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 100, job_ttl: float = 3600.0):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._jobs: Dict[str, Job] = {}
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        Queue ``fn(*args, **kwargs)`` for background execution
+
+        Args:
+            kind: Short job type label, e.g. 'image' or 'cover'
+            fn: Callable whose return value becomes the job result
+
+        Returns:
+            The queued Job
+        """
+        job = Job(kind)
+        with self._lock:
+            self._prune_locked()
+            if self._active >= self.max_pending:
+                raise QueueFullError("Too many pending jobs, please retry later")
+            self._active += 1
+            self._jobs[job.job_id] = job
+
+        job.events.append("status", {"job_id": job.job_id, "status": job.status})
+        # The job runs in the submitter's context (e.g. its endpoint metric label)
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            # Expired jobs are gone even if nothing was submitted since
+            self._prune_locked()
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth counters"""
+        with self._lock:
+            self._prune_locked()
+            queued = sum(1 for job in self._jobs.values() if job.status == "queued")
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+            return {"queued": queued, "running": running, "tracked": len(self._jobs)}
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple, kwargs: dict):
+        job.status = "running"
+        job.started_at = time.time()
+        job.events.append("status", {"job_id": job.job_id, "status": job.status})
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = "succeeded"
+        except Exception as e:
+            logger.warning(f"Job {job.job_id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active -= 1
+            job.events.append("done", job.to_dict())
+            job.events.close()
+
+    def _prune_locked(self):
+        """Forget finished jobs older than job_ttl"""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and now - job.finished_at > self.job_ttl:
+                del self._jobs[job_id]
+
+
+image_job_queue = JobQueue(
+    max_workers=int(os.getenv('IMAGE_JOB_WORKERS', 4)),
+    max_pending=int(os.getenv('IMAGE_JOB_MAX_PENDING', 100)),
+    job_ttl=float(os.getenv('IMAGE_JOB_TTL', 3600))
+)
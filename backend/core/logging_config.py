@@ -0,0 +1,209 @@
+"""Logging setup: non-blocking queue handler with truncation, secret redaction and debug sampling"""
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Dict keys whose values are never logged
+SECRET_FIELDS = {'api_key', 'google_api_key', 'apikey', 'authorization', 'token', 'secret', 'password'}
+
+# Longest string argument or payload field written to the log
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', 2000))
+
+_DATA_URL = re.compile(r'data:([\w/+.-]+);base64,([A-Za-z0-9+/=]{16,})')
+# (pattern, replacement) pairs; group 1, when present, is kept
+_SECRET_PATTERNS = [
+    (re.compile(r'AIza[0-9A-Za-z_\-]{35}'), '***'),      # Google API keys
+    (re.compile(r'sk-[A-Za-z0-9_\-]{16,}'), '***'),      # OpenAI-style keys
+    (re.compile(r'(Bearer )[A-Za-z0-9._\-]+'), r'\1***'),
+    (re.compile(r'(["\'](?:' + '|'.join(sorted(SECRET_FIELDS)) + r')["\']\s*:\s*["\'])[^"\']+', re.IGNORECASE), r'\1***'),
+    (re.compile(r'(\b(?:key|api_key|token)=)[^&\s]+', re.IGNORECASE), r'\1***'),
+]
+
+
+def _data_url_summary(match: re.Match) -> str:
+    return f"data:{match.group(1)};base64,<{len(match.group(2))} chars>"
+
+
+def redact(text: str) -> str:
+    """Replace API keys, bearer tokens and inline base64 images in ``text``"""
+    text = _DATA_URL.sub(_data_url_summary, text)
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def truncate(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(+{len(text) - max_chars} chars)"
+
+
+def summarize(value: Any, max_chars: Optional[int] = None, max_items: int = 10) -> Any:
+    """
+    Log-safe copy of a request payload
+
+    Secret fields are masked, data URLs are replaced by their size and
+    long strings and lists are cut, without copying the large values.
+
+    Args:
+        value: Parsed JSON value (dict, list, str, ...)
+        max_chars: Longest string kept (defaults to LOG_MAX_FIELD_CHARS)
+        max_items: Longest list kept
+
+    Returns:
+        A small value that is cheap to format
+    """
+    if max_chars is None:
+        max_chars = LOG_MAX_FIELD_CHARS
+    if isinstance(value, dict):
+        return {
+            key: '***' if str(key).lower() in SECRET_FIELDS and item else summarize(item, max_chars, max_items)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [summarize(item, max_chars, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"...(+{len(value) - max_items} items)")
+        return items
+    if isinstance(value, str):
+        if value.startswith('data:') and ';base64,' in value[:64]:
+            return f"{value[:value.index(',') + 1]}<{len(value) - value.index(',') - 1} chars>"
+        return truncate(value, max_chars)
+    return value
+
+
+class DebugSampler(logging.Filter):
+    """Pass only ``rate`` of DEBUG records; higher levels always pass"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hand records to a background listener without ever blocking the caller.
+
+    The message is rendered and redacted in the calling thread, with string
+    arguments cut to ``max_field_chars`` and the result to ``max_chars``, so
+    only a bounded string crosses the queue. When the queue is full the record is dropped and
+    counted instead of waiting for the writer.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_field_chars: int = 2000, max_chars: int = 8000):
+        super().__init__(log_queue)
+        self.max_field_chars = max_field_chars
+        self.max_chars = max_chars
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def _render(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if isinstance(args, tuple):
+            args = tuple(truncate(arg, self.max_field_chars) if isinstance(arg, str) else arg for arg in args)
+        msg = str(record.msg)
+        try:
+            message = msg % args if args else msg
+        except (TypeError, ValueError):
+            message = f"{msg} {args}"
+        if self.max_chars <= 0 or len(message) <= self.max_chars:
+            return redact(message)
+        # Redact a window a little wider than the limit so a secret cut by the
+        # limit is masked whole; the megabytes beyond it are never scanned
+        head = redact(message[:self.max_chars + 256])[:self.max_chars]
+        return f"{head}...(+{len(message) - self.max_chars} chars)"
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = self._render(record)
+        if record.exc_info:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+            message = f"{message}\n{redact(exc_text)}"
+        prepared = logging.makeLogRecord(record.__dict__)
+        prepared.msg = message
+        prepared.args = None
+        prepared.exc_info = None
+        prepared.exc_text = None
+        return prepared
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"queued": self.queue.qsize(), "dropped": self._dropped}
+
+
+_handler: Optional[BoundedQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    """Parse LOG_LEVELS ("httpx=WARNING,core.image_io=DEBUG")"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """
+    Route the root logger through a BoundedQueueHandler and a writer thread
+
+    Configured by LOG_LEVEL (root level, default INFO), LOG_LEVELS
+    (per-logger overrides), LOG_MAX_FIELD_CHARS, LOG_MAX_MESSAGE_CHARS,
+    LOG_QUEUE_SIZE and LOG_DEBUG_SAMPLE_RATE. Safe to call more than once.
+    """
+    global _handler, _listener
+    if _handler is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    _handler = BoundedQueueHandler(
+        queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000))),
+        max_field_chars=LOG_MAX_FIELD_CHARS,
+        max_chars=int(os.getenv('LOG_MAX_MESSAGE_CHARS', 8000))
+    )
+    _handler.addFilter(DebugSampler(float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in _parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+
+
+def logging_stats() -> Dict[str, int]:
+    """Queue depth and dropped records of the logging pipeline"""
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return _handler.stats()
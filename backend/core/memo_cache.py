@@ -0,0 +1,123 @@
+"""Two-level (memory + disk) memoization cache for JSON-serialisable results"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from core.sqlite_lru import SqliteLRU
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share a key"""
+    return re.sub(r'\s+', ' ', prompt).strip().casefold()
+
+
+class MemoCache:
+    """
+    Memoize JSON-serialisable results with a TTL.
+
+    Recent entries are kept in an in-memory LRU of ``max_entries``; every
+    entry is also written to a SQLite file so memoized results survive
+    restarts and are shared between worker processes. Once the stored
+    values exceed ``max_bytes`` in total, the least recently used rows are
+    dropped (see SqliteLRU). Values are stored as JSON text, so callers
+    always receive a fresh copy.
+    """
+
+    def __init__(self, name: str, path: str, ttl: float = 3600.0, max_entries: int = 512,
+                 max_bytes: int = 64 * 1024 ** 2):
+        self.name = name
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk = SqliteLRU(
+            path, 'memo', {"value": "TEXT NOT NULL"}, max_bytes=max_bytes, ttl=ttl, size_column='value'
+        )
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(**fields: Any) -> str:
+        canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _remember_locked(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the memoized value for ``key`` or None if missing or expired"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._disk.get(key, ('value',))
+                if row is not None:
+                    entry = (row[0], row[1][0])
+                    self._remember_locked(key, *entry)
+
+            if entry is None or self._disk.expired(entry[0], now):
+                if entry is not None:
+                    self._memory.pop(key, None)
+                    self._disk.delete(key)
+                self._misses += 1
+                return None
+
+            self._memory.move_to_end(key)
+            self._hits += 1
+            value = entry[1]
+        # Keep the disk tier's LRU order in step with the hits
+        self._disk.touch(key)
+        return json.loads(value)
+
+    def put(self, key: str, value: Any):
+        """Memoize ``value`` under ``key`` and evict least recently used rows over budget"""
+        if not self.enabled:
+            return
+        serialized = json.dumps(value, ensure_ascii=False)
+        size = len(serialized.encode('utf-8'))
+        with self._lock:
+            self._remember_locked(key, time.time(), serialized)
+            evicted = self._disk.put(key, {"value": serialized}, size)
+            for cache_key in evicted:
+                self._memory.pop(cache_key, None)
+        if evicted:
+            logger.info(f"{self.name} memo cache evicted {len(evicted)} entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "memory_entries": len(self._memory),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+script_memo_cache = MemoCache(
+    name='script',
+    path=os.getenv('SCRIPT_CACHE_PATH', os.path.join(BACKEND_DIR, 'data', 'script_cache.sqlite3')),
+    ttl=float(os.getenv('SCRIPT_CACHE_TTL', 3600)),
+    max_entries=int(os.getenv('SCRIPT_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.getenv('SCRIPT_CACHE_MAX_BYTES', 64 * 1024 ** 2))
+)
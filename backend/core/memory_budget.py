@@ -0,0 +1,64 @@
+"""Per-request memory ceiling for reference image handling"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class MemoryBudgetExceededError(Exception):
+    """Raised when holding more bytes would take a request over its ceiling"""
+
+
+class MemoryBudget:
+    """
+    Bytes one request may hold at a time.
+
+    Long-lived buffers (prepared reference parts) are charged with
+    ``reserve`` for as long as the request keeps them; transient ones (raw
+    downloads, decoded pixels) are charged with ``hold`` around the code
+    that allocates them. A charge that would exceed ``limit`` raises
+    MemoryBudgetExceededError before anything is allocated, so the caller
+    can skip that reference. A budget belongs to one request and is not
+    shared between threads.
+    """
+
+    def __init__(self, limit: int):
+        # 0 or less disables the ceiling; usage is still tracked
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """Bytes that may still be charged, or None without a ceiling"""
+        if self.limit <= 0:
+            return None
+        return max(0, self.limit - self.used)
+
+    def check(self, size: int, what: str = "buffer"):
+        """Raise if ``size`` more bytes would not fit, without charging them"""
+        remaining = self.remaining
+        if remaining is not None and size > remaining:
+            raise MemoryBudgetExceededError(
+                f"{what} of {size} bytes exceeds the request memory limit "
+                f"({self.used} of {self.limit} bytes in use)"
+            )
+
+    def reserve(self, size: int, what: str = "buffer"):
+        """Charge ``size`` bytes until ``release``; raises if over the limit"""
+        self.check(size, what)
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def release(self, size: int):
+        self.used = max(0, self.used - size)
+
+    @contextmanager
+    def hold(self, size: int, what: str = "buffer") -> Iterator[None]:
+        """Charge ``size`` bytes for the duration of the block"""
+        self.reserve(size, what)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def stats(self) -> Dict[str, int]:
+        return {"used": self.used, "peak": self.peak, "limit": self.limit}
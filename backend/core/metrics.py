@@ -0,0 +1,284 @@
+"""In-process metrics (counters and histograms) exported in Prometheus text format"""
+import abc
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import logging
+import math
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits to slow image generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Endpoint a piece of work is done for; set per request by the controllers.
+# Work queued to other threads inherits it when the context is copied.
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar('metrics_endpoint', default='background')
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        rendered = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        name = f"{name}{{{rendered}}}"
+    if math.isinf(value):
+        return f"{name} {'+Inf' if value > 0 else '-Inf'}"
+    return f"{name} {int(value)}" if value == int(value) else f"{name} {float(value)!r}"
+
+
+class _Metric(abc.ABC):
+    """Base of labelled metrics: a name, help text and fixed label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Sample]:
+        """Current (sample name, labels, value) triples"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(_format_sample(name, labels, value) for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall time of the block, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le='+Inf' if math.isinf(bound) else f"{bound:g}"), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Named metrics plus collectors sampled at scrape time.
+
+    Collectors turn counters that components already keep (cache hits,
+    queue depth) into samples when ``render`` is called, so those
+    components need no metrics code of their own.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, name: str, kind: str, help_text: str, collect: Callable[[], Iterable[Sample]]):
+        """Add a metric whose samples are produced by ``collect()`` at scrape time"""
+        with self._lock:
+            self._collectors.append((name, kind, help_text, collect))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, kind, help_text, collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_format_sample(sample_name, labels, value) for sample_name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# Secret mixed into identifiers exported as labels; without a configured
+# value a random one is used, so ids only stay stable for one process
+_LABEL_SALT = (os.getenv('METRICS_LABEL_SALT') or secrets.token_hex(16)).encode('utf-8')
+
+
+def label_id(value: str) -> str:
+    """
+    Opaque label for a sensitive identifier (e.g. an API key fingerprint)
+
+    /api/metrics is unauthenticated, so such values are exported only as
+    an HMAC under a server-side salt: series stay distinguishable, but a
+    scraper cannot confirm a guessed key against them.
+    """
+    return hmac.new(_LABEL_SALT, value.encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+
+def error_class(error: BaseException) -> str:
+    """Low-cardinality class of a provider failure for the error counter"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    if isinstance(error, (TimeoutError, httpx.TimeoutException)) or 'Timeout' in type(error).__name__:
+        return "timeout"
+    if isinstance(error, (ConnectionError, httpx.TransportError)) or 'Connection' in type(error).__name__:
+        return "connection"
+    return type(error).__name__
+
+
+metrics = MetricsRegistry(
+    enabled=os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+)
+
+http_request_seconds = metrics.histogram(
+    'comic_http_request_seconds', 'HTTP request latency by route', ('endpoint', 'method', 'status')
+)
+stage_seconds = metrics.histogram(
+    'comic_stage_seconds', 'Time spent in each image generation stage', ('stage', 'model', 'endpoint')
+)
+provider_queue_seconds = metrics.histogram(
+    'comic_provider_queue_seconds', 'Time provider calls waited for a scheduler slot', ('model', 'endpoint')
+)
+provider_call_seconds = metrics.histogram(
+    'comic_provider_call_seconds', 'Provider call latency, excluding scheduling', ('model', 'endpoint', 'outcome')
+)
+provider_errors = metrics.counter(
+    'comic_provider_errors_total', 'Failed provider calls by error class', ('model', 'endpoint', 'error_class')
+)
+provider_retries = metrics.counter(
+    'comic_provider_retries_total', 'Provider calls retried by the retry policy', ('model', 'endpoint')
+)
+reference_bytes = metrics.counter(
+    'comic_reference_bytes_total', 'Encoded reference image bytes sent to the provider', ('model', 'endpoint')
+)
+
+
+@contextmanager
+def stage_timer(stage: str, model: str) -> Iterator[None]:
+    """Time one generation stage for the current endpoint"""
+    if not metrics.enabled:
+        yield
+        return
+    with stage_seconds.time(stage=stage, model=model, endpoint=current_endpoint.get()):
+        yield
+
+
+def observe_provider_call(model: Optional[str], queue_seconds: float, call_seconds: float,
+                          error: Optional[BaseException] = None):
+    """Record one provider call's scheduling wait, latency and, if it failed, its error class"""
+    if not metrics.enabled or model is None:
+        return
+    endpoint = current_endpoint.get()
+    provider_queue_seconds.observe(queue_seconds, model=model, endpoint=endpoint)
+    if error is None:
+        outcome = 'ok'
+    elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        # A hedge that lost the race, or a client that went away
+        outcome = 'cancelled'
+    else:
+        outcome = 'error'
+        provider_errors.inc(model=model, endpoint=endpoint, error_class=error_class(error))
+    provider_call_seconds.observe(call_seconds, model=model, endpoint=endpoint, outcome=outcome)
+
+
+def count_provider_error(model: str, error_class_name: str):
+    """Count a failure the provider reported in a successful response (e.g. a safety block)"""
+    if metrics.enabled:
+        provider_errors.inc(model=model, endpoint=current_endpoint.get(), error_class=error_class_name)
+
+
+def count_retry(model: Optional[str]):
+    if metrics.enabled and model is not None:
+        provider_retries.inc(model=model, endpoint=current_endpoint.get())
+
+
+def count_reference_bytes(model: str, size: int):
+    if metrics.enabled and size:
+        reference_bytes.inc(size, model=model, endpoint=current_endpoint.get())
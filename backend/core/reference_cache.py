@@ -0,0 +1,94 @@
+"""In-process LRU cache of prepared reference images"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class ReferenceImageCache:
+    """
+    Byte-budgeted LRU cache for prepared reference images.
+
+    Values are whatever the caller stores (for image generation: ready to
+    upload ``types.Part`` objects); each entry is charged ``size`` bytes
+    against ``max_bytes`` and the least recently used entries are dropped
+    once the budget is exceeded. Keys should identify content, e.g. a hash
+    of inline data or a storage path plus its mtime and size.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for ``key`` or None, updating recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any, size: int):
+        """Store ``value`` under ``key``, evicting old entries to fit the budget"""
+        if size > self.max_bytes:
+            # Never cache something that would flush the whole cache
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    def get_or_load(self, key: str, loader: Callable[[], Tuple[Any, int]]) -> Any:
+        """
+        Return the cached value for ``key``, calling ``loader`` on a miss
+
+        Args:
+            key: Cache key
+            loader: Callable returning (value, size_in_bytes)
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value, size = loader()
+        if value is not None:
+            self.put(key, value, size)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
+reference_cache = ReferenceImageCache(
+    max_bytes=int(os.getenv('REFERENCE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+)
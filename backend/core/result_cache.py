@@ -0,0 +1,87 @@
+"""Disk-backed cache of deterministic image generation results"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from core.sqlite_lru import SqliteLRU
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImageResultCache:
+    """
+    Map a generation request fingerprint to an already stored image.
+
+    Entries live in a small SQLite table next to the image index and point
+    at content-addressed files owned by the image store, so a hit costs one
+    indexed lookup. Entries expire after ``ttl`` seconds. ``max_bytes``
+    bounds the index, not the disk: once the images its entries reference
+    exceed that size in total, the least recently used entries are dropped
+    (see SqliteLRU). Evicting an entry never deletes the image itself,
+    since sessions may still reference it; the image store's own files are
+    not capped by this cache.
+    """
+
+    def __init__(self, index_path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 2 * 1024 ** 3, enabled: bool = False):
+        self.index_path = index_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._index = SqliteLRU(
+            index_path, 'results', {"url": "TEXT NOT NULL", "path": "TEXT NOT NULL"},
+            max_bytes=max_bytes, ttl=ttl
+        )
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(**fields: Any) -> str:
+        """Hash the fields that fully determine a generation request"""
+        canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached image URL for ``key`` if fresh and still on disk"""
+        row = self._index.get(key, ('url', 'path'))
+        if row is None:
+            self._count(False)
+            return None
+        created_at, (url, path) = row
+        if self._index.expired(created_at) or not os.path.exists(path):
+            self._index.delete(key)
+            self._count(False)
+            return None
+        self._index.touch(key)
+        self._count(True)
+        return url
+
+    def put(self, key: str, url: str, path: str, size: int):
+        """Record a result and evict least recently used entries over budget"""
+        evicted = self._index.put(key, {"url": url, "path": path}, size)
+        if evicted:
+            logger.info(f"Image result cache evicted {len(evicted)} entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "hits": self._hits, "misses": self._misses}
+
+
+image_result_cache = ImageResultCache(
+    index_path=os.getenv('IMAGE_RESULT_CACHE_PATH', os.path.join(BACKEND_DIR, 'data', 'result_cache.sqlite3')),
+    ttl=float(os.getenv('IMAGE_RESULT_CACHE_TTL', 7 * 24 * 3600)),
+    max_bytes=int(os.getenv('IMAGE_RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3)),
+    enabled=os.getenv('IMAGE_RESULT_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+)
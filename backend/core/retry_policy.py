@@ -0,0 +1,358 @@
+"""Retry policy with error classification, full jitter, time budgets and circuit breakers"""
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+import requests
+from google.genai import errors as genai_errors
+
+from core.metrics import count_retry
+from core.scheduler import RateLimitedError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# HTTP statuses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Statuses that indict the key itself rather than one request
+KEY_FAULT_STATUS_CODES = {401, 403}
+
+
+class NonRetryableError(Exception):
+    """A failure that will repeat on every attempt (e.g. content rejected by safety filters)"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ErrorClassification:
+    """How the retry policy should treat one failure"""
+
+    def __init__(self, retryable: bool, retry_after: Optional[float] = None, provider_fault: bool = True):
+        self.retryable = retryable
+        self.retry_after = retry_after
+        # Whether the failure says something about the provider/key (counts for the breaker)
+        self.provider_fault = provider_fault
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _genai_retry_delay(details: Any) -> Optional[float]:
+    """Read google.rpc.RetryInfo ("retryDelay": "12s") from a Gemini error body"""
+    error = details.get('error', details) if isinstance(details, dict) else None
+    for item in (error or {}).get('details', []) or []:
+        delay = item.get('retryDelay') if isinstance(item, dict) else None
+        match = re.fullmatch(r'(\d+(?:\.\d+)?)s', delay or '')
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def classify_error(error: BaseException) -> ErrorClassification:
+    """
+    Decide whether ``error`` is worth retrying and how long the provider asked us to wait
+
+    HTTP errors from the Gemini and OpenAI SDKs are classified by status
+    code, honouring Retry-After (or Gemini's RetryInfo). Connection and
+    timeout errors are retryable. NonRetryableError and programming errors
+    (ValueError, TypeError, ...) are not.
+    """
+    if isinstance(error, CircuitOpenError):
+        return ErrorClassification(False, error.retry_after, provider_fault=False)
+    if isinstance(error, RateLimitedError):
+        # Already waited in our own scheduler; the provider was never called
+        return ErrorClassification(False, error.retry_after, provider_fault=False)
+    if isinstance(error, NonRetryableError):
+        return ErrorClassification(False, provider_fault=False)
+
+    if isinstance(error, genai_errors.APIError):
+        headers = getattr(error.response, 'headers', None) or {}
+        retry_after = _parse_retry_after(headers.get('retry-after')) or _genai_retry_delay(error.details)
+        return ErrorClassification(
+            error.code in RETRYABLE_STATUS_CODES, retry_after,
+            provider_fault=error.code in RETRYABLE_STATUS_CODES or error.code in KEY_FAULT_STATUS_CODES
+        )
+
+    if isinstance(error, openai.APIStatusError):
+        retry_after = _parse_retry_after(error.response.headers.get('retry-after'))
+        return ErrorClassification(
+            error.status_code in RETRYABLE_STATUS_CODES, retry_after,
+            provider_fault=error.status_code in RETRYABLE_STATUS_CODES or error.status_code in KEY_FAULT_STATUS_CODES
+        )
+
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError,
+                          requests.ConnectionError, requests.Timeout, TimeoutError, ConnectionError)):
+        return ErrorClassification(True)
+
+    if isinstance(error, (ValueError, TypeError, KeyError, AttributeError)):
+        return ErrorClassification(False, provider_fault=False)
+
+    return ErrorClassification(True)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a provider/key that keeps failing.
+
+    After ``failure_threshold`` consecutive provider failures the breaker
+    opens and calls fail fast with CircuitOpenError for ``reset_timeout``
+    seconds. Then one trial call is let through (half-open): success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may proceed"""
+        with self._lock:
+            state = self._state_locked()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(f"Circuit open for {self.name}, retry in {retry_after:.0f}s", retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if was_trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or was_trial:
+                    logger.warning(f"Circuit breaker {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Give up a half-open trial slot without a verdict (e.g. non-provider error)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state_locked(), "consecutive_failures": self._failures}
+
+
+class CircuitBreakerRegistry:
+    """One circuit breaker per provider/key name"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+                self._breakers[name] = breaker
+            return breaker
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.stats() for name, breaker in breakers.items()}
+
+
+class RetryPolicy:
+    """
+    Retry a call with full-jitter exponential backoff inside a total time budget.
+
+    Each retry sleeps ``uniform(0, min(max_delay, base_delay * 2**n))``, or
+    at least the provider's Retry-After. Non-retryable errors are raised
+    immediately, and no retry is started that could not finish within
+    ``budget`` seconds of the first attempt. Retries are counted in the
+    provider metrics under ``model``.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0, budget: float = 300.0,
+                 model: Optional[str] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.model = model
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number ``retry`` (1-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (retry - 1))))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def run(
+        self,
+        fn: Callable[[float], T],
+        breaker: Optional[CircuitBreaker] = None,
+        on_error: Optional[Callable[[BaseException], Optional[bool]]] = None,
+        label: str = "call"
+    ) -> T:
+        """
+        Call ``fn(remaining_seconds)`` until it succeeds or the policy gives up
+
+        Args:
+            fn: The attempt; receives the time left in the budget so it can
+                bound its own timeout
+            breaker: Optional circuit breaker guarding the provider/key
+            on_error: Optional hook run after every failed attempt; returning
+                True means it removed the cause (e.g. dropped a stale cache)
+                and makes that failure retryable
+            label: Name used in log messages
+
+        Returns:
+            The result of the first successful attempt
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                breaker.before_call()
+            remaining = self.budget - (time.monotonic() - started)
+            try:
+                logger.info(f"{label}: attempt {attempt}/{self.max_attempts}")
+                result = fn(remaining)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, started, breaker, on_error, label)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled or interrupted: no verdict, but free a half-open trial
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    async def run_async(
+        self,
+        fn: Callable[[float], Awaitable[T]],
+        breaker: Optional[CircuitBreaker] = None,
+        on_error: Optional[Callable[[BaseException], Optional[bool]]] = None,
+        label: str = "call"
+    ) -> T:
+        """Async variant of ``run``: awaits ``fn(remaining_seconds)`` and sleeps without blocking the loop"""
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                breaker.before_call()
+            remaining = self.budget - (time.monotonic() - started)
+            try:
+                logger.info(f"{label}: attempt {attempt}/{self.max_attempts}")
+                result = await fn(remaining)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, started, breaker, on_error, label)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled or interrupted: no verdict, but free a half-open trial
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    def _after_failure(
+        self,
+        error: Exception,
+        attempt: int,
+        started: float,
+        breaker: Optional[CircuitBreaker],
+        on_error: Optional[Callable[[BaseException], Optional[bool]]],
+        label: str
+    ) -> Optional[float]:
+        """Book a failed attempt; return the delay before the next one, or None to give up"""
+        decision = classify_error(error)
+        recovered = on_error is not None and bool(on_error(error))
+        if breaker is not None:
+            if decision.provider_fault and not recovered:
+                breaker.record_failure()
+            else:
+                breaker.release_trial()
+
+        logger.warning(f"{label}: attempt {attempt}/{self.max_attempts} failed: {error}")
+        if recovered and not decision.retryable:
+            # The hook fixed what made the call fail; no reason to back off
+            decision = ErrorClassification(True, retry_after=0.0)
+        if not decision.retryable:
+            logger.error(f"{label}: not retrying {type(error).__name__}")
+            return None
+        if attempt >= self.max_attempts:
+            logger.error(f"{label}: all {self.max_attempts} attempts failed")
+            return None
+        delay = self.backoff(attempt, decision.retry_after)
+        if time.monotonic() - started + delay >= self.budget:
+            logger.error(f"{label}: retry budget of {self.budget:.0f}s exhausted")
+            return None
+        logger.info(f"{label}: retrying in {delay:.1f} seconds...")
+        count_retry(self.model)
+        return delay
+
+
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+    reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+)
@@ -0,0 +1,363 @@
+"""Per-API-key rate limiting and weighted fair scheduling of provider calls"""
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from core.metrics import observe_provider_call
+
+logger = logging.getLogger(__name__)
+
+# Set by ProviderScheduler.patient for callers that wait for their turn without a deadline
+_patient: contextvars.ContextVar[bool] = contextvars.ContextVar('provider_scheduler_patient', default=False)
+
+
+class RateLimitedError(Exception):
+    """Raised when a provider call cannot be scheduled for its key in time"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """Short, non-reversible id of an API key for bookkeeping and metrics"""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class _KeyState:
+    """Token bucket, concurrency and fair-queuing tag of one API key"""
+
+    def __init__(self, rate: float, burst: float, weight: float):
+        self.rate = rate
+        self.burst = burst
+        self.weight = weight
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.queued = 0
+        self.last_finish = 0.0
+        self.dispatched = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    def refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def token_wait(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available (0 when rate limiting is off)"""
+        if self.rate <= 0 or self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class _Ticket:
+    def __init__(self, fingerprint: str, start: float, finish: float, cost: float, seq: int):
+        self.fingerprint = fingerprint
+        self.start = start
+        self.finish = finish
+        self.cost = cost
+        self.seq = seq
+
+
+class ProviderScheduler:
+    """
+    Admit provider calls per API key with rate limits and fair sharing.
+
+    Every key has a token bucket (``rate`` calls per second, ``burst``
+    deep) and at most ``key_concurrency`` calls in flight; all keys share
+    ``max_concurrency`` slots. Waiting calls are served in start-time fair
+    queuing order: each gets a virtual finish tag ``start + cost / weight``,
+    so a key with a long backlog (a 20-page comic) cannot starve a key
+    asking for a single page, and a key with weight 2 gets twice the share.
+    A call that waits longer than ``max_wait`` seconds, or arrives while
+    its key already has ``max_queued`` calls waiting, raises
+    RateLimitedError instead of joining a provider-side 429 storm, unless
+    it is made inside ``patient()`` (in-process background work).
+    Threads use ``slot`` and coroutines ``aslot``; both share one queue.
+    Calls that name their ``model`` are also recorded in the provider metrics.
+    Keys that are idle (nothing queued or in flight, a full bucket and the
+    default weight) are forgotten every ``prune_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        key_concurrency: int = 4,
+        rate: float = 1.0,
+        burst: float = 5.0,
+        max_queued: int = 64,
+        max_wait: float = 120.0,
+        default_weight: float = 1.0,
+        prune_interval: float = 60.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.key_concurrency = key_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.default_weight = default_weight
+        self.prune_interval = prune_interval
+        self._keys: Dict[str, _KeyState] = {}
+        self._pruned_at = time.monotonic()
+        self._waiting: List[_Ticket] = []
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._async_waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def _state(self, fingerprint: str) -> _KeyState:
+        state = self._keys.get(fingerprint)
+        if state is None:
+            state = self._keys[fingerprint] = _KeyState(self.rate, self.burst, self.default_weight)
+        return state
+
+    def _prune_locked(self, now: float):
+        """Forget idle keys; caller holds the lock"""
+        if now - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = now
+        for fingerprint, state in list(self._keys.items()):
+            if state.queued or state.in_flight or state.weight != self.default_weight:
+                continue
+            state.refill(now)
+            if state.rate <= 0 or state.tokens >= state.burst:
+                del self._keys[fingerprint]
+
+    def set_weight(self, api_key: Optional[str], weight: float):
+        """Give a key a larger (or smaller) share of the provider slots"""
+        with self._cond:
+            self._state(key_fingerprint(api_key)).weight = weight
+
+    def _next_ticket(self, now: float) -> Optional[_Ticket]:
+        """Waiting ticket with the smallest finish tag among those that may start now"""
+        best = None
+        for ticket in self._waiting:
+            state = self._keys[ticket.fingerprint]
+            if state.in_flight >= self.key_concurrency:
+                continue
+            state.refill(now)
+            if state.token_wait(ticket.cost) > 0:
+                continue
+            if best is None or (ticket.finish, ticket.seq) < (best.finish, best.seq):
+                best = ticket
+        return best
+
+    def _enqueue(self, api_key: Optional[str], cost: float, weight: Optional[float]):
+        """Queue a ticket for ``api_key``; caller holds the lock"""
+        self._prune_locked(time.monotonic())
+        fingerprint = key_fingerprint(api_key)
+        state = self._state(fingerprint)
+        if weight is not None:
+            state.weight = weight
+        if state.queued >= self.max_queued and not _patient.get():
+            state.rejected += 1
+            raise RateLimitedError(f"Too many queued provider calls for key {fingerprint}", self._retry_after(state))
+        start = max(self._virtual_time, state.last_finish)
+        ticket = _Ticket(fingerprint, start, start + cost / max(state.weight, 1e-6), cost, next(self._seq))
+        state.last_finish = ticket.finish
+        state.queued += 1
+        self._waiting.append(ticket)
+        return ticket, state
+
+    def _try_start(self, ticket: _Ticket, state: _KeyState, enqueued: float) -> Optional[float]:
+        """
+        Start ``ticket`` if it is its turn; caller holds the lock
+
+        Returns:
+            None once started, otherwise how long to wait before checking again
+        """
+        now = time.monotonic()
+        if self._in_flight < self.max_concurrency and self._next_ticket(now) is ticket:
+            self._waiting.remove(ticket)
+            state.queued -= 1
+            state.tokens -= ticket.cost if state.rate > 0 else 0
+            state.in_flight += 1
+            state.dispatched += 1
+            state.wait_seconds += now - enqueued
+            self._in_flight += 1
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            # Another waiter may be eligible too (e.g. a different key)
+            self._notify_locked()
+            return None
+
+        if _patient.get():
+            # No deadline; just re-check now and then
+            remaining = max(1.0, self.max_wait)
+        else:
+            remaining = self.max_wait - (now - enqueued)
+        if remaining <= 0:
+            state.rejected += 1
+            raise RateLimitedError(
+                f"Provider calls for key {ticket.fingerprint} waited over {self.max_wait:.1f}s",
+                self._retry_after(state)
+            )
+        # Wake up for a freed slot (notify) or when this key earns a token
+        token_wait = state.token_wait(ticket.cost)
+        return min(remaining, token_wait) if token_wait > 0 else remaining
+
+    def _abandon(self, ticket: _Ticket, state: _KeyState):
+        """Drop a ticket that never started; caller holds the lock"""
+        self._waiting.remove(ticket)
+        state.queued -= 1
+        self._notify_locked()
+
+    def _finish(self, state: _KeyState):
+        with self._cond:
+            state.in_flight -= 1
+            self._in_flight -= 1
+            self._notify_locked()
+
+    def _notify_locked(self):
+        """Wake sync waiters and every event loop with async waiters"""
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def patient(self) -> Iterator[None]:
+        """
+        Let provider calls made in the block wait for their turn indefinitely
+
+        For in-process work whose concurrency is already bounded and where
+        no client waits on the response, such as the comic pipeline: being
+        rejected would only fail a page. The setting follows the context,
+        so it reaches hedged calls and coroutines started in the block.
+        """
+        token = _patient.set(True)
+        try:
+            yield
+        finally:
+            _patient.reset(token)
+
+    @contextmanager
+    def slot(self, api_key: Optional[str], cost: float = 1.0, weight: Optional[float] = None,
+             model: Optional[str] = None) -> Iterator[None]:
+        """
+        Hold a provider slot for ``api_key`` while the block runs
+
+        Args:
+            api_key: Provider key the call is charged to
+            cost: Tokens the call takes from the key's bucket
+            weight: Override the key's fair-share weight
+            model: Model called in the block; labels its latency and error metrics
+
+        Raises:
+            RateLimitedError: If the key's queue is full or the wait exceeds
+                ``max_wait`` (never inside ``patient``)
+        """
+        enqueued = time.monotonic()
+        with self._cond:
+            ticket, state = self._enqueue(api_key, cost, weight)
+            try:
+                while True:
+                    wait = self._try_start(ticket, state, enqueued)
+                    if wait is None:
+                        break
+                    self._cond.wait(wait)
+            except BaseException:
+                self._abandon(ticket, state)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            observe_provider_call(model, started - enqueued, time.monotonic() - started, e)
+            raise
+        else:
+            observe_provider_call(model, started - enqueued, time.monotonic() - started)
+        finally:
+            self._finish(state)
+
+    @asynccontextmanager
+    async def aslot(self, api_key: Optional[str], cost: float = 1.0, weight: Optional[float] = None,
+                    model: Optional[str] = None) -> AsyncIterator[None]:
+        """Async variant of ``slot``: waits on the event loop instead of blocking a thread"""
+        enqueued = time.monotonic()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            ticket, state = self._enqueue(api_key, cost, weight)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._cond:
+                    waiter[1].clear()
+                    wait = self._try_start(ticket, state, enqueued)
+                if wait is None:
+                    break
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket, state)
+            raise
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            observe_provider_call(model, started - enqueued, time.monotonic() - started, e)
+            raise
+        else:
+            observe_provider_call(model, started - enqueued, time.monotonic() - started)
+        finally:
+            self._finish(state)
+
+    def _retry_after(self, state: _KeyState) -> float:
+        """Rough time until the key's backlog drains"""
+        if state.rate <= 0:
+            return 1.0
+        return max(1.0, state.queued / state.rate)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and usage per key fingerprint"""
+        with self._cond:
+            now = time.monotonic()
+            self._prune_locked(now)
+            keys = {}
+            for fingerprint, state in self._keys.items():
+                state.refill(now)
+                keys[fingerprint] = {
+                    "queued": state.queued,
+                    "in_flight": state.in_flight,
+                    "tokens": round(state.tokens, 2),
+                    "weight": state.weight,
+                    "dispatched": state.dispatched,
+                    "rejected": state.rejected,
+                    "avg_wait_seconds": round(state.wait_seconds / state.dispatched, 3) if state.dispatched else 0.0
+                }
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "key_concurrency": self.key_concurrency,
+                "keys": keys
+            }
+
+
+provider_scheduler = ProviderScheduler(
+    max_concurrency=int(os.getenv('PROVIDER_MAX_CONCURRENCY', 16)),
+    key_concurrency=int(os.getenv('PROVIDER_KEY_CONCURRENCY', 4)),
+    rate=float(os.getenv('PROVIDER_KEY_RATE', 1.0)),
+    burst=float(os.getenv('PROVIDER_KEY_BURST', 5)),
+    max_queued=int(os.getenv('PROVIDER_KEY_MAX_QUEUED', 64)),
+    max_wait=float(os.getenv('PROVIDER_MAX_WAIT', 120))
+)
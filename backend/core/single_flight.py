@@ -0,0 +1,247 @@
+"""Single-flight request coalescing and Idempotency-Key replay"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from core.job_queue import image_job_queue
+from core.memo_cache import BACKEND_DIR, MemoCache
+from core.scheduler import key_fingerprint
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# (status_code, JSON body, extra headers) of an endpoint
+EndpointResult = Tuple[int, Any, Dict[str, str]]
+
+
+class IdempotencyConflictError(Exception):
+    """An Idempotency-Key was reused with a different request body"""
+
+
+class SingleFlight:
+    """
+    Run one computation per key at a time and share its outcome.
+
+    The first caller for a key (the leader) runs ``fn``; callers arriving
+    while it runs wait for the same result, or the same exception, instead
+    of starting their own. Threads and coroutines can wait on the same key.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._shared = 0
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self._leaders += 1
+                return future, True
+            self._shared += 1
+            return future, False
+
+    def _done(self, key: str):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: str, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Run ``fn`` unless a call for ``key`` is already in flight
+
+        Returns:
+            Tuple of (result, shared); shared is True when another caller computed it
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._done(key)
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Async variant of ``do``"""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._done(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self._leaders, "shared": self._shared}
+
+
+class RequestDeduplicator:
+    """
+    Collapse duplicate generation requests into one provider computation.
+
+    Concurrent requests with the same endpoint and body share one
+    in-flight computation. A request carrying an ``Idempotency-Key`` is
+    additionally remembered: its successful response is stored (scoped to
+    the endpoint and API key) for the store's TTL and replayed when the
+    same key is sent again. Reusing a key with a different body raises
+    IdempotencyConflictError, also while the first request is still running.
+    A 202 (queued job) response is only replayed for ``accepted_ttl``
+    seconds, as long as the job it points at is kept.
+    """
+
+    def __init__(self, store: MemoCache, coalesce: bool = True, accepted_ttl: Optional[float] = None):
+        self.store = store
+        self.coalesce = coalesce
+        self.accepted_ttl = accepted_ttl
+        self._flights = SingleFlight()
+        # record_key -> (request_hash, number of requests holding it)
+        self._pending: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+        self._replayed = 0
+
+    def _keys(self, endpoint: str, payload: Any, idempotency_key: Optional[str],
+              api_key: Optional[str]) -> Tuple[str, Optional[str]]:
+        request_hash = MemoCache.make_key(endpoint=endpoint, payload=payload)
+        record_key = None
+        if idempotency_key:
+            record_key = MemoCache.make_key(
+                endpoint=endpoint, scope=key_fingerprint(api_key), idempotency_key=idempotency_key
+            )
+        return request_hash, record_key
+
+    def _replay(self, request_hash: str, record_key: Optional[str]) -> Optional[EndpointResult]:
+        """Stored response for an Idempotency-Key, checking the body matches"""
+        if record_key is None:
+            return None
+        record = self.store.get(record_key)
+        if record is None or record.get('expires_at', float('inf')) <= time.time():
+            return None
+        if record['request_hash'] != request_hash:
+            raise IdempotencyConflictError("Idempotency-Key was already used with a different request")
+        with self._lock:
+            self._replayed += 1
+        headers = dict(record['headers'])
+        headers['Idempotent-Replayed'] = 'true'
+        return record['status'], record['body'], headers
+
+    def _remember(self, request_hash: str, record_key: Optional[str], result: EndpointResult):
+        status, body, headers = result
+        # Only successes are stored; a failed request may be retried with the same key
+        if record_key is not None and 200 <= status < 300:
+            record = {"request_hash": request_hash, "status": status, "body": body, "headers": headers}
+            if status == 202 and self.accepted_ttl is not None:
+                # The queued job is forgotten after a while; don't point at it longer
+                record["expires_at"] = time.time() + self.accepted_ttl
+            self.store.put(record_key, record)
+
+    def _claim(self, request_hash: str, record_key: Optional[str]):
+        """Hold an Idempotency-Key for this body while the request runs"""
+        if record_key is None:
+            return
+        with self._lock:
+            pending_hash, holders = self._pending.get(record_key, (request_hash, 0))
+            if pending_hash != request_hash:
+                raise IdempotencyConflictError("Idempotency-Key is already in use with a different request")
+            self._pending[record_key] = (request_hash, holders + 1)
+
+    def _unclaim(self, record_key: Optional[str]):
+        if record_key is None:
+            return
+        with self._lock:
+            request_hash, holders = self._pending[record_key]
+            if holders > 1:
+                self._pending[record_key] = (request_hash, holders - 1)
+            else:
+                del self._pending[record_key]
+
+    def run(self, endpoint: str, payload: Any, idempotency_key: Optional[str], api_key: Optional[str],
+            compute: Callable[[], EndpointResult]) -> EndpointResult:
+        """
+        Compute an endpoint response once for duplicate requests
+
+        Args:
+            endpoint: Endpoint name, part of every key
+            payload: Parsed JSON request body
+            idempotency_key: Value of the Idempotency-Key header, if any
+            api_key: Provider key of the caller; scopes idempotency records
+            compute: Produces (status_code, body, headers) for the request
+
+        Returns:
+            Tuple of (status_code, body, headers)
+        """
+        request_hash, record_key = self._keys(endpoint, payload, idempotency_key, api_key)
+        # Claimed before anything else, so a different body with the same key
+        # cannot slip in between the replay check and the computation
+        self._claim(request_hash, record_key)
+        try:
+            def leader() -> EndpointResult:
+                # A flight for this key may have finished since we joined
+                replay = self._replay(request_hash, record_key)
+                if replay is not None:
+                    return replay
+                result = compute()
+                self._remember(request_hash, record_key, result)
+                return result
+
+            if not self.coalesce and record_key is None:
+                return leader()
+            result, _ = self._flights.do(record_key or request_hash, leader)
+            return result
+        finally:
+            self._unclaim(record_key)
+
+    async def run_async(self, endpoint: str, payload: Any, idempotency_key: Optional[str], api_key: Optional[str],
+                        compute: Callable[[], Awaitable[EndpointResult]]) -> EndpointResult:
+        """Async variant of ``run``; shares in-flight computations with sync callers"""
+        request_hash, record_key = self._keys(endpoint, payload, idempotency_key, api_key)
+        self._claim(request_hash, record_key)
+        try:
+            async def leader() -> EndpointResult:
+                replay = self._replay(request_hash, record_key)
+                if replay is not None:
+                    return replay
+                result = await compute()
+                self._remember(request_hash, record_key, result)
+                return result
+
+            if not self.coalesce and record_key is None:
+                return await leader()
+            result, _ = await self._flights.do_async(record_key or request_hash, leader)
+            return result
+        finally:
+            self._unclaim(record_key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._flights.stats()
+        with self._lock:
+            stats["replayed"] = self._replayed
+        return stats
+
+
+request_deduplicator = RequestDeduplicator(
+    store=MemoCache(
+        name='idempotency',
+        path=os.getenv('IDEMPOTENCY_CACHE_PATH', os.path.join(BACKEND_DIR, 'data', 'idempotency.sqlite3')),
+        ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)),
+        max_entries=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 1024))
+    ),
+    coalesce=os.getenv('REQUEST_COALESCING_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+    accepted_ttl=image_job_queue.job_ttl
+)
@@ -0,0 +1,158 @@
+"""SQLite table of keyed rows with TTL expiry and size-bounded LRU eviction"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class SqliteLRU:
+    """
+    One SQLite table of cache rows, expired after ``ttl`` seconds and kept
+    under ``max_bytes`` by dropping the least recently used rows.
+
+    Every row has ``cache_key``, ``bytes`` (the size it is charged for),
+    ``created_at`` and ``last_access`` next to the caller's ``columns``.
+    Hits are not written one by one: ``touch`` batches them in memory and
+    they are flushed in one transaction at most every ``touch_interval``
+    seconds, and always before eviction picks its victims.
+    """
+
+    def __init__(self, path: str, table: str, columns: Dict[str, str], max_bytes: int,
+                 ttl: float, touch_interval: float = 30.0, size_column: Optional[str] = None):
+        """
+        Args:
+            path: SQLite file
+            table: Table name
+            columns: Caller columns and their SQL types, e.g. {"value": "TEXT NOT NULL"}
+            max_bytes: Total ``bytes`` above which rows are evicted
+            ttl: Seconds after ``created_at`` a row expires
+            touch_interval: Longest time hits stay unwritten
+            size_column: Column whose length seeds ``bytes`` in tables
+                created before size eviction
+        """
+        self.path = path
+        self.table = table
+        self.columns = columns
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.size_column = size_column
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the file and create or migrate the table (caller holds ``_lock``)"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = ''.join(f"{name} {sql_type},\n" for name, sql_type in self.columns.items())
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    cache_key TEXT PRIMARY KEY,
+                    {columns}
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL DEFAULT 0
+                )
+            """)
+            # Files written before size eviction lack its columns
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({self.table})")}
+            if 'bytes' not in existing:
+                conn.execute(f"ALTER TABLE {self.table} ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+                if self.size_column:
+                    conn.execute(f"UPDATE {self.table} SET bytes = LENGTH(CAST({self.size_column} AS BLOB))")
+            if 'last_access' not in existing:
+                conn.execute(f"ALTER TABLE {self.table} ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+                conn.execute(f"UPDATE {self.table} SET last_access = created_at")
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_access ON {self.table}(last_access)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, fields: Sequence[str]) -> Optional[Tuple[float, Tuple[Any, ...]]]:
+        """
+        Read a row without judging it
+
+        Returns:
+            (created_at, values of ``fields``), or None when there is no row
+        """
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT created_at, {', '.join(fields)} FROM {self.table} WHERE cache_key = ?", (key,)
+            ).fetchone()
+        return (row[0], tuple(row[1:])) if row is not None else None
+
+    def expired(self, created_at: float, now: Optional[float] = None) -> bool:
+        return (now or time.time()) - created_at > self.ttl
+
+    def delete(self, key: str):
+        with self._lock:
+            self._touched.pop(key, None)
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table} WHERE cache_key = ?", (key,))
+            conn.commit()
+
+    def touch(self, key: str):
+        """Record a hit; written with the next flush"""
+        now = time.time()
+        with self._lock:
+            self._touched[key] = now
+            if time.monotonic() - self._flushed_at >= self.touch_interval:
+                self._flush_locked()
+                self._connection().commit()
+
+    def _flush_locked(self):
+        """Write batched hits (caller holds ``_lock`` and commits)"""
+        if self._touched:
+            self._connection().executemany(
+                f"UPDATE {self.table} SET last_access = ? WHERE cache_key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    def put(self, key: str, values: Dict[str, Any], size: int) -> List[str]:
+        """
+        Insert or replace a row, drop expired rows and evict over ``max_bytes``
+
+        Returns:
+            Keys of the rows evicted to make room
+        """
+        now = time.time()
+        names = list(values)
+        evicted: List[str] = []
+        with self._lock:
+            conn = self._connection()
+            self._touched.pop(key, None)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (cache_key, {', '.join(names)}, bytes, created_at, last_access) "
+                f"VALUES (?, {', '.join('?' for _ in names)}, ?, ?, ?)",
+                (key, *(values[name] for name in names), size, now, now)
+            )
+            conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,))
+            total = conn.execute(f"SELECT COALESCE(SUM(bytes), 0) FROM {self.table}").fetchone()[0]
+            if total > self.max_bytes:
+                # Eviction must see every hit so far
+                self._flush_locked()
+                for cache_key, entry_bytes in conn.execute(
+                    f"SELECT cache_key, bytes FROM {self.table} ORDER BY last_access ASC"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute(f"DELETE FROM {self.table} WHERE cache_key = ?", (cache_key,))
+                    total -= entry_bytes
+                    evicted.append(cache_key)
+            conn.commit()
+        return evicted
+
+    def flush(self):
+        """Write batched hits now"""
+        with self._lock:
+            self._flush_locked()
+            self._connection().commit()
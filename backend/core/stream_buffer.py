@@ -0,0 +1,148 @@
+"""Bounded read-ahead of provider streams, so slow clients do not hold provider slots"""
+import asyncio
+import contextvars
+import logging
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class StreamBufferTimeoutError(TimeoutError):
+    """The consumer stopped reading for longer than the buffer waits"""
+
+
+class _Buffer:
+    """Chunks handed from the producer to the consumer, with end and error state"""
+
+    def __init__(self, max_chunks: int):
+        self.max_chunks = max_chunks
+        self.chunks = deque()
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        # Set when the consumer went away; the producer stops reading
+        self.abandoned = False
+
+    def full(self) -> bool:
+        return len(self.chunks) >= self.max_chunks and not self.abandoned
+
+    def ready(self) -> bool:
+        return bool(self.chunks) or self.finished
+
+    def take(self) -> Any:
+        """Next chunk; raises the producer's error, or StopIteration at the end"""
+        if self.chunks:
+            return self.chunks.popleft()
+        if self.error is not None:
+            raise self.error
+        raise StopIteration
+
+    def timed_out(self, timeout: float):
+        self.error = StreamBufferTimeoutError(f"Stream consumer idle for over {timeout:.0f}s")
+        self.finished = True
+        logger.warning(f"Stopped reading a provider stream: {self.error}")
+
+
+def drain_stream(chunks: Iterator[T], max_chunks: int = 4096, timeout: float = 30.0) -> Iterator[T]:
+    """
+    Read ``chunks`` in a background thread and yield them from a bounded buffer
+
+    Whatever ``chunks`` holds while it runs (a provider slot, a client
+    lease) is released as soon as the provider finishes, not when the
+    caller has consumed every chunk. If the buffer stays full for
+    ``timeout`` seconds the provider stream is closed, and the caller gets
+    StreamBufferTimeoutError after the buffered chunks. Errors raised by
+    ``chunks`` are re-raised to the caller in order.
+    """
+    buffer = _Buffer(max_chunks)
+    cond = threading.Condition()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                with cond:
+                    if not cond.wait_for(lambda: not buffer.full(), timeout):
+                        buffer.timed_out(timeout)
+                        break
+                    if buffer.abandoned:
+                        break
+                    buffer.chunks.append(chunk)
+                    cond.notify_all()
+        except BaseException as e:
+            with cond:
+                buffer.error = e
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            with cond:
+                buffer.finished = True
+                cond.notify_all()
+
+    # The producer sees the caller's context (scheduler patience, metric labels)
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(produce,), name='stream-buffer', daemon=True).start()
+    try:
+        while True:
+            with cond:
+                cond.wait_for(buffer.ready)
+                try:
+                    chunk = buffer.take()
+                except StopIteration:
+                    return
+                cond.notify_all()
+            yield chunk
+    finally:
+        with cond:
+            buffer.abandoned = True
+            cond.notify_all()
+
+
+async def adrain_stream(chunks: AsyncIterator[T], max_chunks: int = 4096, timeout: float = 30.0) -> AsyncIterator[T]:
+    """Async variant of ``drain_stream``: reads ``chunks`` in a task on the running loop"""
+    buffer = _Buffer(max_chunks)
+    cond = asyncio.Condition()
+
+    async def produce():
+        try:
+            async for chunk in chunks:
+                async with cond:
+                    try:
+                        await asyncio.wait_for(cond.wait_for(lambda: not buffer.full()), timeout)
+                    except asyncio.TimeoutError:
+                        buffer.timed_out(timeout)
+                        break
+                    if buffer.abandoned:
+                        break
+                    buffer.chunks.append(chunk)
+                    cond.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            buffer.error = e
+        finally:
+            close = getattr(chunks, 'aclose', None)
+            if close is not None:
+                await close()
+            async with cond:
+                buffer.finished = True
+                cond.notify_all()
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            async with cond:
+                await cond.wait_for(buffer.ready)
+                try:
+                    chunk = buffer.take()
+                except StopIteration:
+                    return
+                cond.notify_all()
+            yield chunk
+    finally:
+        if not task.done():
+            buffer.abandoned = True
+            task.cancel()
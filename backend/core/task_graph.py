@@ -0,0 +1,67 @@
+"""Incrementally built dependency graph of tasks on a shared executor"""
+import logging
+import threading
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """
+    Run named tasks as soon as their dependencies have finished.
+
+    Nodes may be added while earlier ones are already running (for example
+    page tasks as a streamed script produces pages), and every node is
+    submitted to ``executor`` the moment its last dependency completes. A
+    failed dependency does not block its dependents; tasks inspect shared
+    state to decide what to do with missing inputs.
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._cond = threading.Condition(threading.RLock())
+        self._pending: Dict[str, Tuple[List[str], Callable[[], Any]]] = {}
+        self._running: Dict[str, Future] = {}
+        self.results: Dict[str, bool] = {}
+
+    def add(self, name: str, deps: List[str], fn: Callable[[], Any]):
+        """Add a node; it starts immediately if its dependencies are done"""
+        with self._cond:
+            if name in self._pending or name in self._running or name in self.results:
+                raise ValueError(f"Duplicate task: {name}")
+            self._pending[name] = (list(deps), fn)
+            self._schedule_locked()
+
+    def _schedule_locked(self):
+        for name, (deps, fn) in list(self._pending.items()):
+            # A done-callback may already have scheduled this node re-entrantly
+            if name not in self._pending:
+                continue
+            if all(dep in self.results for dep in deps):
+                del self._pending[name]
+                future = self._executor.submit(fn)
+                self._running[name] = future
+                future.add_done_callback(lambda f, n=name: self._on_done(n, f))
+
+    def _on_done(self, name: str, future: Future):
+        with self._cond:
+            self._running.pop(name, None)
+            error = future.exception()
+            if error is not None:
+                logger.debug(f"Task {name} failed: {error}")
+            self.results[name] = error is None
+            self._schedule_locked()
+            self._cond.notify_all()
+
+    def wait(self):
+        """Block until every added node has finished"""
+        with self._cond:
+            while self._pending or self._running:
+                missing = {
+                    dep for deps, _ in self._pending.values() for dep in deps
+                    if dep not in self.results and dep not in self._pending and dep not in self._running
+                }
+                if missing and not self._running:
+                    raise ValueError(f"Tasks depend on unknown tasks: {', '.join(sorted(missing))}")
+                self._cond.wait()
@@ -0,0 +1,282 @@
+"""Server-side whole-comic generation pipeline"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from core.context_cache import context_cache_manager
+from core.event_stream import EventLog
+from core.image_store import image_store
+from core.scheduler import provider_scheduler
+from core.task_graph import TaskGraph
+from services.comic_service import ComicService
+from services.image_service import ImageService
+
+logger = logging.getLogger(__name__)
+
+# Number of previously generated pages passed as references, same as the frontend
+MAX_PREVIOUS_PAGES = 6
+
+
+class PipelineBusyError(Exception):
+    """Raised when the server is already running its maximum number of pipeline runs"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PipelineRun:
+    """State of one comic pipeline run"""
+
+    def __init__(self, params: Dict[str, Any]):
+        self.run_id = uuid.uuid4().hex
+        self.params = params
+        self.events = EventLog()
+        self.status = "pending"
+        self.pages: List[Dict[str, Any]] = []
+        self.page_images: Dict[int, str] = {}
+        self.cover_url: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "status": self.status,
+            "pages": self.pages,
+            "page_images": [self.page_images.get(i) for i in range(len(self.pages))],
+            "cover_url": self.cover_url,
+            "error": self.error
+        }
+
+
+class ComicPipelineService:
+    """
+    Run script -> page images -> cover on the server as a small DAG.
+
+    Each page image is a node with explicit dependencies; a node is
+    submitted to the worker pool as soon as everything it depends on has
+    finished, so page 1 starts while the script is still streaming and
+    independent pages overlap when ``parallel_pages`` is enabled. Runs keep
+    going when the client disconnects and their events can be replayed.
+    Their provider calls wait for a scheduler slot without a deadline: the
+    worker pool already bounds them and nobody is waiting on a response.
+    """
+
+    _runs: Dict[str, PipelineRun] = {}
+    _lock = threading.Lock()
+    _executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv('PIPELINE_MAX_WORKERS', 8)),
+        thread_name_prefix='comic-pipeline'
+    )
+    RUN_TTL = float(os.getenv('PIPELINE_RUN_TTL', 3600))
+    # Runs in progress at once (0 disables the cap) and the Retry-After given beyond it
+    MAX_ACTIVE_RUNS = int(os.getenv('PIPELINE_MAX_ACTIVE_RUNS', 4))
+    BUSY_RETRY_AFTER = float(os.getenv('PIPELINE_BUSY_RETRY_AFTER', 30))
+
+    @classmethod
+    def start(cls, params: Dict[str, Any]) -> PipelineRun:
+        """
+        Start a pipeline run in the background
+
+        Args:
+            params: Validated request parameters (see /api/generate-comic)
+
+        Returns:
+            The created PipelineRun
+
+        Raises:
+            PipelineBusyError: If MAX_ACTIVE_RUNS runs are still in progress
+        """
+        with cls._lock:
+            cls._prune_locked()
+            active = sum(1 for existing in cls._runs.values() if existing.finished_at is None)
+            if 0 < cls.MAX_ACTIVE_RUNS <= active:
+                raise PipelineBusyError(
+                    f"{active} comic pipelines are already running, please retry later",
+                    cls.BUSY_RETRY_AFTER
+                )
+            run = PipelineRun(params)
+            cls._runs[run.run_id] = run
+        threading.Thread(
+            target=cls._execute,
+            args=(run,),
+            name=f"comic-pipeline-{run.run_id[:8]}",
+            daemon=True
+        ).start()
+        return run
+
+    @classmethod
+    def get_run(cls, run_id: str) -> Optional[PipelineRun]:
+        with cls._lock:
+            cls._prune_locked()
+            return cls._runs.get(run_id)
+
+    @classmethod
+    def _prune_locked(cls):
+        """Drop finished runs older than RUN_TTL"""
+        now = time.time()
+        for run_id, run in list(cls._runs.items()):
+            if run.finished_at and now - run.finished_at > cls.RUN_TTL:
+                del cls._runs[run_id]
+
+    @classmethod
+    def _execute(cls, run: PipelineRun):
+        with provider_scheduler.patient():
+            cls._run_stages(run)
+
+    @classmethod
+    def _run_stages(cls, run: PipelineRun):
+        params = run.params
+        run.status = "running"
+        run.events.append("run", {"run_id": run.run_id, "status": run.status})
+        graph = None
+
+        try:
+            graph = TaskGraph(cls._executor)
+
+            # Stage 1: script (skipped when the caller already has one).
+            # Pages are streamed, so page images start while the model is
+            # still writing later pages.
+            pages = params.get('pages')
+            if pages:
+                for page in pages:
+                    cls._add_page(run, graph, page)
+            else:
+                service = ComicService(
+                    params.get('api_key'),
+                    params['base_url'],
+                    params['model'],
+                    params['comic_style'],
+                    params['language'],
+                    google_api_key=params.get('google_api_key')
+                )
+                for page in service.stream_comic_script(params['prompt'], params['page_count'], params['rows_per_page']):
+                    cls._add_page(run, graph, page)
+            run.events.append("script", {"pages": run.pages, "page_count": len(run.pages)})
+
+            # Final stage: the cover once every page is done
+            if params.get('generate_cover', True) and run.pages:
+                graph.add(
+                    "cover",
+                    [f"page-{i}" for i in range(len(run.pages))],
+                    lambda: cls._patiently(cls._generate_cover, run)
+                )
+            graph.wait()
+
+            run.status = "completed" if len(run.page_images) == len(run.pages) else "partial"
+        except Exception as e:
+            logger.error(f"Pipeline {run.run_id} failed: {e}")
+            run.status = "failed"
+            run.error = str(e)
+            run.events.append("error", {"error": str(e)})
+            if graph is not None:
+                # Let already started pages finish before reporting done
+                graph.wait()
+        finally:
+            context_cache_manager.release(run.run_id, params.get('google_api_key'))
+            run.finished_at = time.time()
+            run.events.append("done", run.to_dict())
+            run.events.close()
+
+    @classmethod
+    def _add_page(cls, run: PipelineRun, graph: TaskGraph, page: Dict[str, Any]):
+        """Record a script page and schedule its image"""
+        index = len(run.pages)
+        run.pages.append(page)
+        run.events.append("script_page", {"index": index, "page": page})
+
+        if index == 0:
+            deps = []
+        elif run.params.get('parallel_pages', False):
+            # Later pages only anchor on page 1 and can run side by side
+            deps = ["page-0"]
+        else:
+            # The first page stays a reference (and context cache prefix) as the window slides
+            window = range(max(1, index - MAX_PREVIOUS_PAGES + 1), index)
+            deps = ["page-0"] + [f"page-{i}" for i in window]
+        graph.add(f"page-{index}", deps, lambda: cls._patiently(cls._generate_page, run, index, deps))
+
+    @staticmethod
+    def _patiently(fn, *args):
+        """Run a graph task in the pipeline's scheduling mode (pool threads start without it)"""
+        with provider_scheduler.patient():
+            return fn(*args)
+
+    @classmethod
+    def _generate_page(cls, run: PipelineRun, index: int, deps: List[str]):
+        params = run.params
+        page_data = run.pages[index]
+        previous = []
+        for dep in deps:
+            dep_index = int(dep.split("-", 1)[1])
+            url = run.page_images.get(dep_index)
+            if url:
+                previous.append({"pageIndex": dep_index, "imageUrl": url, "pageTitle": run.pages[dep_index].get('title', '')})
+        if params.get('reference_img'):
+            previous.insert(0, params['reference_img'])
+
+        try:
+            image_url, prompt = ImageService.generate_comic_image(
+                page_data=page_data,
+                comic_style=params['comic_style'],
+                extra_body=previous or None,
+                google_api_key=params['google_api_key'],
+                rows_per_page=params['rows_per_page'],
+                language=params['language'],
+                reference_strategy=params.get('reference_strategy'),
+                comic_id=run.run_id
+            )
+            if not image_url:
+                raise ValueError("Image generation failed")
+        except Exception as e:
+            logger.warning(f"Pipeline {run.run_id} page {index + 1} failed: {e}")
+            run.events.append("page_error", {"index": index, "error": str(e)})
+            raise
+
+        run.page_images[index] = image_url
+        run.events.append("page", {
+            "index": index,
+            "image_url": image_url,
+            "variants": image_store.variants_for_url(image_url),
+            "prompt": prompt
+        })
+
+    @classmethod
+    def _generate_cover(cls, run: PipelineRun):
+        params = run.params
+        if not run.page_images:
+            run.events.append("cover_error", {"error": "No page images to base the cover on"})
+            raise ValueError("No page images to base the cover on")
+        references = [
+            {"pageIndex": i, "imageUrl": run.page_images[i], "pageTitle": run.pages[i].get('title', '')}
+            for i in sorted(run.page_images)
+        ]
+        try:
+            image_url, prompt = ImageService.generate_comic_cover(
+                comic_style=params['comic_style'],
+                google_api_key=params['google_api_key'],
+                reference_imgs=references,
+                language=params['language'],
+                custom_requirements=params.get('cover_requirements', ''),
+                reference_strategy=params.get('cover_reference_strategy'),
+                comic_id=run.run_id
+            )
+            if not image_url:
+                raise ValueError("Cover generation failed")
+        except Exception as e:
+            logger.warning(f"Pipeline {run.run_id} cover failed: {e}")
+            run.events.append("cover_error", {"error": str(e)})
+            raise
+
+        run.cover_url = image_url
+        run.events.append("cover", {
+            "image_url": image_url,
+            "variants": image_store.variants_for_url(image_url),
+            "prompt": prompt
+        })
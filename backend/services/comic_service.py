@@ -1,13 +1,20 @@
 """Comic script generation service"""
 import openai
 import json
-from typing import List, Dict, Any
-from langchain_openai import ChatOpenAI
+import os
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
 from langchain_core.messages import HumanMessage, SystemMessage
 from pydantic import BaseModel, Field
-from google import genai
 from google.genai import types
 
+from core.client_registry import client_registry
+from core.memo_cache import script_memo_cache, normalize_prompt
+from core.scheduler import RateLimitedError, provider_scheduler
+from core.stream_buffer import adrain_stream, drain_stream
+from services.prompt_templates import (
+    SCRIPT_LANGUAGE_INSTRUCTIONS, log_prompt_cache_usage, render_prompt, style_description
+)
+
 
 class Panel(BaseModel):
     text: str = Field(description="分镜描述文字")
@@ -24,6 +31,18 @@ class ComicPage(BaseModel):
 class ComicScript(BaseModel):
     pages: List[ComicPage] = Field(description="漫画面板页面列表")
 
+# Script chunks read ahead of a slow client, and how long a full buffer waits for it
+STREAM_BUFFER_CHUNKS = int(os.getenv('SCRIPT_STREAM_BUFFER_CHUNKS', 4096))
+STREAM_CLIENT_TIMEOUT = float(os.getenv('SCRIPT_STREAM_CLIENT_TIMEOUT', 30))
+
+# Structured JSON output settings for Gemini script generation
+_GEMINI_SCRIPT_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=ComicScript,
+    thinking_config=types.ThinkingConfig(thinking_level="low")
+)
+
+
 class ComicService:
     """Comic script generator using OpenAI or Google API"""
     
@@ -34,113 +53,316 @@ class ComicService:
         self.comic_style = comic_style
         self.language = language
         self.google_api_key = google_api_key
+        self.cache_hit = False
     
-    def generate_comic_script(self, prompt: str, page_count: int = 3, rows_per_page: int = 4) -> List[Dict[str, Any]]:
+    def generate_comic_script(self, prompt: str, page_count: int = 3, rows_per_page: int = 4, bypass_cache: bool = False) -> List[Dict[str, Any]]:
         """
         Generate comic script based on user prompt
 
+        Identical requests (after prompt normalization) within
+        SCRIPT_CACHE_TTL are answered from the script memo cache;
+        ``self.cache_hit`` tells the caller which path was taken.
+
         Args:
             prompt: User's description of the comic
             page_count: Number of pages to generate
             rows_per_page: Number of rows per page (3-5)
+            bypass_cache: Always call the model (the result is still memoized)
 
         Returns:
             List of comic page data
         """
-        # Define style descriptions
-        style_descriptions = {
-            "doraemon": "哆啦A梦风格：圆润可爱的角色设计，简洁明快的线条，温馨幽默的氛围",
-            "american": "美式漫画风格：夸张的肌肉线条，英雄主义，强烈的明暗对比",
-            "watercolor": "水彩风格：柔和的色彩过渡，艺术感的笔触，梦幻氛围",
-            "disney": "迪士尼动画风格：经典的迪士尼角色设计，流畅的动作表现，丰富的表情，温暖明亮的色彩，充满魔法和梦幻的氛围",
-            "ghibli": "宫崎骏/吉卜力风格：细腻的自然场景描绘，柔和温暖的色调，充满想象力的奇幻元素，人物表情细腻生动，富有诗意和治愈感",
-            "pixar": "皮克斯动画风格：3D渲染质感，圆润可爱的角色设计，丰富的光影效果，细腻的材质表现，情感表达真挚动人",
-            "shonen": "日本少年漫画风格：充满动感的线条和速度线，夸张的表情和动作，热血激昂的氛围，强烈的视觉冲击力，快节奏的分镜"
-        }
-        
-        # Define language instructions
-        language_instructions = {
-            "zh": "请用中文生成所有内容（包括标题和分镜描述）。",
-            "en": "Please generate all content in English (including titles and panel descriptions).",
-            "ja": "すべてのコンテンツ（タイトルとパネルの説明を含む）を日本語で生成してください。"
-        }
-        
-        style_desc = style_descriptions.get(self.comic_style, style_descriptions["doraemon"])
-        language_instruction = language_instructions.get(self.language, language_instructions["zh"])
-        
-        system_prompt = f"""You are a professional comic storyboard script assistant. Please generate a {page_count}-page comic storyboard script based on the user's description.
+        self.cache_hit = False
+        cache_key = self._script_cache_key(prompt, page_count, rows_per_page)
+        if not bypass_cache:
+            cached = script_memo_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                return cached
+
+        comic_data = self._generate_script(prompt, page_count, rows_per_page)
+        script_memo_cache.put(cache_key, comic_data)
+        return comic_data
+
+    def stream_comic_script(self, prompt: str, page_count: int = 3, rows_per_page: int = 4, bypass_cache: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a comic script, yielding each page as soon as it is complete
+
+        Uses the providers' streaming APIs and an incremental parser, so the
+        first page is available long before the whole script is written.
+        Memoized scripts are replayed from the cache.
+
+        Args:
+            prompt: User's description of the comic
+            page_count: Number of pages to generate
+            rows_per_page: Number of rows per page (3-5)
+            bypass_cache: Always call the model (the result is still memoized)
 
-**IMPORTANT: Please use {style_desc} to design the storyboard content.**
+        Yields:
+            Comic page data, in order
+        """
+        self.cache_hit = False
+        cache_key = self._script_cache_key(prompt, page_count, rows_per_page)
+        if not bypass_cache:
+            cached = script_memo_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                yield from cached
+                return
 
-**Language Requirement: {language_instruction}**
+        system_prompt = self._build_system_prompt(page_count, rows_per_page)
+        parser = ComicScriptStreamParser()
+        pages: List[Dict[str, Any]] = []
+        try:
+            # Read ahead so the provider slot is freed when the model is done,
+            # not when the HTTP client has read every page
+            chunks = drain_stream(self._stream_text(system_prompt, prompt), STREAM_BUFFER_CHUNKS, STREAM_CLIENT_TIMEOUT)
+            for chunk in chunks:
+                for page in parser.feed(chunk):
+                    pages.append(page)
+                    yield page
 
-Please strictly follow the provided Schema structure to generate the storyboard script:
+            if not pages:
+                # The model ignored JSON mode (e.g. wrapped output in markdown)
+                for page in _parse_script_text(parser.text):
+                    pages.append(page)
+                    yield page
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            raise Exception(f"AI generation failed: {str(e)}")
 
-1. **Story Structure**:
-   - Generate a complete and coherent {page_count}-page story.
-   - Each page (ComicPage) should contain approximately {rows_per_page} rows (Rows). You can vary slightly (±1 row) for better storytelling flow, but aim for around {rows_per_page} rows per page.
-   - **Pacing Control**: Each row can contain 1-2 panels (Panels). Mix single-panel rows (for emphasis) with two-panel rows (for dialogue/action) to create dynamic pacing. Avoid strictly alternating patterns - vary the layout naturally based on the story needs.
+        if not pages:
+            raise Exception("AI generation failed: no pages in response")
+        script_memo_cache.put(cache_key, pages)
 
-2. **Visual Design (Critical)**:
-   - **Row Height**: Dynamically adjust `height` based on the importance of the panels.
-     - Standard shots/dialogue: Use '250px'.
-     - Key actions/emphasis shots: Use '350px' or '400px'.
-     - Avoid using the same height for all rows.
-   - **Panel Description**: The `text` field MUST contain specific visual descriptions (e.g., camera angle, facial expressions, body language, background details).
-   - Descriptions should fully reflect the visual style of {self.comic_style}.
+    def _stream_text(self, system_prompt: str, prompt: str) -> Iterator[str]:
+        """Stream raw JSON text for a ComicScript from the configured provider"""
+        if self.api_key:
+            # The lease and the slot are held until the provider stream ends
+            with client_registry.lease_openai_client(self.api_key, self.base_url) as client, \
+                    provider_scheduler.slot(self.api_key, model=self.model):
+                stream = client.chat.completions.create(**self._openai_stream_args(system_prompt, prompt))
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    if chunk.usage is not None:
+                        log_prompt_cache_usage('comic_script', chunk)
+        else:
+            with client_registry.lease_genai_client(self.google_api_key) as client, \
+                    provider_scheduler.slot(self.google_api_key, model="gemini-3-flash-preview"):
+                stream = client.models.generate_content_stream(
+                    model="gemini-3-flash-preview",
+                    contents=[system_prompt, prompt],
+                    config=_GEMINI_SCRIPT_CONFIG
+                )
+                last_chunk = None
+                for chunk in stream:
+                    last_chunk = chunk
+                    if chunk.text:
+                        yield chunk.text
+            if last_chunk is not None:
+                log_prompt_cache_usage('comic_script', last_chunk)
 
-3. **Dialogue Content (Very Important)**:
-   - **Rich Dialogue**: Comics should primarily tell stories through dialogue and spoken text. 
-   - **Speech Bubbles**: In the `text` field, use quotes to indicate character dialogue (e.g., "Character A: 'Hello, how are you?'"). This text will appear as speech bubbles in the comic.
-   - **Balance**: Prioritize dialogue over internal thoughts. Show emotions through what characters SAY and DO, not just what they think. Internal monologue should be minimal.
-   - **Readable Comics**: Ensure readers can follow the story through dialogue alone. Each panel should have verbal content when characters are present.
+    async def generate_comic_script_async(self, prompt: str, page_count: int = 3, rows_per_page: int = 4, bypass_cache: bool = False) -> List[Dict[str, Any]]:
+        """Async variant of generate_comic_script using the providers' async clients"""
+        self.cache_hit = False
+        cache_key = self._script_cache_key(prompt, page_count, rows_per_page)
+        if not bypass_cache:
+            cached = script_memo_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                return cached
 
-4. **Language**:
-   - All content (titles, descriptions, dialogue) must follow the language requirement: {language_instruction}"""
+        comic_data = await self._generate_script_async(prompt, page_count, rows_per_page)
+        script_memo_cache.put(cache_key, comic_data)
+        return comic_data
 
+    async def stream_comic_script_async(self, prompt: str, page_count: int = 3, rows_per_page: int = 4, bypass_cache: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_comic_script"""
+        self.cache_hit = False
+        cache_key = self._script_cache_key(prompt, page_count, rows_per_page)
+        if not bypass_cache:
+            cached = script_memo_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                for page in cached:
+                    yield page
+                return
+
+        system_prompt = self._build_system_prompt(page_count, rows_per_page)
+        parser = ComicScriptStreamParser()
+        pages: List[Dict[str, Any]] = []
         try:
-            if self.api_key:
-                llm = ChatOpenAI(model=self.model, openai_api_key=self.api_key, base_url=self.base_url, temperature=0.7, max_tokens=3000)
-                structured_llm = llm.with_structured_output(ComicScript)
-                response: ComicScript = structured_llm.invoke(
-                    input=[
-                        SystemMessage(content=system_prompt),
-                        HumanMessage(content=prompt)
-                    ],
+            chunks = adrain_stream(self._astream_text(system_prompt, prompt), STREAM_BUFFER_CHUNKS, STREAM_CLIENT_TIMEOUT)
+            async for chunk in chunks:
+                for page in parser.feed(chunk):
+                    pages.append(page)
+                    yield page
+
+            if not pages:
+                for page in _parse_script_text(parser.text):
+                    pages.append(page)
+                    yield page
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            raise Exception(f"AI generation failed: {str(e)}")
+
+        if not pages:
+            raise Exception("AI generation failed: no pages in response")
+        script_memo_cache.put(cache_key, pages)
+
+    async def _astream_text(self, system_prompt: str, prompt: str) -> AsyncIterator[str]:
+        """Async variant of _stream_text"""
+        if self.api_key:
+            async with client_registry.lease_async_openai_client(self.api_key, self.base_url) as client, \
+                    provider_scheduler.aslot(self.api_key, model=self.model):
+                stream = await client.chat.completions.create(**self._openai_stream_args(system_prompt, prompt))
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    if chunk.usage is not None:
+                        log_prompt_cache_usage('comic_script', chunk)
+        else:
+            async with client_registry.lease_genai_client(self.google_api_key) as client, \
+                    provider_scheduler.aslot(self.google_api_key, model="gemini-3-flash-preview"):
+                stream = await client.aio.models.generate_content_stream(
+                    model="gemini-3-flash-preview",
+                    contents=[system_prompt, prompt],
+                    config=_GEMINI_SCRIPT_CONFIG
                 )
+                last_chunk = None
+                async for chunk in stream:
+                    last_chunk = chunk
+                    if chunk.text:
+                        yield chunk.text
+            if last_chunk is not None:
+                log_prompt_cache_usage('comic_script', last_chunk)
+
+    async def _generate_script_async(self, prompt: str, page_count: int, rows_per_page: int) -> List[Dict[str, Any]]:
+        """Async variant of _generate_script"""
+        system_prompt = self._build_system_prompt(page_count, rows_per_page)
+
+        try:
+            if self.api_key:
+                async with client_registry.lease_chat_openai(self.api_key, self.base_url, self.model, temperature=0.7, max_tokens=3000) as llm, \
+                        provider_scheduler.aslot(self.api_key, model=self.model):
+                    structured_llm = llm.with_structured_output(ComicScript, include_raw=True)
+                    result = await structured_llm.ainvoke(
+                        input=[
+                            SystemMessage(content=system_prompt),
+                            HumanMessage(content=prompt)
+                        ],
+                    )
+                log_prompt_cache_usage('comic_script', result['raw'])
+                if result.get('parsing_error') is not None:
+                    raise result['parsing_error']
+                return [elem.model_dump() for elem in result['parsed'].pages]
+            else:
+                async with client_registry.lease_genai_client(self.google_api_key) as client, \
+                        provider_scheduler.aslot(self.google_api_key, model="gemini-3-flash-preview"):
+                    response = await client.aio.models.generate_content(
+                        model="gemini-3-flash-preview",
+                        contents=[system_prompt, prompt],
+                        config=_GEMINI_SCRIPT_CONFIG
+                    )
+                log_prompt_cache_usage('comic_script', response)
+                if not response.parsed:
+                    return _parse_script_text(response.text)
+                return [elem.model_dump() for elem in response.parsed.pages]
+
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            raise Exception(f"AI generation failed: {str(e)}")
+
+    def _openai_stream_args(self, system_prompt: str, prompt: str) -> Dict[str, Any]:
+        """Chat completion arguments for a streamed ComicScript"""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 3000,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "ComicScript", "schema": ComicScript.model_json_schema()}
+            }
+        }
+
+    def _script_cache_key(self, prompt: str, page_count: int, rows_per_page: int) -> str:
+        """Memo cache key for a script request"""
+        return script_memo_cache.make_key(
+            prompt=normalize_prompt(prompt),
+            page_count=page_count,
+            rows_per_page=rows_per_page,
+            comic_style=self.comic_style,
+            language=self.language,
+            provider='openai' if self.api_key else 'gemini',
+            model=self.model if self.api_key else 'gemini-3-flash-preview',
+            base_url=self.base_url if self.api_key else None
+        )
+
+    def _build_system_prompt(self, page_count: int, rows_per_page: int) -> str:
+        """Build the storyboard system prompt (static instructions first, request settings last)"""
+        return render_prompt(
+            'comic_script',
+            page_count=page_count,
+            rows_per_page=rows_per_page,
+            comic_style=self.comic_style,
+            style_desc=style_description(self.comic_style),
+            language_instruction=SCRIPT_LANGUAGE_INSTRUCTIONS.get(self.language, SCRIPT_LANGUAGE_INSTRUCTIONS["zh"])
+        )
+
+    def _generate_script(self, prompt: str, page_count: int, rows_per_page: int) -> List[Dict[str, Any]]:
+        """Call the configured model to generate a comic script"""
+        system_prompt = self._build_system_prompt(page_count, rows_per_page)
+
+        try:
+            if self.api_key:
+                with client_registry.lease_chat_openai(self.api_key, self.base_url, self.model, temperature=0.7, max_tokens=3000) as llm, \
+                        provider_scheduler.slot(self.api_key, model=self.model):
+                    structured_llm = llm.with_structured_output(ComicScript, include_raw=True)
+                    result = structured_llm.invoke(
+                        input=[
+                            SystemMessage(content=system_prompt),
+                            HumanMessage(content=prompt)
+                        ],
+                    )
+                log_prompt_cache_usage('comic_script', result['raw'])
+                if result.get('parsing_error') is not None:
+                    raise result['parsing_error']
+                response: ComicScript = result['parsed']
                 
                 # Parse and validate JSON
                 comic_data = [elem.model_dump() for elem in response.pages]
                 return comic_data
             else:
                 # Fallback to Google Gemini
-                client = genai.Client(api_key=self.google_api_key)
-                response = client.models.generate_content(
-                    model="gemini-3-flash-preview",
-                    contents=[system_prompt, prompt],
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=ComicScript,
-                        thinking_config=types.ThinkingConfig(thinking_level="low")
+                with client_registry.lease_genai_client(self.google_api_key) as client, \
+                        provider_scheduler.slot(self.google_api_key, model="gemini-3-flash-preview"):
+                    response = client.models.generate_content(
+                        model="gemini-3-flash-preview",
+                        contents=[system_prompt, prompt],
+                        config=_GEMINI_SCRIPT_CONFIG
                     )
-                )
+                log_prompt_cache_usage('comic_script', response)
                 
                 # Parse Google response
                 comic_script_data = response.parsed
                 if not comic_script_data:
                     # Retry with raw JSON parsing if needed
-                    text_response = response.text
-                    # Extract JSON from potential markdown
-                    if "```json" in text_response:
-                        text_response = text_response.split("```json")[1].split("```")[0].strip()
-                    elif "```" in text_response:
-                        text_response = text_response.split("```")[1].split("```")[0].strip()
-                    
-                    data = json.loads(text_response)
-                    comic_script_data = ComicScript(**data)
+                    return _parse_script_text(response.text)
                 
                 return [elem.model_dump() for elem in comic_script_data.pages]
             
+        except RateLimitedError:
+            raise
         except Exception as e:
             raise Exception(f"AI generation failed: {str(e)}")
 
@@ -187,3 +409,77 @@ def validate_script(script) -> tuple[bool, str]:
             return False, "Invalid page structure"
     
     return True, ""
+
+
+def _parse_script_text(text_response: str) -> List[Dict[str, Any]]:
+    """Parse a complete ComicScript JSON document, tolerating markdown fences"""
+    # Extract JSON from potential markdown
+    if "```json" in text_response:
+        text_response = text_response.split("```json")[1].split("```")[0].strip()
+    elif "```" in text_response:
+        text_response = text_response.split("```")[1].split("```")[0].strip()
+
+    data = json.loads(text_response)
+    if isinstance(data, list):
+        data = {"pages": data}
+    return [elem.model_dump() for elem in ComicScript(**data).pages]
+
+
+class ComicScriptStreamParser:
+    """
+    Incremental parser for streamed ComicScript JSON.
+
+    Feed it text chunks as they arrive; it scans each character once,
+    tracking string/escape state and nesting depth, and returns every
+    ComicPage object inside the ``pages`` array (or a bare top-level array)
+    as soon as its closing brace arrives, validated against the schema.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pages_depth: Optional[int] = None
+        self._page_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk and return the pages completed by it"""
+        self.text += chunk
+        pages = []
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:self._pos]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif ch in '{[':
+                if self._pages_depth is None and ch == '[' and (
+                    self._depth == 0 or (self._depth == 1 and self._last_string == 'pages')
+                ):
+                    self._pages_depth = self._depth + 1
+                elif ch == '{' and self._pages_depth is not None and self._depth == self._pages_depth:
+                    self._page_start = self._pos
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._pages_depth is not None:
+                    if ch == '}' and self._depth == self._pages_depth and self._page_start is not None:
+                        page = json.loads(text[self._page_start:self._pos + 1])
+                        pages.append(ComicPage.model_validate(page).model_dump())
+                        self._page_start = None
+                    elif ch == ']' and self._depth == self._pages_depth - 1:
+                        self._pages_depth = -1  # pages array closed, ignore anything after
+            self._pos += 1
+        return pages
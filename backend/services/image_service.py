@@ -1,8 +1,15 @@
 """Image generation service"""
+import asyncio
+import json
 import os
-import requests
 from typing import List, Dict, Any, Optional, Union
-from comic_generator import generate_social_media_image_core
+from comic_generator import generate_social_media_image_core, generate_social_media_image_core_async
+from core.context_cache import context_cache_manager
+from core.image_proxy import ProxiedImage, image_proxy
+from services.prompt_templates import (
+    COVER_INSTRUCTIONS, PAGE_INSTRUCTIONS, PAGE_NEGATIVE_PROMPT, language_name, render_prompt
+)
+from services.reference_selection import select_references, stable_reference_count
 
 
 class ImageService:
@@ -16,7 +23,11 @@ class ImageService:
         extra_body: Optional[List] = None,
         google_api_key: str = None,
         rows_per_page: Optional[int] = None,
-        language: str = 'en'
+        language: str = 'en',
+        reference_strategy: Optional[Union[str, Dict[str, Any]]] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        hedge: Optional[bool] = None
     ) -> tuple[Optional[str], str]:
         """
         Generate comic image from page data
@@ -29,29 +40,64 @@ class ImageService:
             google_api_key: Google API key for image generation
             rows_per_page: Optional number of rows to strictly limit (3-5)
             language: Language of the comic content
+            reference_strategy: Optional reference selection strategy name or options
+            bypass_cache: Skip the image result cache lookup (e.g. "regenerate")
+            comic_id: Optional comic/session id; lets pages of one comic share
+                a provider-side context cache
+            hedge: Hedge slow provider calls (None uses IMAGE_HEDGE_ENABLED)
 
         Returns:
             Tuple of (image_url, prompt)
         """
+        core_args, prompt = ImageService._page_image_args(
+            page_data, comic_style, reference_img, extra_body, google_api_key, rows_per_page,
+            language, reference_strategy, bypass_cache, comic_id, hedge
+        )
+        return generate_social_media_image_core(**core_args), prompt
+
+    @staticmethod
+    async def generate_comic_image_async(**kwargs) -> tuple[Optional[str], str]:
+        """Async variant of generate_comic_image; takes the same arguments"""
+        # Reference selection loads (downloads, decodes, re-encodes) the
+        # references to size them: keep that off the event loop
+        core_args, prompt = await asyncio.to_thread(ImageService._page_image_args, **kwargs)
+        return await generate_social_media_image_core_async(**core_args), prompt
+
+    @staticmethod
+    def _page_image_args(
+        page_data: Dict[str, Any],
+        comic_style: str = 'doraemon',
+        reference_img: Optional[Union[str, List[str]]] = None,
+        extra_body: Optional[List] = None,
+        google_api_key: str = None,
+        rows_per_page: Optional[int] = None,
+        language: str = 'en',
+        reference_strategy: Optional[Union[str, Dict[str, Any]]] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        hedge: Optional[bool] = None
+    ) -> tuple[Dict[str, Any], str]:
+        """Build the image core arguments and the prompt for a page"""
         # Truncate page data to rows_per_page if specified
         if rows_per_page is not None and 'rows' in page_data:
             page_data = page_data.copy()  # Don't modify original
             page_data['rows'] = page_data['rows'][:rows_per_page]
 
-        # Convert page data to prompt with style and language
-        prompt = ImageService._convert_page_to_prompt(page_data, comic_style, language)
+        # Convert page data to prompt with style and language; with a
+        # context cache the static instructions are sent separately
+        use_context_cache = bool(comic_id) and context_cache_manager.enabled
+        prompt = ImageService._convert_page_to_prompt(
+            page_data, comic_style, language, include_static=not use_context_cache
+        )
         
         # Prepare reference images (can be single image or array)
         reference_images = []
         
-        # Add previous generated pages as additional references
+        # Add previous generated pages as additional references,
+        # bounded by the selected reference strategy
         if extra_body and isinstance(extra_body, list):
             # extra_body contains previous page URLs
-            for prev_page in extra_body:
-                if isinstance(prev_page, dict) and 'imageUrl' in prev_page:
-                    reference_images.append(prev_page['imageUrl'])
-                elif isinstance(prev_page, str):
-                    reference_images.append(prev_page)
+            reference_images = select_references(extra_body, reference_strategy)
         
         # # Add current page sketch as last reference
         # if reference_img:
@@ -63,14 +109,18 @@ class ImageService:
         # Use reference_images if we have any, otherwise None
         final_reference = reference_images if reference_images else None
         
-        # Generate image
-        image_url = generate_social_media_image_core(
-            prompt=prompt,
-            reference_img=final_reference,
-            google_api_key=google_api_key
-        )
-        
-        return image_url, prompt
+        core_args = {
+            "prompt": prompt,
+            "reference_img": final_reference,
+            "google_api_key": google_api_key,
+            "metadata": {'style': comic_style},
+            "bypass_cache": bypass_cache,
+            "comic_id": comic_id if use_context_cache else None,
+            "instructions": PAGE_INSTRUCTIONS if use_context_cache else None,
+            "stable_references": stable_reference_count(extra_body, reference_images) if use_context_cache else 0,
+            "hedge": hedge
+        }
+        return core_args, prompt
     
     @staticmethod
     def generate_comic_cover(
@@ -78,7 +128,11 @@ class ImageService:
         google_api_key: str = None,
         reference_imgs: List[Union[str, Dict]] = None,
         language: str = 'en',
-        custom_requirements: str = ''
+        custom_requirements: str = '',
+        reference_strategy: Optional[Union[str, Dict[str, Any]]] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        hedge: Optional[bool] = None
     ) -> tuple[Optional[str], str]:
         """
         Generate comic cover image
@@ -89,32 +143,65 @@ class ImageService:
             reference_imgs: List of reference image URLs
             language: Language of the comic
             custom_requirements: User's custom cover requirements (optional)
+            reference_strategy: Optional reference selection strategy name or options
+            bypass_cache: Skip the image result cache lookup
+            comic_id: Optional comic/session id for the provider context cache
+            hedge: Hedge slow provider calls (None uses IMAGE_HEDGE_ENABLED)
 
         Returns:
             Tuple of (image_url, prompt)
         """
+        core_args, prompt = ImageService._cover_image_args(
+            comic_style, google_api_key, reference_imgs, language, custom_requirements,
+            reference_strategy, bypass_cache, comic_id, hedge
+        )
+        return generate_social_media_image_core(**core_args), prompt
+
+    @staticmethod
+    async def generate_comic_cover_async(**kwargs) -> tuple[Optional[str], str]:
+        """Async variant of generate_comic_cover; takes the same arguments"""
+        core_args, prompt = await asyncio.to_thread(ImageService._cover_image_args, **kwargs)
+        return await generate_social_media_image_core_async(**core_args), prompt
+
+    @staticmethod
+    def _cover_image_args(
+        comic_style: str = 'doraemon',
+        google_api_key: str = None,
+        reference_imgs: List[Union[str, Dict]] = None,
+        language: str = 'en',
+        custom_requirements: str = '',
+        reference_strategy: Optional[Union[str, Dict[str, Any]]] = None,
+        bypass_cache: bool = False,
+        comic_id: Optional[str] = None,
+        hedge: Optional[bool] = None
+    ) -> tuple[Dict[str, Any], str]:
+        """Build the image core arguments and the prompt for a cover"""
         # Create cover prompt
-        prompt = ImageService._create_cover_prompt(comic_style, language, custom_requirements)
+        use_context_cache = bool(comic_id) and context_cache_manager.enabled
+        prompt = ImageService._create_cover_prompt(
+            comic_style, language, custom_requirements, include_static=not use_context_cache
+        )
         
         # Prepare reference images list (extract URLs from objects if needed)
         processed_refs = []
         if reference_imgs:
-            for img in reference_imgs:
-                if isinstance(img, dict) and 'imageUrl' in img:
-                    processed_refs.append(img['imageUrl'])
-                elif isinstance(img, str):
-                    processed_refs.append(img)
+            processed_refs = select_references(reference_imgs, reference_strategy)
 
-        image_url = generate_social_media_image_core(
-            prompt=prompt,
-            reference_img=processed_refs,
-            google_api_key=google_api_key
-        )
-        
-        return image_url, prompt
+        core_args = {
+            "prompt": prompt,
+            "reference_img": processed_refs,
+            "google_api_key": google_api_key,
+            "metadata": {'style': comic_style},
+            "bypass_cache": bypass_cache,
+            "comic_id": comic_id if use_context_cache else None,
+            "instructions": COVER_INSTRUCTIONS if use_context_cache else None,
+            "stable_references": stable_reference_count(reference_imgs, processed_refs) if use_context_cache else 0,
+            "hedge": hedge
+        }
+        return core_args, prompt
     
     @staticmethod
-    def proxy_image_download(image_url: str) -> tuple[bytes, str]:
+    def proxy_image_download(image_url: str) -> ProxiedImage:
         """
         Proxy image download to bypass CORS restrictions
         
@@ -122,21 +209,28 @@ class ImageService:
             image_url: URL of the image to download
             
         Returns:
-            Tuple of (image_content, content_type)
+            ProxiedImage streaming the body from upstream or the disk cache
+
+        Raises:
+            ProxyError: If the image cannot be fetched or is not acceptable
         """
-        response = requests.get(image_url, timeout=60)
-        
-        if response.status_code != 200:
-            raise Exception(f"Failed to fetch image: {response.status_code}")
-        
-        content_type = response.headers.get('Content-Type', 'image/png')
-        return response.content, content_type
+        return image_proxy.fetch(image_url)
     
     @staticmethod
-    def _convert_page_to_prompt(page_data: Dict[str, Any], comic_style: str = 'doraemon', language: str = 'en') -> str:
-        """Convert page data to image generation prompt"""
-        import json
-        
+    def _convert_page_to_prompt(
+        page_data: Dict[str, Any],
+        comic_style: str = 'doraemon',
+        language: str = 'en',
+        include_static: bool = True
+    ) -> str:
+        """
+        Convert page data to image generation prompt
+
+        Static requirements and the negative prompt come first so every page
+        of every comic shares the same prompt prefix; style, language and
+        the page content follow. With ``include_static=False`` the static
+        parts are left out (they are sent as PAGE_INSTRUCTIONS instead).
+        """
         panels = []
         if 'rows' in page_data:
             for i, row in enumerate(page_data['rows'], 1):
@@ -145,108 +239,35 @@ class ImageService:
                         if 'text' in panel:
                             panels.append(f"Panel {i}-{j}: {panel['text']}")
 
-        language_map = {
-            'zh': 'Chinese (简体中文)',
-            'en': 'English',
-            'ja': 'Japanese (日本語)',
-            'ko': 'Korean (한국어)',
-            'fr': 'French (Français)',
-            'de': 'German (Deutsch)',
-            'es': 'Spanish (Español)'
-        }
-        target_lang = language_map.get(language, 'English')
-
-        # Main prompt content
-        prompt_content = """Using the style of {comic_style}, convert the storyline in each panel of the reference image into corresponding comic content. All text in the comic, including titles and speech bubbles, MUST be in {target_lang}.
-
-# Content:
-
-## Title
-{title}
+        target_lang = language_name(language)
 
-## Panels
-{panels}"""
-
-        # Requirements section (positive guidance only)
-        requirements_content = """- Maintain consistency in characters and scenes.
-- The image should be colorful and vibrant.
-- Include speech bubbles with short, clear dialogue to help tell the story.
-- Ensure text is legible and spelled correctly.
-- All dialogue and titles MUST be in {target_lang}.
-- Display the title only once, typically at the top center of the comic page.
-- Maintain consistent and uniform margins around the entire comic page.
-- Ensure equal spacing on all sides (top, bottom, left, right) for a professional appearance.
-- The comic title should use a {comic_style}-style font that matches the overall comic aesthetic.
-- Use fonts that properly support {target_lang} characters.
-- Ensure all text is correctly encoded and displayed clearly.
-- Text should be clear, sharp, and properly rendered in both speech bubbles and titles.
-- Character Consistency: Use the first provided images (previous pages) as the definitive source for character appearances. These may also include user-provided reference images for maintaining character, prop, or item consistency. Carry over the exact facial features, hair styles, and identical clothing/outfits."""
-
-        # Negative prompt (all negative constraints)
-        negative_prompt = "overly complex panels, complex panel content, inconsistent characters, distorted proportions, dull colors, panel indices visible, panel numbers shown, cluttered dialogue, verbose dialogue, illegible text, misspelled words, duplicated titles, multiple title locations, uneven margins, mismatched fonts, text corruption, mojibake, garbled characters, blurry text, character appearance changes, incorrect clothing, clothing changes without script requirement, layout deviation from sketch, costume changes"
-        
-        # Format the content
-        formatted_prompt = prompt_content.format(
-            comic_style=comic_style, 
-            title=page_data.get('title', ''),
-            panels="\n".join(panels),
-            target_lang=target_lang
-        )
-        
-        formatted_requirements = requirements_content.format(
+        # Create structured JSON; key order is preserved in the output
+        generation_data = {
+            "requirements": render_prompt(
+                'page_requirements', static=include_static, comic_style=comic_style, target_lang=target_lang
+            )
+        }
+        if include_static:
+            generation_data["negative_prompt"] = PAGE_NEGATIVE_PROMPT
+        generation_data["prompt"] = render_prompt(
+            'page_content',
             comic_style=comic_style,
-            target_lang=target_lang
+            target_lang=target_lang,
+            title=page_data.get('title', ''),
+            panels="\n".join(panels)
         )
-        
-        # Create structured JSON
-        img_prompt = {
-            "image_generation_data": {
-                "prompt": formatted_prompt.strip(),
-                "requirements": formatted_requirements.strip(),
-                "negative_prompt": negative_prompt
-            }
-        }
+        img_prompt = {"image_generation_data": generation_data}
         
         return json.dumps(img_prompt, ensure_ascii=False)
 
     @staticmethod
-    def _create_cover_prompt(comic_style: str, language: str = 'en', custom_requirements: str = '') -> str:
-        """Create prompt for comic cover"""
-        language_map = {
-            'zh': 'Chinese (简体中文)',
-            'en': 'English',
-            'ja': 'Japanese (日本語)',
-            'ko': 'Korean (한국어)',
-            'fr': 'French (Français)',
-            'de': 'German (Deutsch)',
-            'es': 'Spanish (Español)'
-        }
-
-        target_lang = language_map.get(language, 'English')
-
-        prompt_template = """Create a high-quality comic book cover in the style of {comic_style}.
-
-# Important Context:
-- The reference images provided show the story pages of this comic.
-- You MUST base the cover on the characters, scenes, and storyline shown in these reference images.
-- The cover should capture the essence and key moments from the story pages.
-- Use the same characters, props, and items with consistent appearances as shown in the reference images.
-
-# Requirements:
-- The image must be a vertical comic book cover composition.
-- The art style must strictly follow {comic_style}.
-- Make it eye-catching and dramatic while staying true to the story.
-- Feature the main characters and key scenes from the reference story pages.
-- High resolution, detailed, and professional quality.
-- No other text except the title.
-- The title text must be in {target_lang}.
-- Clear and sharp text for the title, do not repeat all the titles in reference images.
-- Vibrant colors and "Cover Art" aesthetic.
-- Only present one row one panel in the cover.
-- Ensure all characters in the title are correctly rendered and legible.
-- The cover should feel like a natural introduction to the story shown in the reference pages.
-{custom_section}"""
-
+    def _create_cover_prompt(
+        comic_style: str,
+        language: str = 'en',
+        custom_requirements: str = '',
+        include_static: bool = True
+    ) -> str:
+        """Create prompt for comic cover (without COVER_INSTRUCTIONS if ``include_static`` is False)"""
         # Add custom requirements if provided
         custom_section = ""
         if custom_requirements and custom_requirements.strip():
@@ -261,9 +282,11 @@ User Requirements:
 
 ** You MUST implement ALL of the above user requirements. They are mandatory. **"""
 
-        final_prompt = prompt_template.format(
+        final_prompt = render_prompt(
+            'cover',
+            static=include_static,
             comic_style=comic_style,
-            target_lang=target_lang,
+            target_lang=language_name(language),
             custom_section=custom_section
         )
         return final_prompt.strip()
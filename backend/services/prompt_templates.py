@@ -0,0 +1,328 @@
+"""Prompt template registry shared by the generation services"""
+import logging
+import threading
+from string import Formatter
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Comic style descriptions used by script generation and prompt optimization
+STYLE_DESCRIPTIONS = {
+    "doraemon": "哆啦A梦风格：圆润可爱的角色设计，简洁明快的线条，温馨幽默的氛围",
+    "american": "美式漫画风格：夸张的肌肉线条，英雄主义，强烈的明暗对比",
+    "watercolor": "水彩风格：柔和的色彩过渡，艺术感的笔触，梦幻氛围",
+    "disney": "迪士尼动画风格：经典的迪士尼角色设计，流畅的动作表现，丰富的表情，温暖明亮的色彩，充满魔法和梦幻的氛围",
+    "ghibli": "宫崎骏/吉卜力风格：细腻的自然场景描绘，柔和温暖的色调，充满想象力的奇幻元素，人物表情细腻生动，富有诗意和治愈感",
+    "pixar": "皮克斯动画风格：3D渲染质感，圆润可爱的角色设计，丰富的光影效果，细腻的材质表现，情感表达真挚动人",
+    "shonen": "日本少年漫画风格：充满动感的线条和速度线，夸张的表情和动作，热血激昂的氛围，强烈的视觉冲击力，快节奏的分镜"
+}
+
+# Target language names used in image prompts
+LANGUAGE_NAMES = {
+    'zh': 'Chinese (简体中文)',
+    'en': 'English',
+    'ja': 'Japanese (日本語)',
+    'ko': 'Korean (한국어)',
+    'fr': 'French (Français)',
+    'de': 'German (Deutsch)',
+    'es': 'Spanish (Español)'
+}
+
+SCRIPT_LANGUAGE_INSTRUCTIONS = {
+    "zh": "请用中文生成所有内容（包括标题和分镜描述）。",
+    "en": "Please generate all content in English (including titles and panel descriptions).",
+    "ja": "すべてのコンテンツ（タイトルとパネルの説明を含む）を日本語で生成してください。"
+}
+
+OPTIMIZER_LANGUAGE_INSTRUCTIONS = {
+    "zh": "请用中文优化提示词。",
+    "en": "Please optimize the prompt in English.",
+    "ja": "日本語でプロンプトを最適化してください。"
+}
+
+TITLE_LANGUAGE_INSTRUCTIONS = {
+    "zh": "请用中文生成标题。标题应该简洁（5-15个汉字），有吸引力，能概括故事的核心主题或亮点。",
+    "en": "Generate the title in English. The title should be concise (3-8 words), catchy, and capture the core theme or highlight of the story.",
+    "ja": "日本語でタイトルを生成してください。タイトルは簡潔（5-15文字）で、魅力的で、ストーリーの核心テーマまたはハイライトを捉えたものにしてください。"
+}
+
+
+def style_description(comic_style: str) -> str:
+    return STYLE_DESCRIPTIONS.get(comic_style, STYLE_DESCRIPTIONS["doraemon"])
+
+
+def language_name(language: str) -> str:
+    return LANGUAGE_NAMES.get(language, 'English')
+
+
+class PromptTemplate:
+    """
+    A prompt split into a static prefix and a variable suffix.
+
+    Providers cache the longest previously seen prompt prefix, so every
+    byte that does not depend on the request lives in ``static`` and the
+    per-request values are only substituted into ``variable``, which is
+    appended last. The variable part is parsed once, when the template is
+    registered.
+    """
+
+    def __init__(self, name: str, static: str, variable: str):
+        self.name = name
+        self.static = static.strip()
+        self.variable = variable.strip()
+        self.fields = frozenset(
+            field for _, field, _, _ in Formatter().parse(self.variable) if field
+        )
+
+    def render_variable(self, **values: Any) -> str:
+        """Render only the variable part (the static part is sent separately)"""
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Template {self.name} is missing values: {', '.join(sorted(missing))}")
+        return self.variable.format(**values)
+
+    def render(self, **values: Any) -> str:
+        return f"{self.static}\n\n{self.render_variable(**values)}"
+
+
+TEMPLATES: Dict[str, PromptTemplate] = {}
+
+
+def register_template(name: str, static: str, variable: str) -> PromptTemplate:
+    template = PromptTemplate(name, static, variable)
+    TEMPLATES[name] = template
+    return template
+
+
+def render_prompt(name: str, static: bool = True, **values: Any) -> str:
+    """Render a registered template; ``static=False`` leaves out its static prefix"""
+    template = TEMPLATES[name]
+    return template.render(**values) if static else template.render_variable(**values)
+
+
+register_template(
+    'comic_script',
+    static="""You are a professional comic storyboard script assistant. Please generate a comic storyboard script based on the user's description, using the page count, rows per page, visual style and language given under **Request Settings** at the end of these instructions.
+
+Please strictly follow the provided Schema structure to generate the storyboard script:
+
+1. **Story Structure**:
+   - Generate a complete and coherent story with exactly the requested number of pages.
+   - Each page (ComicPage) should contain approximately the requested number of rows (Rows). You can vary slightly (±1 row) for better storytelling flow, but aim for around that many rows per page.
+   - **Pacing Control**: Each row can contain 1-2 panels (Panels). Mix single-panel rows (for emphasis) with two-panel rows (for dialogue/action) to create dynamic pacing. Avoid strictly alternating patterns - vary the layout naturally based on the story needs.
+
+2. **Visual Design (Critical)**:
+   - **Row Height**: Dynamically adjust `height` based on the importance of the panels.
+     - Standard shots/dialogue: Use '250px'.
+     - Key actions/emphasis shots: Use '350px' or '400px'.
+     - Avoid using the same height for all rows.
+   - **Panel Description**: The `text` field MUST contain specific visual descriptions (e.g., camera angle, facial expressions, body language, background details).
+   - Descriptions should fully reflect the requested visual style.
+
+3. **Dialogue Content (Very Important)**:
+   - **Rich Dialogue**: Comics should primarily tell stories through dialogue and spoken text.
+   - **Speech Bubbles**: In the `text` field, use quotes to indicate character dialogue (e.g., "Character A: 'Hello, how are you?'"). This text will appear as speech bubbles in the comic.
+   - **Balance**: Prioritize dialogue over internal thoughts. Show emotions through what characters SAY and DO, not just what they think. Internal monologue should be minimal.
+   - **Readable Comics**: Ensure readers can follow the story through dialogue alone. Each panel should have verbal content when characters are present.
+
+4. **Language**:
+   - All content (titles, descriptions, dialogue) must follow the language requirement under Request Settings.""",
+    variable="""**Request Settings**:
+- Pages: {page_count}
+- Rows per page: about {rows_per_page}
+- **IMPORTANT: Please use {style_desc} to design the storyboard content.** (style: {comic_style})
+- **Language Requirement: {language_instruction}**"""
+)
+
+register_template(
+    'prompt_optimizer',
+    static="""You are a professional comic storyboard prompt optimizer. Your task is to take a user's simple idea and expand it into a detailed, vivid description suitable for comic storyboard generation.
+
+**Your Task**:
+1. Understand the user's core idea and intent
+2. Expand it with rich visual details suitable for comic panels:
+   - Character descriptions (appearance, expressions, clothing)
+   - Scene settings (location, atmosphere, time of day)
+   - Key actions and interactions
+   - Emotional tones and story beats
+3. Structure the description to support multi-panel storytelling
+4. Make it vivid and specific enough for visual generation
+5. Keep it concise but comprehensive (2-4 sentences)
+
+**Output Format**:
+- Single paragraph with clear, visual descriptions
+- Include specific details about characters, settings, and actions
+- Maintain story flow and coherence
+- Emphasize visual elements over abstract concepts
+
+**Important**:
+- Focus on what CAN BE SEEN in comic panels
+- Use concrete visual language
+- Consider the comic style context below in your descriptions
+- Output ONLY the optimized prompt, no explanations or meta-commentary""",
+    variable="""**Comic Style Context**: {style_desc}
+
+**Language Requirement**: {language_instruction}"""
+)
+
+register_template(
+    'session_title',
+    static="""你是一个专业的漫画标题生成器。你的任务是为漫画创作会话生成一个简短、准确、吸引人的标题。
+
+**核心原则**（按优先级排序）：
+1. **准确性第一**：标题必须准确反映故事的核心主题，不要过度发挥创意而偏离主题
+2. **简洁明了**：控制在推荐长度内，去除冗余修饰
+3. **抓住重点**：聚焦故事的主角、关键情节或核心冲突
+4. **便于识别**：让用户一眼就能认出这个故事
+
+**标题生成步骤**：
+1. 仔细阅读用户的故事描述和漫画内容
+2. 识别核心要素：主角是谁？主要做什么？核心冲突或主题是什么？
+3. 提炼最关键的1-2个要素
+4. 用最简洁的语言表达出来
+
+**优秀示例**：
+- 用户描述: "讲述小明从零开始学习Python编程，遇到困难但最终做出了第一个网站的故事"
+  → 标题: "小明学编程" （抓住主角+核心行为）
+
+- 用户描述: "一只流浪猫在城市里寻找家的温暖，最终被一个小女孩收养"
+  → 标题: "流浪猫找家记" （抓住主角+核心情节）
+
+- 用户描述: "魔法学院的学生露西发现了一个古老的咒语，她必须阻止黑暗势力利用它"
+  → 标题: "露西与黑暗咒语" （抓住主角+核心冲突）
+
+- 用户描述: "A brave knight fights a dragon to save the kingdom"
+  → 标题: "Dragon Slayer" （抓住核心行为+对手）
+
+**避免的错误**：
+❌ 太长："小明在现代社会中艰难学习编程技术的励志成长故事"
+❌ 太虚："成长的足迹"、"梦想启航" （太空泛，缺乏具体性）
+❌ 偏离主题："编程改变世界" （如果故事核心是小明个人成长，这就偏了）
+❌ 过度修饰："勇敢无畏的小明踏上编程征途"
+
+**输出要求**：
+- 只输出标题本身，不要任何解释
+- 不要引号、书名号等标点符号
+- 严格控制长度""",
+    variable="""**语言要求**: {language_instruction}"""
+)
+
+register_template(
+    'page_requirements',
+    static="""- Maintain consistency in characters and scenes.
+- The image should be colorful and vibrant.
+- Include speech bubbles with short, clear dialogue to help tell the story.
+- Ensure text is legible and spelled correctly.
+- Display the title only once, typically at the top center of the comic page.
+- Maintain consistent and uniform margins around the entire comic page.
+- Ensure equal spacing on all sides (top, bottom, left, right) for a professional appearance.
+- Ensure all text is correctly encoded and displayed clearly.
+- Text should be clear, sharp, and properly rendered in both speech bubbles and titles.
+- Character Consistency: Use the first provided images (previous pages) as the definitive source for character appearances. These may also include user-provided reference images for maintaining character, prop, or item consistency. Carry over the exact facial features, hair styles, and identical clothing/outfits.""",
+    variable="""- All dialogue and titles MUST be in {target_lang}.
+- The comic title should use a {comic_style}-style font that matches the overall comic aesthetic.
+- Use fonts that properly support {target_lang} characters."""
+)
+
+register_template(
+    'page_content',
+    static="""Convert the storyline in each panel of the reference image into corresponding comic content, following the requirements above.""",
+    variable="""Style: {comic_style}. All text in the comic, including titles and speech bubbles, MUST be in {target_lang}.
+
+# Content:
+
+## Title
+{title}
+
+## Panels
+{panels}"""
+)
+
+register_template(
+    'cover',
+    static="""Create a high-quality comic book cover.
+
+# Important Context:
+- The reference images provided show the story pages of this comic.
+- You MUST base the cover on the characters, scenes, and storyline shown in these reference images.
+- The cover should capture the essence and key moments from the story pages.
+- Use the same characters, props, and items with consistent appearances as shown in the reference images.
+
+# Requirements:
+- The image must be a vertical comic book cover composition.
+- The art style must strictly follow the style given under Style and Language.
+- Make it eye-catching and dramatic while staying true to the story.
+- Feature the main characters and key scenes from the reference story pages.
+- High resolution, detailed, and professional quality.
+- No other text except the title.
+- Clear and sharp text for the title, do not repeat all the titles in reference images.
+- Vibrant colors and "Cover Art" aesthetic.
+- Only present one row one panel in the cover.
+- Ensure all characters in the title are correctly rendered and legible.
+- The cover should feel like a natural introduction to the story shown in the reference pages.""",
+    variable="""# Style and Language:
+- Art style: {comic_style}.
+- The title text must be in {target_lang}.
+{custom_section}"""
+)
+
+# Static negative prompt for page images
+PAGE_NEGATIVE_PROMPT = "overly complex panels, complex panel content, inconsistent characters, distorted proportions, dull colors, panel indices visible, panel numbers shown, cluttered dialogue, verbose dialogue, illegible text, misspelled words, duplicated titles, multiple title locations, uneven margins, mismatched fonts, text corruption, mojibake, garbled characters, blurry text, character appearance changes, incorrect clothing, clothing changes without script requirement, layout deviation from sketch, costume changes"
+
+
+# Static instructions shared by every page image of every comic, sent as a
+# provider-side cached context when explicit context caching is enabled
+PAGE_INSTRUCTIONS = f"""# Requirements:
+{TEMPLATES['page_requirements'].static}
+
+# Avoid:
+{PAGE_NEGATIVE_PROMPT}"""
+
+COVER_INSTRUCTIONS = TEMPLATES['cover'].static
+
+
+_usage_lock = threading.Lock()
+_usage_totals: Dict[str, Dict[str, int]] = {}
+
+
+def prompt_token_usage(response: Any) -> Optional[Tuple[int, int]]:
+    """
+    Extract (cached_tokens, prompt_tokens) from a provider response
+
+    Understands Gemini responses (``usage_metadata``), OpenAI responses and
+    stream chunks (``usage``) and LangChain messages (``usage_metadata``
+    dicts). Returns None when the response carries no usage.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if isinstance(usage, dict):
+        details = usage.get('input_token_details') or {}
+        return details.get('cache_read') or 0, usage.get('input_tokens') or 0
+    if usage is not None:
+        return usage.cached_content_token_count or 0, usage.prompt_token_count or 0
+
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', 0) if details is not None else 0
+        return cached or 0, usage.prompt_tokens or 0
+    return None
+
+
+def log_prompt_cache_usage(label: str, response: Any):
+    """Log and accumulate how many prompt tokens the provider served from its prefix cache"""
+    usage = prompt_token_usage(response)
+    if usage is None:
+        return
+    cached, prompt_tokens = usage
+    with _usage_lock:
+        totals = _usage_totals.setdefault(label, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached
+    logger.info(f"{label}: {cached}/{prompt_tokens} prompt tokens served from provider cache")
+
+
+def prompt_cache_stats() -> Dict[str, Dict[str, int]]:
+    with _usage_lock:
+        return {label: dict(totals) for label, totals in _usage_totals.items()}
@@ -0,0 +1,229 @@
+"""Reference image selection strategies for page and cover generation"""
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from comic_generator import REFERENCE_REQUEST_MAX_BYTES, load_reference_image
+from core.memory_budget import MemoryBudget
+
+logger = logging.getLogger(__name__)
+
+# Hard caps applied after every strategy
+DEFAULT_MAX_REFERENCES = int(os.getenv('REFERENCE_MAX_COUNT', 8))
+DEFAULT_MAX_REFERENCE_BYTES = int(os.getenv('REFERENCE_MAX_TOTAL_BYTES', 16 * 1024 * 1024))
+
+# Priorities: higher survives the caps first
+PRIORITY_PINNED = 40
+PRIORITY_ANCHOR = 30
+PRIORITY_FIRST_PAGE = 20
+PRIORITY_RECENT_PAGE = 10
+# Recency bonus of the newest page; older pages get one less each, down to 0
+RECENCY_STEPS = 9
+
+
+def _page_url(item: Any) -> Optional[str]:
+    if isinstance(item, dict) and 'imageUrl' in item:
+        return item['imageUrl']
+    if isinstance(item, str):
+        return item
+    return None
+
+
+def _split_references(extra_body: List[Any]) -> Tuple[List[str], List[str]]:
+    """
+    Split raw references into anchors and generated pages
+
+    Plain strings are user-supplied references (uploaded character sheets,
+    cover art); dicts with ``imageUrl`` are previously generated pages and
+    are ordered by ``pageIndex`` when present.
+    """
+    anchors = []
+    pages = []
+    for position, item in enumerate(extra_body):
+        if isinstance(item, dict) and 'imageUrl' in item:
+            pages.append((item.get('pageIndex', position), position, item['imageUrl']))
+        elif isinstance(item, str):
+            anchors.append(item)
+    pages.sort(key=lambda page: (page[0], page[1]))
+    return anchors, [url for _, _, url in pages]
+
+
+def _recent_pages(pages: List[str], k: int) -> List[Tuple[str, int]]:
+    # More recent pages get a slightly higher priority than older ones, but
+    # stay below the first page however long the comic gets
+    recent = pages[max(0, len(pages) - k):]
+    return [
+        (url, PRIORITY_RECENT_PAGE + max(0, RECENCY_STEPS - age))
+        for age, url in zip(range(len(recent) - 1, -1, -1), recent)
+    ]
+
+
+def _strategy_all(anchors, pages, options):
+    """Every reference, the historical behaviour"""
+    selected = [(url, PRIORITY_ANCHOR) for url in anchors]
+    if pages:
+        selected.append((pages[0], PRIORITY_FIRST_PAGE))
+        selected.extend(_recent_pages(pages[1:], len(pages)))
+    return selected
+
+
+def _strategy_recent(anchors, pages, options):
+    """Anchors plus the last K pages"""
+    k = int(options.get('k', 3))
+    return [(url, PRIORITY_ANCHOR) for url in anchors] + _recent_pages(pages, k)
+
+
+def _strategy_first_and_recent(anchors, pages, options):
+    """Anchors, the first page and the last K pages"""
+    k = int(options.get('k', 2))
+    selected = [(url, PRIORITY_ANCHOR) for url in anchors]
+    if pages:
+        selected.append((pages[0], PRIORITY_FIRST_PAGE))
+        selected.extend(_recent_pages(pages[1:], k))
+    return selected
+
+
+def _strategy_anchor_and_last(anchors, pages, options):
+    """Character sheet / cover anchors plus the last page (first page if no anchors)"""
+    selected = [(url, PRIORITY_ANCHOR) for url in anchors]
+    if pages:
+        if not anchors and len(pages) > 1:
+            selected.append((pages[0], PRIORITY_FIRST_PAGE))
+        selected.append((pages[-1], PRIORITY_RECENT_PAGE))
+    return selected
+
+
+def _strategy_pinned(anchors, pages, options):
+    """Only user-pinned references plus the last page"""
+    pinned = [url for url in (_page_url(item) for item in options.get('pinned', [])) if url]
+    selected = [(url, PRIORITY_PINNED) for url in pinned]
+    if pages and pages[-1] not in pinned:
+        selected.append((pages[-1], PRIORITY_RECENT_PAGE))
+    return selected
+
+
+REFERENCE_STRATEGIES: Dict[str, Callable[[List[str], List[str], Dict[str, Any]], List[Tuple[str, int]]]] = {
+    'all': _strategy_all,
+    'recent': _strategy_recent,
+    'first_and_recent': _strategy_first_and_recent,
+    'anchor_and_last': _strategy_anchor_and_last,
+    'pinned': _strategy_pinned,
+}
+
+
+def validate_strategy(strategy: Optional[Union[str, Dict[str, Any]]]) -> Optional[str]:
+    """Return an error message if ``strategy`` is not a usable strategy spec"""
+    if strategy is None:
+        return None
+    if isinstance(strategy, dict):
+        name = strategy.get('name', 'all')
+    elif isinstance(strategy, str):
+        name = strategy
+    else:
+        return "Reference strategy must be a name or an object"
+    if name not in REFERENCE_STRATEGIES:
+        return f"Unknown reference strategy: {name}. Available: {', '.join(REFERENCE_STRATEGIES)}"
+    return None
+
+
+def _reference_size(url: str) -> int:
+    """Size in bytes of the prepared (uploaded) reference; loads through the cache"""
+    try:
+        # Preparing one reference must fit the per-request ceiling on its own
+        part = load_reference_image(url, MemoryBudget(REFERENCE_REQUEST_MAX_BYTES))
+    except Exception as e:
+        logger.warning(f"Could not size reference image {url[:50]}...: {e}")
+        return 0
+    return len(part.inline_data.data) if part is not None else 0
+
+
+def stable_reference_count(references: Optional[List[Any]], selected: List[str]) -> int:
+    """
+    Count the leading selected references that stay the same across a comic
+
+    Anchors (user-supplied strings) and the comic's first page (pageIndex 0)
+    do not change from page to page and lead the upload order, so they can
+    live in a provider context cache; the references after them vary.
+
+    Args:
+        references: Raw references passed to ``select_references``
+        selected: Its result
+
+    Returns:
+        Number of stable references at the start of ``selected``
+    """
+    stable = set()
+    for item in references or []:
+        if isinstance(item, str):
+            stable.add(item)
+        elif isinstance(item, dict) and item.get('pageIndex') == 0 and 'imageUrl' in item:
+            stable.add(item['imageUrl'])
+    count = 0
+    for url in selected:
+        if url not in stable:
+            break
+        count += 1
+    return count
+
+
+def select_references(
+    references: Optional[List[Any]],
+    strategy: Optional[Union[str, Dict[str, Any]]] = None
+) -> List[str]:
+    """
+    Choose which reference images to upload for one generation call
+
+    Args:
+        references: Raw references: user-supplied strings and/or generated
+            page dicts ({"pageIndex", "imageUrl", ...})
+        strategy: Strategy name or {"name", "k", "pinned", "max_refs",
+            "max_bytes"}; defaults to 'all'
+
+    Returns:
+        Reference URLs in upload order, within the count and byte caps
+    """
+    options: Dict[str, Any] = {}
+    if isinstance(strategy, dict):
+        options = strategy
+        name = strategy.get('name', 'all')
+    else:
+        name = strategy or 'all'
+
+    error = validate_strategy(strategy)
+    if error:
+        raise ValueError(error)
+
+    anchors, pages = _split_references(references or [])
+    candidates = REFERENCE_STRATEGIES[name](anchors, pages, options)
+
+    # Deduplicate, keeping the first (highest placed) occurrence
+    seen = set()
+    ordered = []
+    for url, priority in candidates:
+        if url not in seen:
+            seen.add(url)
+            ordered.append((url, priority))
+
+    max_refs = min(int(options.get('max_refs', DEFAULT_MAX_REFERENCES)), DEFAULT_MAX_REFERENCES)
+    max_bytes = min(int(options.get('max_bytes', DEFAULT_MAX_REFERENCE_BYTES)), DEFAULT_MAX_REFERENCE_BYTES)
+
+    # Keep the highest-priority references that fit both caps, then restore upload order
+    kept = set()
+    total_bytes = 0
+    by_priority = sorted(range(len(ordered)), key=lambda i: ordered[i][1], reverse=True)
+    for index in by_priority:
+        if len(kept) >= max_refs:
+            break
+        size = _reference_size(ordered[index][0])
+        if total_bytes + size > max_bytes:
+            continue
+        kept.add(index)
+        total_bytes += size
+
+    selected = [url for i, (url, _) in enumerate(ordered) if i in kept]
+    if len(selected) < len(ordered):
+        logger.info(
+            f"Reference strategy '{name}' kept {len(selected)}/{len(ordered)} references "
+            f"({total_bytes} bytes)"
+        )
+    return selected
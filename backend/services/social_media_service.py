@@ -1,10 +1,11 @@
 """Social media content generation service"""
 import json
 from typing import List, Dict, Any
-from openai import OpenAI
-from google import genai
 from google.genai import types
 
+from core.client_registry import client_registry
+from core.scheduler import provider_scheduler
+
 
 class SocialMediaService:
     """Social media content generator for Xiaohongshu and Twitter using OpenAI or Google"""
@@ -14,10 +15,6 @@ class SocialMediaService:
         self.base_url = base_url
         self.model = model
         self.google_api_key = google_api_key
-        if api_key:
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.client = None
     
     def generate_social_content(self, comic_data: List[Dict], platform: str = 'xiaohongshu') -> Dict[str, Any]:
         """
@@ -101,28 +98,31 @@ Create a viral tweet that captures the FEELING and makes people say "this is so
 
 写出让人"太懂了！"的文案，要有你的态度和感悟！"""
 
-        if self.client:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=1000
-            )
+        if self.api_key:
+            with client_registry.lease_openai_client(self.api_key, self.base_url) as client, \
+                    provider_scheduler.slot(self.api_key, model=self.model):
+                response = client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.8,
+                    max_tokens=1000
+                )
             generated_text = response.choices[0].message.content.strip()
         else:
             # Fallback to Google Gemini
-            client = genai.Client(api_key=self.google_api_key)
-            response = client.models.generate_content(
-                model="gemini-3-flash-preview",
-                contents=[system_prompt, user_prompt],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    thinking_config=types.ThinkingConfig(thinking_level="low")
+            with client_registry.lease_genai_client(self.google_api_key) as client, \
+                    provider_scheduler.slot(self.google_api_key, model="gemini-3-flash-preview"):
+                response = client.models.generate_content(
+                    model="gemini-3-flash-preview",
+                    contents=[system_prompt, user_prompt],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        thinking_config=types.ThinkingConfig(thinking_level="low")
+                    )
                 )
-            )
             generated_text = response.text
         
         # Extract JSON from markdown code blocks if present
@@ -0,0 +1,72 @@
+"""Provider context cache: one cache per comic keyed on its stable references"""
+from google.genai import types
+
+from core.context_cache import ContextCacheManager
+from services.reference_selection import stable_reference_count
+
+
+class _FakeCaches:
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    def create(self, model, config):
+        name = f"cachedContents/{len(self.created)}"
+        self.created.append((name, len(config.contents[0].parts) if config.contents else 0))
+        return type('Cached', (), {'name': name})()
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class _FakeClient:
+    def __init__(self):
+        self.caches = _FakeCaches()
+
+
+def _part(tag: str) -> types.Part:
+    return types.Part.from_bytes(data=tag.encode('utf-8'), mime_type='image/png')
+
+
+def _pages(index: int, window: int = 6):
+    """Pipeline references of page ``index``: page 0 plus the sliding window"""
+    previous = [0] + list(range(max(1, index - window + 1), index)) if index else []
+    return [{"pageIndex": i, "imageUrl": f"page-{i}"} for i in previous]
+
+
+def test_long_comic_reuses_one_cache_as_the_window_slides():
+    manager = ContextCacheManager(enabled=True, reference_count=2)
+    client = _FakeClient()
+    names = []
+    for index in range(1, 15):
+        references = ["anchor"] + _pages(index)
+        selected = ["anchor"] + [page["imageUrl"] for page in _pages(index)]
+        stable = min(stable_reference_count(references, selected), manager.reference_count)
+        parts = [_part(url) for url in selected]
+        names.append(manager.get_or_create(client, 'key', 'comic', 'model', 'instructions', parts[:stable]))
+
+    assert client.caches.created == [("cachedContents/0", 2)]
+    assert set(names) == {"cachedContents/0"}
+    assert manager.stats()["reused"] == 13
+
+
+def test_cache_is_replaced_once_when_the_first_page_appears():
+    manager = ContextCacheManager(enabled=True, reference_count=2)
+    client = _FakeClient()
+    anchor, first = _part("anchor"), _part("page-0")
+
+    assert manager.get_or_create(client, 'key', 'comic', 'model', 'instructions', [anchor]) == "cachedContents/0"
+    assert manager.get_or_create(client, 'key', 'comic', 'model', 'instructions', [anchor, first]) == "cachedContents/1"
+    assert client.caches.deleted == ["cachedContents/0"]
+    # A request without the cached prefix goes inline instead of creating another cache
+    assert manager.get_or_create(client, 'key', 'comic', 'model', 'instructions', [_part("other")]) is None
+    assert manager.get_or_create(client, 'key', 'comic', 'model', 'instructions', [anchor]) is None
+    assert len(client.caches.created) == 2
+
+
+def test_stable_reference_count_stops_at_the_first_varying_reference():
+    references = ["sheet", {"pageIndex": 0, "imageUrl": "p0"}, {"pageIndex": 4, "imageUrl": "p4"}]
+    assert stable_reference_count(references, ["sheet", "p0", "p4"]) == 2
+    assert stable_reference_count(references, ["p4", "sheet"]) == 0
+    # Without page 0 in the selection only the anchors are stable
+    assert stable_reference_count(references, ["sheet", "p4"]) == 1
@@ -0,0 +1,93 @@
+"""Hedged calls: delay and latency are measured from when the call is in flight"""
+import asyncio
+import threading
+import time
+
+from core.hedging import Hedger
+from core.scheduler import ProviderScheduler
+
+
+def _hedger(**overrides) -> Hedger:
+    settings = dict(enabled=True, min_samples=1, min_delay=0.1, budget_burst=5, max_workers=4)
+    settings.update(overrides)
+    hedger = Hedger(**settings)
+    hedger._tracker('image').record(0.1)
+    return hedger
+
+
+def _congested_scheduler():
+    """A one-slot scheduler whose slot is held until the returned event is set"""
+    scheduler = ProviderScheduler(max_concurrency=1, key_concurrency=1, rate=0, max_wait=10)
+    acquired, release = threading.Event(), threading.Event()
+
+    def holder():
+        with scheduler.slot('key'):
+            acquired.set()
+            release.wait()
+
+    threading.Thread(target=holder, daemon=True).start()
+    acquired.wait()
+    return scheduler, release
+
+
+def test_queueing_for_a_slot_does_not_trigger_a_hedge():
+    hedger = _hedger()
+    scheduler, release = _congested_scheduler()
+    threading.Timer(0.4, release.set).start()
+
+    def call():
+        time.sleep(0.05)
+        return 'ok'
+
+    assert hedger.run('image', 'key', call, slot=lambda: scheduler.slot('key')) == 'ok'
+    stats = hedger.stats()
+    assert stats['hedged'] == 0
+    # The 0.4s wait for the slot is not recorded as provider latency
+    assert max(hedger._tracker('image')._samples) < 0.3
+
+
+def test_slow_call_in_flight_is_hedged_and_the_backup_wins():
+    hedger = _hedger()
+    calls = []
+
+    def call():
+        calls.append(None)
+        time.sleep(1.0 if len(calls) == 1 else 0.05)
+        return len(calls)
+
+    assert hedger.run('image', 'key', call) == 2
+    assert hedger.stats()['hedge_wins'] == 1
+
+
+def test_failure_to_take_the_slot_is_raised_without_hanging():
+    hedger = _hedger()
+
+    class Refusing:
+        def __enter__(self):
+            raise RuntimeError("no slot")
+
+        def __exit__(self, *exc):
+            return False
+
+    try:
+        hedger.run('image', 'key', lambda: 'never', slot=Refusing)
+    except RuntimeError as e:
+        assert str(e) == "no slot"
+    else:
+        raise AssertionError("slot failure was swallowed")
+
+
+def test_async_queueing_for_a_slot_does_not_trigger_a_hedge():
+    hedger = _hedger()
+    scheduler, release = _congested_scheduler()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return 'ok'
+
+    async def main():
+        threading.Timer(0.4, release.set).start()
+        return await hedger.run_async('image', 'key', call, slot=lambda: scheduler.aslot('key'))
+
+    assert asyncio.run(main()) == 'ok'
+    assert hedger.stats()['hedged'] == 0
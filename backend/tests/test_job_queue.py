@@ -0,0 +1,38 @@
+"""Background job queue: bounded pending jobs and expiry of finished ones"""
+import threading
+import time
+
+import pytest
+
+from core.job_queue import JobQueue, QueueFullError
+
+
+def _wait_finished(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished_at is not None
+
+
+def test_finished_jobs_expire_without_new_submissions():
+    queue = JobQueue(max_workers=1, job_ttl=0.05)
+    job = queue.submit('image', lambda: 'url')
+    _wait_finished(job)
+    assert queue.get(job.job_id) is job
+
+    time.sleep(0.1)
+    assert queue.stats()['tracked'] == 0
+    assert queue.get(job.job_id) is None
+
+
+def test_submissions_beyond_max_pending_are_refused():
+    queue = JobQueue(max_workers=1, max_pending=1)
+    release = threading.Event()
+    job = queue.submit('image', release.wait, 5)
+    try:
+        with pytest.raises(QueueFullError):
+            queue.submit('image', lambda: None)
+    finally:
+        release.set()
+    _wait_finished(job)
+    assert job.status == 'succeeded'
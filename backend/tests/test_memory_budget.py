@@ -0,0 +1,89 @@
+"""Per-request memory ceiling and the reference handling bounds bench.memory measures"""
+import base64
+
+import pytest
+
+from bench import memory as memory_bench
+from bench.fake_provider import noise_png
+from core.memory_budget import MemoryBudget, MemoryBudgetExceededError
+
+MB = memory_bench.MB
+
+
+def test_hold_rejects_allocations_over_the_limit():
+    budget = MemoryBudget(1000)
+    budget.reserve(600)
+    with pytest.raises(MemoryBudgetExceededError):
+        with budget.hold(500, "Decoded reference"):
+            pytest.fail("over-budget block must not run")
+    assert budget.used == 600
+    assert budget.remaining == 400
+
+
+def test_hold_releases_its_charge_after_the_block():
+    budget = MemoryBudget(1000)
+    with pytest.raises(RuntimeError):
+        with budget.hold(800):
+            assert budget.used == 800
+            raise RuntimeError("decode failed")
+    assert budget.used == 0
+    assert budget.peak == 800
+    with budget.hold(1000):
+        pass
+
+
+def test_check_does_not_charge_and_unlimited_budget_only_tracks():
+    budget = MemoryBudget(1000)
+    budget.check(1000)
+    assert budget.used == 0
+    with pytest.raises(MemoryBudgetExceededError):
+        budget.check(1001)
+
+    unlimited = MemoryBudget(0)
+    unlimited.reserve(10 * MB)
+    assert unlimited.remaining is None
+    assert unlimited.stats() == {"used": 10 * MB, "peak": 10 * MB, "limit": 0}
+
+
+@pytest.fixture(scope='module')
+def comic_generator(tmp_path_factory):
+    # Singletons read their settings at import
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in memory_bench.environment(str(tmp_path_factory.mktemp('memory'))).items():
+            patch.setenv(name, value)
+        import comic_generator
+        yield comic_generator
+
+
+@pytest.fixture(scope='module')
+def reference_rows(comic_generator):
+    return memory_bench.measure([1, 2, 4], 512, 512, pages=2)
+
+
+def test_reference_overhead_is_flat_per_reference(reference_rows):
+    first = reference_rows[0]["overhead"]
+    for row in reference_rows[1:]:
+        assert row["overhead"] <= first * 1.25 + MB, row
+
+
+def test_released_request_retains_no_reference_memory(reference_rows):
+    for row in reference_rows:
+        assert row["held"] > 0
+        assert row["retained"] <= MB, row
+
+
+def test_reference_over_the_request_ceiling_is_skipped(comic_generator, monkeypatch):
+    data_url = "data:image/png;base64," + base64.b64encode(noise_png(256, 256, 0)).decode('ascii')
+    # The data URL check runs before decoding
+    with pytest.raises(MemoryBudgetExceededError):
+        comic_generator._read_reference_bytes(data_url, MemoryBudget(1000))
+
+    monkeypatch.setattr(comic_generator, 'REFERENCE_REQUEST_MAX_BYTES', 1000)
+    request, _ = comic_generator._prepare_image_request(
+        "Ceiling check", [data_url], 'test-key', None, True, None, None, False
+    )
+    try:
+        assert request.reference_parts == []
+        assert request.budget.used == 0
+    finally:
+        request.release()
@@ -0,0 +1,30 @@
+"""Reference strategies keep anchors and the first page ahead of recent pages"""
+import pytest
+
+from services import reference_selection
+from services.reference_selection import select_references
+
+
+@pytest.fixture(autouse=True)
+def unit_sizes(monkeypatch):
+    # Every reference weighs one byte; no image is loaded
+    monkeypatch.setattr(reference_selection, '_reference_size', lambda url: 1)
+
+
+def _comic(pages: int):
+    return ["sheet"] + [{"pageIndex": i, "imageUrl": f"p{i}"} for i in range(pages)]
+
+
+def test_long_comic_keeps_anchor_and_first_page_under_the_count_cap():
+    selected = select_references(_comic(40), {"name": "all", "max_refs": 4})
+    assert selected == ["sheet", "p0", "p38", "p39"]
+
+
+def test_pinned_references_outrank_recent_pages_of_a_long_comic():
+    strategy = {"name": "pinned", "pinned": ["p3", "p7"], "max_refs": 2}
+    assert select_references(_comic(40), strategy) == ["p3", "p7"]
+
+
+def test_newer_pages_win_within_the_recent_tier():
+    selected = select_references(_comic(12), {"name": "recent", "k": 12, "max_refs": 3})
+    assert selected == ["sheet", "p10", "p11"]
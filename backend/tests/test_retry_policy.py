@@ -0,0 +1,140 @@
+"""Error classification, circuit breaker states and retry policy bookkeeping"""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from google.genai import errors as genai_errors
+
+from core.retry_policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    NonRetryableError,
+    RetryPolicy,
+    classify_error,
+)
+from core.scheduler import RateLimitedError
+
+
+def _genai_error(code: int, retry_delay: str = None) -> genai_errors.APIError:
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}] if retry_delay else []
+    body = {"error": {"code": code, "message": "failed", "status": "ERROR", "details": details}}
+    return genai_errors.ClientError(code, body) if code < 500 else genai_errors.ServerError(code, body)
+
+
+def _openai_error(code: int, retry_after: str = None) -> openai.APIStatusError:
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(code, headers=headers, request=httpx.Request("POST", "http://provider"))
+    return openai.APIStatusError("failed", response=response, body=None)
+
+
+@pytest.mark.parametrize("error, retryable, retry_after, provider_fault", [
+    (_genai_error(429, "12s"), True, 12.0, True),
+    (_genai_error(503), True, None, True),
+    (_genai_error(400), False, None, False),
+    (_genai_error(403), False, None, True),
+    (_openai_error(429, "7"), True, 7.0, True),
+    (_openai_error(401), False, None, True),
+    (_openai_error(422), False, None, False),
+    (httpx.ConnectError("refused"), True, None, True),
+    (TimeoutError(), True, None, True),
+    (ValueError("bad prompt"), False, None, False),
+    (NonRetryableError("blocked"), False, None, False),
+    (RateLimitedError("queued too long", 3.0), False, 3.0, False),
+    (CircuitOpenError("open", 9.0), False, 9.0, False),
+])
+def test_classify_error(error, retryable, retry_after, provider_fault):
+    decision = classify_error(error)
+    assert decision.retryable is retryable
+    assert decision.retry_after == retry_after
+    assert decision.provider_fault is provider_fault
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    # Only one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_interrupted_trial_frees_the_half_open_slot():
+    breaker = _half_open_breaker()
+
+    def interrupted(remaining):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        RetryPolicy(max_attempts=3).run(interrupted, breaker=breaker)
+    # The next call is let through as a new trial
+    breaker.before_call()
+
+
+def test_cancelled_async_trial_frees_the_half_open_slot():
+    breaker = _half_open_breaker()
+
+    async def cancelled(remaining):
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(RetryPolicy(max_attempts=3).run_async(cancelled, breaker=breaker))
+    breaker.before_call()
+
+
+def test_retryable_failures_are_retried_and_count_for_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=5)
+    calls = []
+
+    def flaky(remaining):
+        calls.append(remaining)
+        if len(calls) < 3:
+            raise _genai_error(503)
+        return "ok"
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01)
+    assert policy.run(flaky, breaker=breaker) == "ok"
+    assert len(calls) == 3
+    assert breaker.stats()["consecutive_failures"] == 0
+
+
+def test_recovering_hook_retries_without_a_breaker_fault():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    calls = []
+
+    def stale_cache(remaining):
+        calls.append(None)
+        if len(calls) == 1:
+            raise _genai_error(404)
+        return "ok"
+
+    policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+    assert policy.run(stale_cache, breaker=breaker, on_error=lambda e: True) == "ok"
+    assert breaker.state == "closed"
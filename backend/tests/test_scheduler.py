@@ -0,0 +1,86 @@
+"""Provider scheduler: fair ordering, token buckets, deadlines and idle keys"""
+import threading
+import time
+
+import pytest
+
+from core.scheduler import ProviderScheduler, RateLimitedError
+
+
+def _hold(scheduler: ProviderScheduler, key: str):
+    """Occupy a slot for ``key`` until the returned event is set"""
+    acquired, release = threading.Event(), threading.Event()
+
+    def holder():
+        with scheduler.slot(key):
+            acquired.set()
+            release.wait(5)
+
+    threading.Thread(target=holder, daemon=True).start()
+    acquired.wait(5)
+    return release
+
+
+def test_waiting_keys_are_served_in_fair_order():
+    scheduler = ProviderScheduler(max_concurrency=1, key_concurrency=1, rate=0)
+    release = _hold(scheduler, 'holder')
+    order, threads = [], []
+
+    def call(key, name):
+        with scheduler.slot(key):
+            order.append(name)
+
+    # A long backlog of one key, then a single call of another
+    for key, name in (('comic', 'a1'), ('comic', 'a2'), ('comic', 'a3'), ('page', 'b1')):
+        queued = scheduler.stats()['queued']
+        thread = threading.Thread(target=call, args=(key, name))
+        thread.start()
+        threads.append(thread)
+        while scheduler.stats()['queued'] == queued:
+            time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_calls_beyond_the_burst_wait_for_a_token():
+    scheduler = ProviderScheduler(rate=10, burst=1)
+    started = time.monotonic()
+    with scheduler.slot('key'):
+        pass
+    assert time.monotonic() - started < 0.05
+    with scheduler.slot('key'):
+        pass
+    assert time.monotonic() - started >= 0.08
+
+
+def test_call_waiting_past_max_wait_is_rejected_unless_patient():
+    scheduler = ProviderScheduler(key_concurrency=1, rate=0, max_wait=0.1)
+    release = _hold(scheduler, 'key')
+    started = time.monotonic()
+    with pytest.raises(RateLimitedError) as error:
+        with scheduler.slot('key'):
+            pass
+    assert 0.08 <= time.monotonic() - started < 1.0
+    assert error.value.retry_after >= 1.0
+    assert scheduler.stats()['queued'] == 0
+
+    threading.Timer(0.3, release.set).start()
+    with scheduler.patient(), scheduler.slot('key'):
+        pass
+
+
+def test_idle_keys_are_pruned_but_weighted_and_busy_ones_kept():
+    scheduler = ProviderScheduler(rate=1000, burst=1, prune_interval=0)
+    for key in ('one', 'two'):
+        with scheduler.slot(key):
+            pass
+    scheduler.set_weight('weighted', 2.0)
+    release = _hold(scheduler, 'busy')
+    time.sleep(0.01)
+    try:
+        assert len(scheduler.stats()['keys']) == 2
+    finally:
+        release.set()
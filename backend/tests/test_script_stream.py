@@ -0,0 +1,137 @@
+"""Streamed comic scripts: incremental page parsing and read-ahead of the provider stream"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from core.stream_buffer import StreamBufferTimeoutError, adrain_stream, drain_stream
+from services.comic_service import ComicScriptStreamParser
+
+
+def _page(title: str, text: str = "A panel") -> dict:
+    return {"title": title, "rows": [{"height": "180px", "panels": [{"text": text}]}]}
+
+
+def _feed(chunks):
+    parser = ComicScriptStreamParser()
+    return parser, [page for chunk in chunks for page in parser.feed(chunk)]
+
+
+def test_pages_split_across_chunks_are_emitted_when_complete():
+    text = json.dumps({"pages": [_page("One"), _page("Two")]})
+    parser = ComicScriptStreamParser()
+    emitted = []
+    for i in range(0, len(text), 7):
+        emitted.append(parser.feed(text[i:i + 7]))
+    pages = [page for batch in emitted for page in batch]
+    assert [page["title"] for page in pages] == ["One", "Two"]
+    # The first page arrives before the stream ends
+    assert emitted.index([pages[0]]) < len(emitted) - 1
+
+
+def test_split_strings_escapes_and_braces_inside_strings():
+    page = _page('Say "hi" {not a page}', 'Back\\slash ] and [brackets] and \\"quotes\\"')
+    text = json.dumps({"pages": [page]}, ensure_ascii=False)
+    # One character at a time splits every string and escape sequence
+    _, pages = _feed(list(text))
+    assert pages == [page]
+
+
+def test_bare_top_level_array_and_trailing_fields():
+    _, pages = _feed([json.dumps([_page("One")])])
+    assert [page["title"] for page in pages] == ["One"]
+
+    text = json.dumps({"pages": [_page("One")], "notes": {"pages": [_page("Ignored")]}})
+    _, pages = _feed([text])
+    assert [page["title"] for page in pages] == ["One"]
+
+
+def test_truncated_input_returns_only_complete_pages():
+    text = json.dumps({"pages": [_page("One"), _page("Two")]})
+    parser, pages = _feed([text[:text.index("Two") + 10]])
+    assert [page["title"] for page in pages] == ["One"]
+    assert parser.text.endswith(text[text.index("Two"):text.index("Two") + 10])
+
+
+def test_provider_is_released_before_a_slow_consumer_finishes():
+    released = threading.Event()
+
+    def provider():
+        try:
+            yield from ("a", "b", "c")
+        finally:
+            released.set()
+
+    chunks = drain_stream(provider(), max_chunks=8, timeout=5)
+    assert next(chunks) == "a"
+    # The consumer has not read "b" and "c" yet, but the provider is done
+    assert released.wait(2)
+    assert list(chunks) == ["b", "c"]
+
+
+def test_full_buffer_stops_the_provider_after_the_timeout():
+    released = threading.Event()
+
+    def provider():
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            released.set()
+
+    chunks = drain_stream(provider(), max_chunks=2, timeout=0.1)
+    assert next(chunks) == 0
+    assert released.wait(2)
+    with pytest.raises(StreamBufferTimeoutError):
+        list(chunks)
+
+
+def test_provider_errors_reach_the_consumer_after_buffered_chunks():
+    def provider():
+        yield "a"
+        raise ConnectionError("reset")
+
+    chunks = drain_stream(provider())
+    assert next(chunks) == "a"
+    with pytest.raises(ConnectionError):
+        next(chunks)
+
+
+def test_async_provider_is_released_before_a_slow_consumer_finishes():
+    async def main():
+        released = asyncio.Event()
+
+        async def provider():
+            try:
+                for chunk in ("a", "b", "c"):
+                    yield chunk
+            finally:
+                released.set()
+
+        chunks = adrain_stream(provider(), max_chunks=8, timeout=5)
+        first = await chunks.__anext__()
+        await asyncio.wait_for(released.wait(), 2)
+        return [first] + [chunk async for chunk in chunks]
+
+    assert asyncio.run(main()) == ["a", "b", "c"]
+
+
+def test_abandoned_async_consumer_cancels_the_provider():
+    async def main():
+        released = asyncio.Event()
+
+        async def provider():
+            try:
+                while True:
+                    yield "x"
+                    await asyncio.sleep(0.01)
+            finally:
+                released.set()
+
+        chunks = adrain_stream(provider(), max_chunks=4, timeout=5)
+        await chunks.__anext__()
+        await chunks.aclose()
+        await asyncio.wait_for(released.wait(), 2)
+
+    asyncio.run(main())
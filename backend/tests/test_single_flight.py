@@ -0,0 +1,109 @@
+"""Request coalescing, Idempotency-Key replay and conflicts"""
+import threading
+import time
+
+import pytest
+
+from core.memo_cache import MemoCache
+from core.single_flight import IdempotencyConflictError, RequestDeduplicator
+
+
+@pytest.fixture
+def deduplicator(tmp_path):
+    store = MemoCache(name='idempotency-test', path=str(tmp_path / 'idempotency.sqlite3'), ttl=60)
+    return RequestDeduplicator(store, accepted_ttl=0.2)
+
+
+def _slow(result, started=None, release=None, calls=None):
+    def compute():
+        if calls is not None:
+            calls.append(None)
+        if started is not None:
+            started.set()
+        if release is not None:
+            release.wait(5)
+        return result
+    return compute
+
+
+def _in_thread(fn):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, outcome
+
+
+def test_concurrent_identical_requests_share_one_computation(deduplicator):
+    started, release, calls = threading.Event(), threading.Event(), []
+    compute = _slow((200, {"ok": True}, {}), started, release, calls)
+    first, first_outcome = _in_thread(lambda: deduplicator.run('image', {"p": 1}, None, 'key', compute))
+    started.wait(5)
+    second, second_outcome = _in_thread(lambda: deduplicator.run('image', {"p": 1}, None, 'key', compute))
+    time.sleep(0.05)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(calls) == 1
+    assert first_outcome['result'] == second_outcome['result'] == (200, {"ok": True}, {})
+    assert deduplicator.stats()['shared'] == 1
+
+
+def test_idempotency_key_replays_the_stored_response(deduplicator):
+    calls = []
+    compute = _slow((200, {"url": "a.png"}, {}), calls=calls)
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'key', compute)
+    status, body, headers = deduplicator.run('image', {"p": 1}, 'idem-1', 'key', compute)
+
+    assert (status, body) == (200, {"url": "a.png"})
+    assert headers['Idempotent-Replayed'] == 'true'
+    assert len(calls) == 1
+    # Keys are scoped to the caller's API key
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'other-key', compute)
+    assert len(calls) == 2
+
+
+def test_reused_key_with_a_different_body_conflicts_after_completion(deduplicator):
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'key', _slow((200, {}, {})))
+    with pytest.raises(IdempotencyConflictError):
+        deduplicator.run('image', {"p": 2}, 'idem-1', 'key', _slow((200, {}, {})))
+
+
+def test_reused_key_with_a_different_body_conflicts_while_in_flight(deduplicator):
+    started, release, calls = threading.Event(), threading.Event(), []
+    first, outcome = _in_thread(lambda: deduplicator.run(
+        'image', {"p": 1}, 'idem-1', 'key', _slow((200, {"p": 1}, {}), started, release, calls)
+    ))
+    started.wait(5)
+    try:
+        with pytest.raises(IdempotencyConflictError):
+            deduplicator.run('image', {"p": 2}, 'idem-1', 'key', _slow((200, {"p": 2}, {}), calls=calls))
+    finally:
+        release.set()
+        first.join(5)
+    assert outcome['result'] == (200, {"p": 1}, {})
+    assert len(calls) == 1
+
+
+def test_failures_are_not_stored(deduplicator):
+    calls = []
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'key', _slow((500, {"error": "x"}, {}), calls=calls))
+    assert deduplicator.run('image', {"p": 1}, 'idem-1', 'key', _slow((200, {}, {}), calls=calls))[0] == 200
+    assert len(calls) == 2
+
+
+def test_accepted_job_response_is_replayed_only_while_the_job_is_kept(deduplicator):
+    calls = []
+    compute = _slow((202, {"job_id": "j1"}, {}), calls=calls)
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'key', compute)
+    assert deduplicator.run('image', {"p": 1}, 'idem-1', 'key', compute)[2].get('Idempotent-Replayed') == 'true'
+    time.sleep(0.25)
+    deduplicator.run('image', {"p": 1}, 'idem-1', 'key', compute)
+    assert len(calls) == 2
@@ -0,0 +1,61 @@
+"""Size-bounded SQLite LRU shared by the script memo cache and the image result cache"""
+import sqlite3
+
+from core.memo_cache import MemoCache
+from core.result_cache import ImageResultCache
+from core.sqlite_lru import SqliteLRU
+
+
+def _table(tmp_path, max_bytes=30, touch_interval=3600.0) -> SqliteLRU:
+    return SqliteLRU(str(tmp_path / 'lru.sqlite3'), 'entries', {"value": "TEXT NOT NULL"},
+                     max_bytes=max_bytes, ttl=60, touch_interval=touch_interval)
+
+
+def _keys(table: SqliteLRU):
+    with sqlite3.connect(table.path) as conn:
+        return {row[0] for row in conn.execute(f"SELECT cache_key FROM {table.table}")}
+
+
+def test_batched_hits_decide_which_rows_are_evicted(tmp_path):
+    table = _table(tmp_path)
+    for key in ('a', 'b', 'c'):
+        table.put(key, {"value": key}, 10)
+    # The hit on 'a' is only in memory until eviction flushes it
+    table.touch('a')
+    assert table.put('d', {"value": 'd'}, 10) == ['b']
+    assert _keys(table) == {'a', 'c', 'd'}
+
+
+def test_hits_are_not_written_one_by_one(tmp_path):
+    table = _table(tmp_path)
+    table.put('a', {"value": 'a'}, 1)
+    before = table.get('a', ('last_access',))[1][0]
+    table.touch('a')
+    assert table.get('a', ('last_access',))[1][0] == before
+    table.flush()
+    assert table.get('a', ('last_access',))[1][0] > before
+
+
+def test_memo_cache_migrates_tables_without_size_columns(tmp_path):
+    path = tmp_path / 'memo.sqlite3'
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE memo (cache_key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+        conn.execute("INSERT INTO memo VALUES ('old', '\"legacy\"', strftime('%s','now'))")
+    cache = MemoCache('test', str(path), ttl=60, max_bytes=1000)
+    assert cache.get('old') == 'legacy'
+    cache.put('new', 'x' * 2000)
+    # Over budget: the least recently used rows go, the memory tier follows
+    assert cache.get('old') is None
+
+
+def test_result_cache_eviction_keeps_the_image_files(tmp_path):
+    cache = ImageResultCache(str(tmp_path / 'results.sqlite3'), max_bytes=150, enabled=True)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'{i}.png'
+        path.write_bytes(b'x' * 100)
+        paths.append(path)
+        cache.put(f'key{i}', f'/img/{i}.png', str(path), 100)
+    assert cache.get('key0') is None
+    assert cache.get('key2') == '/img/2.png'
+    assert all(path.exists() for path in paths)